@@ -0,0 +1,402 @@
+"""Benchmarks of the hot paths of the bot, run from the bot folder
+
+    python benchmark.py
+    python benchmark.py --only bank,mod --quick
+
+Each run is saved in data/red/benchmarks/ with the commit it ran on and
+compared to the previous run, or to --compare. Benchmarks slower than
+before by more than --threshold are flagged as regressions and make the
+script exit with code 1.
+
+The benchmarks of cogs run Red offline (see offline.py) in an empty
+temporary folder, so that runs on different commits are comparable."""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+from offline import ROOT, handle, offline_bot, scratch_folder, stop_bot
+
+RESULTS_PATH = os.path.join(ROOT, "data", "red", "benchmarks")
+
+SIZES = ((1000, "1k"), (10000, "10k"), (100000, "100k"))
+GROUPS = ("dataio", "encoding", "pagify", "bank", "mod", "customcom",
+          "settings")
+
+
+def synthetic_bank(accounts=100000, servers=10, server_ids=None):
+    """Bank data shaped like data/economy/bank.json"""
+    rnd = random.Random(0)
+    if server_ids is None:
+        server_ids = [str(100000000000000000 + n) for n in range(servers)]
+    bank = {}
+    for n in range(accounts):
+        server = server_ids[n % len(server_ids)]
+        user = str(200000000000000000 + n)
+        bank.setdefault(server, {})[user] = {
+            "name": "Membre #{}".format(n),
+            "balance": rnd.randint(0, 10 ** 6),
+            "created_at": "2017-01-01 12:00:00"
+        }
+    return bank
+
+
+def measure(func, *, repeat=5, number=1):
+    """Best time of one call of func, out of repeat rounds of number calls"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Results:
+    def __init__(self):
+        self.benchmarks = {}  # name: {"seconds": best time, ...}
+
+    def add(self, name, seconds, **info):
+        self.benchmarks[name] = dict(info, seconds=seconds)
+        print("{:<44} {:>12}".format(name, _duration(seconds)))
+
+
+class OfflineBot:
+    """Red started on FakeDiscord the first time a benchmark needs it"""
+
+    def __init__(self):
+        self.bot = None
+        self.fake = None
+
+    def start(self):
+        if self.bot is None:
+            self.bot, self.fake = offline_bot(servers=2, members=20, cogs=[])
+        return self.bot, self.fake
+
+    def stop(self):
+        if self.bot is not None:
+            from cogs.utils.dataIO import dataIO
+            dataIO.flush()
+            stop_bot(self.bot)
+
+    def reload(self, cog):
+        self.bot.unload_extension("cogs." + cog)
+        self.bot.load_extension("cogs." + cog)
+
+    def member(self, n=0):
+        server = self.bot.servers[0]
+        return [m for m in server.members if not m.bot][n]
+
+    def message(self, content, n=0):
+        server = self.bot.servers[0]
+        channel = sorted(server.channels, key=lambda c: c.position)[0]
+        return self.fake.message(channel.id, self.member(n).id, content)
+
+    def command(self, content):
+        """Seconds taken to handle a command sent in the first channel"""
+        server = self.bot.servers[0]
+        channel = sorted(server.channels, key=lambda c: c.position)[0]
+        content = self.bot.settings.prefixes[0] + content
+        return self.bot.loop.run_until_complete(
+            handle(self.fake, channel.id, self.member().id, content))
+
+
+def bench_dataio(results, sizes):
+    from cogs.utils.dataIO import dataIO
+    os.makedirs("data/benchmark", exist_ok=True)
+    for accounts, label in sizes:
+        path = "data/benchmark/bank-{}.json".format(label)
+        bank = synthetic_bank(accounts)
+        results.add("dataio.save_json[{}]".format(label),
+                    measure(lambda: dataIO.save_json(path, bank), repeat=3),
+                    bytes=os.path.getsize(path))
+        key = dataIO._key(path)
+
+        def load():
+            dataIO._forget(key)  # Read from the disk, not the cache
+            dataIO.load_json(path)
+
+        results.add("dataio.load_json[{}]".format(label),
+                    measure(load, repeat=3))
+
+        def check_then_load():
+            # As in the cogs' check_files: load_json takes the data
+            # is_valid_json has just parsed
+            dataIO.is_valid_json(path)
+            dataIO.load_json(path)
+
+        results.add("dataio.check_then_load[{}]".format(label),
+                    measure(check_then_load, number=10))
+
+
+def bench_encoding(results, sizes):
+    """Encode time and size of a synthetic bank with each json profile"""
+    from cogs.utils import dataIO as dataIO_module
+    from cogs.utils.dataIO import dataIO
+    accounts, label = sizes[-1]
+    bank = synthetic_bank(accounts)
+    encoders = [("pretty", lambda d: dataIO._dump_json(d, "pretty")),
+                ("compact-stdlib",
+                 lambda d: json.dumps(d, ensure_ascii=False,
+                                      separators=(',', ':')))]
+    if dataIO_module.ujson is not None:
+        encoders.append(("compact-ujson", dataIO_module.ujson.dumps))
+    if dataIO_module.orjson is not None:
+        encoders.append(("compact-orjson", dataIO_module.orjson.dumps))
+    for name, encoder in encoders:
+        out = encoder(bank)
+        size = len(out.encode("utf-8") if isinstance(out, str) else out)
+        results.add("json.encode[{},{}]".format(name, label),
+                    measure(lambda: encoder(bank), repeat=3), bytes=size)
+
+
+def bench_pagify(results, sizes):
+    from cogs.utils.chat_formatting import pagify
+    rnd = random.Random(0)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "@",
+             "consectetur", "`code`", "adipiscing", "elit"]
+    for lines, label in sizes[1:]:
+        text = "\n".join(" ".join(rnd.choice(words)
+                                  for _ in range(rnd.randint(1, 20)))
+                         for _ in range(lines))
+        results.add("pagify[{} lines]".format(label),
+                    measure(lambda: list(pagify(text, shorten_by=8)),
+                            repeat=3), bytes=len(text))
+
+
+def bench_settings(results, offline):
+    bot, _ = offline.start()
+    settings = bot.settings
+    default, custom = bot.servers[:2]
+    settings.set_server_prefixes(custom, ["?", "!!"])
+    content = settings.prefixes[0] + "ping"
+    for name, server in (("global", default), ("server", custom)):
+        results.add("settings.get_prefixes[{}]".format(name),
+                    measure(lambda: settings.get_prefixes(server),
+                            number=10000))
+        results.add("settings.match_prefix[{}]".format(name),
+                    measure(lambda: settings.match_prefix(server, content),
+                            number=10000))
+
+
+def bench_bank(results, offline, sizes):
+    from cogs.utils.dataIO import dataIO
+    bot, _ = offline.start()
+    server = bot.servers[0]
+    a, b = offline.member(0), offline.member(1)
+    os.makedirs("data/economy", exist_ok=True)
+    for accounts, label in sizes[1:]:
+        dataIO.flush()
+        bank = synthetic_bank(accounts, server_ids=[server.id])
+        for member in (a, b):
+            bank[server.id][member.id] = {"name": member.name,
+                                          "balance": 10 ** 9,
+                                          "created_at": "2017-01-01 12:00:00"}
+        dataIO.save_json("data/economy/bank.json", bank)
+        offline.reload("economy")
+        bank = bot.get_cog("Economy").bank
+        results.add("bank.deposit_credits[{}]".format(label),
+                    measure(lambda: bank.deposit_credits(a, 1), number=100))
+        results.add("bank.withdraw_credits[{}]".format(label),
+                    measure(lambda: bank.withdraw_credits(a, 1), number=100))
+        results.add("bank.transfer_credits[{}]".format(label),
+                    measure(lambda: bank.transfer_credits(a, b, 1),
+                            number=100))
+        results.add("bank.get_balance[{}]".format(label),
+                    measure(lambda: bank.get_balance(a), number=100))
+        results.add("economy.leaderboard[{}]".format(label),
+                    measure(lambda: offline.command("leaderboard"),
+                            repeat=3))
+        if accounts <= 10000:  # Deduplicates accounts in quadratic time
+            results.add("economy.leaderboard_global[{}]".format(label),
+                        measure(lambda: offline.command("leaderboard global"),
+                                repeat=1))
+    bot.unload_extension("cogs.economy")
+
+
+def bench_mod(results, offline, sizes):
+    from cogs.utils.wordfilter import WordFilter
+    bot, _ = offline.start()
+    offline.reload("mod")
+    mod = bot.get_cog("Mod")
+    server = bot.servers[0]
+    message = offline.message("salut tout le monde, quelqu'un a vu le "
+                              "dernier épisode ? c'était vraiment bien")
+    rnd = random.Random(0)
+    for words, label in sizes[:2]:
+        mod.filter[server.id] = ["".join(rnd.choice("abcdefghijklmnop")
+                                         for _ in range(rnd.randint(4, 10)))
+                                 for _ in range(words)]
+        mod.word_filters[server.id] = WordFilter(mod.filter[server.id])
+        results.add("mod.filter compile[{} words]".format(label),
+                    measure(lambda: WordFilter(mod.filter[server.id])
+                            .search(""), repeat=3))
+
+        async def check(n=100):
+            for _ in range(n):
+                await mod.check_filter(message)
+
+        results.add("mod.check_filter[{} words]".format(label),
+                    measure(lambda: bot.loop.run_until_complete(check()))
+                    / 100)
+    mod.filter.pop(server.id, None)
+    mod.word_filters.pop(server.id, None)
+    bot.unload_extension("cogs.mod")
+
+
+def bench_customcom(results, offline):
+    bot, _ = offline.start()
+    offline.reload("customcom")
+    cc = bot.get_cog("CustomCommands")
+    message = offline.message("!bienvenue")
+    command = ("Salut {author.name}, bienvenue sur {server.name} ! "
+               "Va lire {channel.mention} et dis bonjour à {author.mention}."
+               " {message.content} {author.nope} {author._private}")
+    results.add("customcom.format_cc",
+                measure(lambda: cc.format_cc(command, message), number=1000))
+    bot.unload_extension("cogs.customcom")
+
+
+def run(groups, quick):
+    sizes = SIZES[:2] if quick else SIZES
+    results = Results()
+    scratch = scratch_folder(copy_data=False)
+    offline = OfflineBot()
+    try:
+        if "dataio" in groups:
+            bench_dataio(results, sizes)
+        if "encoding" in groups:
+            bench_encoding(results, sizes)
+        if "pagify" in groups:
+            bench_pagify(results, sizes)
+        if "settings" in groups:
+            bench_settings(results, offline)
+        if "bank" in groups:
+            bench_bank(results, offline, sizes)
+        if "mod" in groups:
+            bench_mod(results, offline, sizes)
+        if "customcom" in groups:
+            bench_customcom(results, offline)
+    finally:
+        offline.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results.benchmarks
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def save(benchmarks):
+    os.makedirs(RESULTS_PATH, exist_ok=True)
+    commit = git_commit()
+    now = datetime.datetime.now()
+    data = {"commit": commit, "date": now.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(), "benchmarks": benchmarks}
+    filename = os.path.join(RESULTS_PATH, "{:%Y%m%d-%H%M%S}-{}.json".format(
+        now, commit or "nogit"))
+    with open(filename, encoding='utf-8', mode="w") as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    return filename
+
+
+def previous_run(exclude=None):
+    runs = sorted(glob.glob(os.path.join(RESULTS_PATH, "*.json")))
+    runs = [r for r in runs if r != exclude]
+    return runs[-1] if runs else None
+
+
+def compare(benchmarks, filename, threshold):
+    """Prints the change of each benchmark since the run saved in
+    filename, returns the names of the regressions"""
+    with open(filename, encoding='utf-8', mode="r") as f:
+        previous = json.load(f)
+    print("\nCompared to {} ({})".format(previous.get("commit") or "?",
+                                         os.path.basename(filename)))
+    regressions = []
+    for name, result in sorted(benchmarks.items()):
+        old = previous["benchmarks"].get(name)
+        if old is None or not old["seconds"]:
+            continue
+        change = result["seconds"] / old["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "faster"
+        print("{:<44} {:>12} {:>12} {:>+7.0%}  {}".format(
+            name, _duration(old["seconds"]), _duration(result["seconds"]),
+            change, flag))
+    return regressions
+
+
+def _duration(seconds):
+    if seconds < 1e-3:
+        return "{:.2f} µs".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.2f} ms".format(seconds * 1e3)
+    return "{:.2f} s".format(seconds)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Asimov - Benchmarks")
+    parser.add_argument("--only", help="Comma separated groups among " +
+                                       ", ".join(GROUPS))
+    parser.add_argument("--quick", action="store_true",
+                        help="Skips the largest sizes")
+    parser.add_argument("--compare", help="Results file to compare with, "
+                                          "the previous run by default")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown flagged as a regression (0.2 = 20%%)")
+    parser.add_argument("--no-save", action="store_true",
+                        help="Does not save the results")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.chdir(ROOT)
+    groups = GROUPS
+    if args.only:
+        groups = [g.strip() for g in args.only.split(",")]
+        unknown = set(groups) - set(GROUPS)
+        if unknown:
+            print("Unknown groups: {}".format(", ".join(sorted(unknown))))
+            sys.exit(2)
+    benchmarks = run(groups, args.quick)
+    filename = None
+    if not args.no_save:
+        filename = save(benchmarks)
+        print("\nResults saved in {}".format(os.path.relpath(filename)))
+    reference = args.compare or previous_run(exclude=filename)
+    if reference is None:
+        return
+    regressions = compare(benchmarks, reference, args.threshold)
+    if regressions:
+        print("\n{} regression(s): {}".format(len(regressions),
+                                              ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ from discord.ext import commands
 from .utils.chat_formatting import *
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help
 from copy import deepcopy
 import os
 import discord
@@ -12,8 +12,10 @@ class Alias:
     def __init__(self, bot):
         self.bot = bot
         self.file_path = "data/alias/aliases.json"
-        self.aliases = dataIO.load_json(self.file_path)
-        self.remove_old()
+        self.aliases = dataIO.open_dataset(self.file_path)
+        if isinstance(self.aliases, dict):
+            # Other backends are only fed with already fixed data
+            self.remove_old()
 
     @commands.group(pass_context=True, no_pm=True)
     async def alias(self, ctx):
@@ -42,7 +44,7 @@ class Alias:
             self.aliases[server.id] = {}
         if command not in self.bot.commands:
             self.aliases[server.id][command] = to_execute
-            dataIO.save_json(self.file_path, self.aliases)
+            await dataIO.save_json_async(self.file_path, self.aliases)
             await self.bot.say("Alias '{}' ajouté.".format(command))
         else:
             await self.bot.say("Impossible d'ajouter '{}' car c'est une commande Bot.".format(command))
@@ -84,7 +86,7 @@ class Alias:
         server = ctx.message.server
         if server.id in self.aliases:
             self.aliases[server.id].pop(command, None)
-            dataIO.save_json(self.file_path, self.aliases)
+            await dataIO.save_json_async(self.file_path, self.aliases)
         await self.bot.say("Alias '{}' supprimé.".format(command))
 
     @alias.command(name="list", pass_context=True, no_pm=True)
@@ -106,25 +108,26 @@ class Alias:
             else:
                 await self.bot.say("Aucun alias sur ce serveur.")
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def check_alias(self, context):
+        message = context.message
+        if len(message.content) < 2 or context.is_private:
             return
 
-        msg = message.content
         server = message.server
-        prefix = self.get_prefix(server, msg)
+        prefix = context.prefix
 
         if not prefix:
             return
 
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
+        if server.id in self.aliases and context.allowed:
+            alias = context.first_word
             if alias in self.aliases[server.id]:
                 new_command = self.aliases[server.id][alias]
                 args = message.content[len(prefix + alias):]
                 new_message = deepcopy(message)
                 new_message.content = prefix + new_command + args
                 await self.bot.process_commands(new_message)
+                return True
 
     def part_of_existing_command(self, alias, server):
         '''Command or alias'''
@@ -159,11 +162,7 @@ class Alias:
         return msg.split(" ")[0]
 
     def get_prefix(self, server, msg):
-        prefixes = self.bot.settings.get_prefixes(server)
-        for p in prefixes:
-            if msg.startswith(p):
-                return p
-        return None
+        return self.bot.settings.match_prefix(server, msg)
 
 
 def check_folder():
@@ -184,4 +183,6 @@ def check_file():
 def setup(bot):
     check_folder()
     check_file()
-    bot.add_cog(Alias(bot))
+    n = Alias(bot)
+    bot.add_message_handler(n.check_alias, priority=70)
+    bot.add_cog(n)
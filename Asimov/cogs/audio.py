@@ -3,7 +3,7 @@ from discord.ext import commands
 import threading
 import os
 from random import shuffle, choice
-from cogs.utils.dataIO import fileIO
+from cogs.utils.dataIO import dataIO, fileIO
 from cogs.utils import checks
 from __main__ import send_cmd_help, settings
 import re
@@ -150,17 +150,17 @@ class Playlist:
                "link": self.url}
         return ret
 
-    def append_song(self, author, url):
+    async def append_song(self, author, url):
         if author.id != self.author:
             raise UnauthorizedSave
         elif not self.main_class._valid_playable_url(url):
             raise InvalidURL
         else:
             self.playlist.append(url)
-            self.save()
+            await self.save()
 
-    def save(self):
-        fileIO(self.path, "save", self.to_json())
+    async def save(self):
+        await dataIO.save_json_async(self.path, self.to_json())
 
     @property
     def sid(self):
@@ -236,6 +236,17 @@ class Audio:
         self.bot = bot
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
+        # get_server_settings saves on every lookup
+        dataIO.configure("data/audio/settings.json", write_behind=True,
+                         profile="compact")
+        bot.metrics.gauge("red_audio_cache_megabytes",
+                          "Size of the audio cache", self._cache_size)
+        bot.metrics.gauge("red_audio_queued_songs",
+                          "Songs waiting in the queues of every server",
+                          self._queued_songs)
+        bot.metrics.gauge("red_audio_downloaders",
+                          "Downloader threads still running",
+                          self._running_downloaders)
         self.settings = fileIO("data/audio/settings.json", 'load')
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD"]
@@ -302,6 +313,15 @@ class Audio:
             os.path.join(self.cache_path, s)) / 10**6, songs))
         return size
 
+    def _queued_songs(self):
+        queues = list(self.queue.values())
+        return {(("queue", "queue"),): sum(len(q["QUEUE"]) for q in queues),
+                (("queue", "temp"),): sum(len(q["TEMP_QUEUE"])
+                                          for q in queues)}
+
+    def _running_downloaders(self):
+        return sum(d.is_alive() for d in list(self.downloaders.values()))
+
     def _cache_too_large(self):
         if self._cache_size() > self._cache_max():
             return True
@@ -736,7 +756,7 @@ class Audio:
             except MaximumLength:
                 log.warning("Je ne peux pas jouer l'url ci-dessous parce que trop long."
                             "Utilisez {}audioset maxlength pour changer ça.\n\n"
-                            "{}".format(self.bot.command_prefix[0], url))
+                            "{}".format(self.bot.settings.prefixes[0], url))
                 raise
             local = False
         else:  # Assume local
@@ -832,7 +852,7 @@ class Audio:
             log.debug('Bot status returned to ' + str(self._old_game))
             self._old_game = False
 
-    def _save_playlist(self, server, name, playlist):
+    async def _save_playlist(self, server, name, playlist):
         sid = server.id
         try:
             f = playlist.filename
@@ -847,7 +867,7 @@ class Audio:
 
         log.debug("saving playlist '{}' to {}:\n\t{}".format(name, f,
                                                              playlist))
-        fileIO(f, 'save', playlist)
+        await dataIO.save_json_async(f, playlist)
 
     def _shuffle_queue(self, server):
         shuffle(self.queue[server.id]["QUEUE"])
@@ -1374,7 +1394,7 @@ class Audio:
         playlist.name = name
         playlist.server = server
 
-        self._save_playlist(server, name, playlist)
+        await self._save_playlist(server, name, playlist)
         await self.bot.say("Playlist '{}' sauvegardée.".format(name))
 
 
@@ -1402,7 +1422,7 @@ class Audio:
             playlist.name = name
             playlist.server = server
 
-            self._save_playlist(server, name, playlist)
+            await self._save_playlist(server, name, playlist)
             await self.bot.say("Playlist '{}' sauvegardée. Morceaux: {}".format(
                 name, len(songlist)))
         else:
@@ -1419,7 +1439,7 @@ class Audio:
         playlist = self._load_playlist(
             server, name, local=self._playlist_exists_local(server, name))
         try:
-            playlist.append_song(author, url)
+            await playlist.append_song(author, url)
         except UnauthorizedSave:
             await self.bot.say("Vous n'êtes pas l'auteur de la playlist.")
         except InvalidURL:
@@ -1,7 +1,6 @@
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed
 import os
 import re
 
@@ -12,7 +11,7 @@ class CustomCommands:
     def __init__(self, bot):
         self.bot = bot
         self.file_path = "data/customcom/commands.json"
-        self.c_commands = dataIO.load_json(self.file_path)
+        self.c_commands = dataIO.open_dataset(self.file_path)
 
     @commands.command(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(administrator=True)
@@ -33,7 +32,7 @@ class CustomCommands:
         if command not in cmdlist:
             cmdlist[command] = text
             self.c_commands[server.id] = cmdlist
-            dataIO.save_json(self.file_path, self.c_commands)
+            await dataIO.save_json_async(self.file_path, self.c_commands)
             await self.bot.say("Commande créée.")
         else:
             await self.bot.say("Cette commande existe déjà.")
@@ -50,7 +49,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist[command] = text
                 self.c_commands[server.id] = cmdlist
-                dataIO.save_json(self.file_path, self.c_commands)
+                await dataIO.save_json_async(self.file_path, self.c_commands)
                 await self.bot.say("Commande éditée.")
             else:
                 await self.bot.say("Cette commande n'existe pas")
@@ -68,7 +67,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist.pop(command, None)
                 self.c_commands[server.id] = cmdlist
-                dataIO.save_json(self.file_path, self.c_commands)
+                await dataIO.save_json_async(self.file_path, self.c_commands)
                 await self.bot.say("Supprimée avec succès.")
             else:
                 await self.bot.say("Cette commande n'existe pas.")
@@ -99,33 +98,33 @@ class CustomCommands:
         else:
             await self.bot.say("Il n'y a pas de commandes custom sur ce serveur")
 
-    async def checkCC(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def checkCC(self, context):
+        message = context.message
+        if len(message.content) < 2 or context.is_private:
             return
 
         server = message.server
-        prefix = self.get_prefix(message)
 
-        if not prefix:
+        if not context.prefix:
             return
 
-        if server.id in self.c_commands and user_allowed(message):
+        if server.id in self.c_commands and context.allowed:
             cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
+            cmd = context.command
             if cmd in cmdlist.keys():
                 cmd = cmdlist[cmd]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
             elif cmd.lower() in cmdlist.keys():
                 cmd = cmdlist[cmd.lower()]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
+            else:
+                return
+            cmd = self.format_cc(cmd, message)
+            await self.bot.send_message(message.channel, cmd)
+            return True
 
     def get_prefix(self, message):
-        for p in self.bot.settings.get_prefixes(message.server):
-            if message.content.startswith(p):
-                return p
-        return False
+        prefix = self.bot.settings.match_prefix(message.server,
+                                                message.content)
+        return prefix or False
 
     def format_cc(self, command, message):
         results = re.findall("\{([^}]+)\}", command)
@@ -174,5 +173,5 @@ def setup(bot):
     check_folders()
     check_files()
     n = CustomCommands(bot)
-    bot.add_listener(n.checkCC, "on_message")
+    bot.add_message_handler(n.checkCC, priority=60)
     bot.add_cog(n)
@@ -6,6 +6,8 @@ from datetime import datetime
 from random import randint
 from copy import deepcopy
 from .utils import checks
+from .utils.outbound import FUN
+from .utils.logqueue import queue_handler
 from __main__ import send_cmd_help
 import os
 import time
@@ -46,7 +48,10 @@ class SameSenderAndReceiver(BankError):
 
 class Bank:
     def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+        # Credits change all the time, bank rewrites are merged.
+        # They are rare enough to afford flushing them to the disk
+        dataIO.configure(file_path, write_behind=True, fsync="file+dir")
+        self.accounts = dataIO.open_dataset(file_path)
         self.bot = bot
 
     def create_account(self, user):
@@ -193,6 +198,8 @@ class Bank:
 class Economy:
     """Soyez riche virtuellement !"""
 
+    outbound_priority = FUN
+
     def __init__(self, bot):
         global default_settings
         self.bot = bot
@@ -222,10 +229,10 @@ class Economy:
         except AccountAlreadyExists:
             await self.bot.say("{} Tu as déjà un compte Bank.".format(user.mention))
 
-    async def auto_register(self, message): #Enregistre automatiquement
-        server = message.server
+    async def auto_register(self, context): #Enregistre automatiquement
+        server = context.server
         if server != None:
-            user = message.author
+            user = context.author
             try:
                 account = self.bank.create_account(user)
             except AccountAlreadyExists:
@@ -327,12 +334,12 @@ class Economy:
                             gain = self.settings[server.id]["JACKPOT"] - minimum
                             self.bank.deposit_credits(author, gain)
                             self.settings[server.id]["JACKPOT"] = 150
-                            fileIO("data/economy/settings.json", "save", self.settings)
+                            await dataIO.save_json_async("data/economy/settings.json", self.settings)
                         else:
                             self.settings[server.id]["JACKPOT"] += offre
                             await self.bot.say("**Le Jackpot s'élève désormais à {}§**".format(self.settings[server.id]["JACKPOT"]))
                             self.bank.withdraw_credits(author, offre)
-                            fileIO("data/economy/settings.json", "save", self.settings)
+                            await dataIO.save_json_async("data/economy/settings.json", self.settings)
                     else:
                         await self.bot.say("Tu n'as pas cet argent.")
                 else:
@@ -508,7 +515,6 @@ class Economy:
                             perms.send_messages = False
                             r = discord.utils.get(ctx.message.server.roles, name="Play")
                             await self.bot.edit_channel_permissions(c, r, perms)
-                        await asyncio.sleep(1.5)
                 except discord.Forbidden:
                     await self.bot.say("Une erreur est apparue.")
             except discord.Forbidden:
@@ -552,13 +558,13 @@ class Economy:
         self.settings["BOOST"] = mult
         if boost <= 0:
             await self.bot.say("Le boost ne peut pas être inférieur ou égal à 0")
-            fileIO("data/economy/settings.json", "save", self.settings)
+            await dataIO.save_json_async("data/economy/settings.json", self.settings)
         if boost < 1:
             await self.bot.say("Le boost est maintenant de " + str(mult) + ", ce qui retire de l'argent à chaque distribution.")
-            fileIO("data/economy/settings.json", "save", self.settings)
+            await dataIO.save_json_async("data/economy/settings.json", self.settings)
         if boost > 1:
             await self.bot.say("Le boost est maintenant de " + str(mult))
-            fileIO("data/economy/settings.json", "save", self.settings)
+            await dataIO.save_json_async("data/economy/settings.json", self.settings)
         
     @economyset.command(pass_context=True)
     async def slotmin(self, ctx, bid : int):
@@ -566,7 +572,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MIN"] = bid
         await self.bot.say("Minimum bid is now " + str(bid) + " credits.")
-        fileIO("data/economy/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/economy/settings.json", self.settings)
 
     @economyset.command(pass_context=True)
     async def slotmax(self, ctx, bid : int):
@@ -574,7 +580,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_MAX"] = bid
         await self.bot.say("Maximum bid is now " + str(bid) + " credits.")
-        fileIO("data/economy/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/economy/settings.json", self.settings)
 
     @economyset.command(pass_context=True)
     async def slottime(self, ctx, seconds : int):
@@ -582,7 +588,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["SLOT_TIME"] = seconds
         await self.bot.say("Cooldown is now " + str(seconds) + " seconds.")
-        fileIO("data/economy/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/economy/settings.json", self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaytime(self, ctx, seconds : int):
@@ -590,7 +596,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["PAYDAY_TIME"] = seconds
         await self.bot.say("Value modified. At least " + str(seconds) + " seconds must pass between each payday.")
-        fileIO("data/economy/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/economy/settings.json", self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaycredits(self, ctx, credits : int):
@@ -598,7 +604,7 @@ class Economy:
         server = ctx.message.server
         self.settings[server.id]["PAYDAY_CREDITS"] = credits
         await self.bot.say("Every payday will now give " + str(credits) + " credits.")
-        fileIO("data/economy/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/economy/settings.json", self.settings)
 
     def display_time(self, seconds, granularity=2): # What would I ever do without stackoverflow?
         intervals = (                               # Source: http://stackoverflow.com/a/24542445
@@ -643,10 +649,10 @@ def setup(bot):
     check_files()
     logger = logging.getLogger("red.economy")
     n = Economy(bot)
-    bot.add_listener(n.auto_register, "on_message")
+    bot.add_message_handler(n.auto_register, priority=20)
     if logger.level == 0: # Prevents the logger from being loaded again in case of module reload
         logger.setLevel(logging.INFO)
         handler = logging.FileHandler(filename='data/economy/economy.log', encoding='utf-8', mode='a')
         handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
-        logger.addHandler(handler)
+        logger.addHandler(queue_handler(handler))
     bot.add_cog(n)
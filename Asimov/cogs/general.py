@@ -3,6 +3,7 @@ from discord.ext import commands
 from .utils.chat_formatting import *
 from .utils.dataIO import fileIO, dataIO
 from .utils import checks
+from .utils.outbound import FUN
 from random import randint
 from random import choice as randchoice
 import datetime
@@ -20,6 +21,8 @@ default = {"CHANNEL" : "", "CB_AUTO" : False, "ACTIVE" : False, "BOT_ID" : ""}
 class General:
     """General commands."""
 
+    outbound_priority = FUN
+
     def __init__(self, bot):
         self.bot = bot
         self.sett = dataIO.load_json("data/gen/sett.json")
@@ -270,7 +273,7 @@ class General:
                              "COLOR" : coul,
                              "FOOTER" : footer,
                              "IMG" : imgurl}
-            fileIO("data/gen/box.json", "save", self.box)
+            await dataIO.save_json_async("data/gen/box.json", self.box)
             await self.bot.whisper("**Enregisté**. Je vais vous envoyer un aperçu d'ici quelques secondes...")
             await asyncio.sleep(2)
             # ======= AFFICHAGE =========
@@ -322,7 +325,7 @@ class General:
         """Permet la suppression d'un ticker Inbox"""
         if nom in self.box:
             del self.box[nom]
-            fileIO("data/gen/box.json", "save", self.box)
+            await dataIO.save_json_async("data/gen/box.json", self.box)
             await self.bot.say("Supprimé.")
         else:
             await self.bot.say("Ce nom n'existe pas.")
@@ -368,7 +371,7 @@ class General:
                              "COLOR" : coul,
                              "FOOTER" : footer,
                              "IMG" : imgurl}
-            fileIO("data/gen/box.json", "save", self.box)
+            await dataIO.save_json_async("data/gen/box.json", self.box)
             await self.bot.whisper("**Modifié**. Je vais vous envoyer un aperçu d'ici quelques secondes...")
             await asyncio.sleep(2)
             if self.box[nom]["COLOR"] != None:
@@ -592,7 +595,8 @@ class General:
                 return poll
         return False
 
-    async def check_poll_votes(self, message):
+    async def check_poll_votes(self, context):
+        message = context.message
         if message.author.id != self.bot.user.id:
             if self.getPollByChannel(message):
                     self.getPollByChannel(message).checkAnswer(message)
@@ -669,5 +673,5 @@ def setup(bot):
     check_folders()
     check_files()
     n = General(bot)
-    bot.add_listener(n.check_poll_votes, "on_message")
+    bot.add_message_handler(n.check_poll_votes, priority=30)
     bot.add_cog(n)
@@ -80,7 +80,7 @@ class Downloader:
             del self.repos[repo_name]
             return
         self.populate_list(repo_name)
-        self.save_repos()
+        await dataIO.save_json_async(self.file_path, self.repos)
         data = self.get_info_data(repo_name)
         if data:
             msg = data.get("INSTALL_MSG")
@@ -96,7 +96,7 @@ class Downloader:
             return
         del self.repos[repo_name]
         #shutil.rmtree(os.path.join(self.path, repo_name))
-        self.save_repos()
+        await dataIO.save_json_async(self.file_path, self.repos)
         await self.bot.say("Repo '{}' retiré.".format(repo_name))
 
     @cog.command(name="list")
@@ -239,7 +239,7 @@ class Downloader:
 
         msg = await self._robust_edit(msg, base_msg + status)
 
-        registry = dataIO.load_json("data/red/cogs.json")
+        registry = await dataIO.load_json_async("data/red/cogs.json")
 
         for t in updated_cogs:
             repo, cog, _ = t
@@ -313,7 +313,7 @@ class Downloader:
             return
         set_cog("cogs." + cog, False)
         self.repos[repo_name][cog]['INSTALLED'] = False
-        self.save_repos()
+        await dataIO.save_json_async(self.file_path, self.repos)
         os.remove(os.path.join("cogs", cog + ".py"))
         owner = self.bot.get_cog('Owner')
         await owner.unload.callback(owner, module=cog)
@@ -371,7 +371,7 @@ class Downloader:
             distutils.dir_util.copy_tree(cog_data_path,
                                          os.path.join('data/', cog))
         self.repos[repo_name][cog]['INSTALLED'] = True
-        self.save_repos()
+        await dataIO.save_json_async(self.file_path, self.repos)
         return True
 
     def get_info_data(self, repo_name, cog=None):
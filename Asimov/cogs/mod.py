@@ -2,6 +2,9 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.outbound import MODERATION
+from .utils.logqueue import queue_handler
+from .utils.wordfilter import WordFilter
 from __main__ import send_cmd_help, settings
 from collections import deque, defaultdict
 from cogs.utils.chat_formatting import escape_mass_mentions, box
@@ -36,18 +39,34 @@ class NoModLogChannel(ModError):
 class Mod:
     """Moderation tools."""
 
+    outbound_priority = MODERATION
+
     def __init__(self, bot):
         self.bot = bot
+        dataIO.configure("data/mod/modlog.json", write_behind=True)
+        for f in ("past_names.json", "past_nicknames.json"):
+            dataIO.configure("data/mod/" + f, write_behind=True,
+                             profile="compact")
+        dataIO.configure("data/mod/perms_cache.json", profile="compact")
         self.whitelist_list = dataIO.load_json("data/mod/whitelist.json")
         self.blacklist_list = dataIO.load_json("data/mod/blacklist.json")
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self.update_access_sets()
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self.word_filters = {sid: WordFilter(words)
+                             for sid, words in self.filter.items()}
+        # The other shards' changes to the lists, brought in by dataIO
+        for f in ("whitelist.json", "blacklist.json", "ignorelist.json"):
+            dataIO.on_refresh("data/mod/" + f, self.update_access_sets)
+        dataIO.on_refresh("data/mod/filter.json", self.refresh_word_filters)
+        self.past_names = dataIO.open_dataset("data/mod/past_names.json",
+                                              depth=1)
+        self.past_nicknames = dataIO.open_dataset(
+            "data/mod/past_nicknames.json")
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
         self.cache = defaultdict(lambda: deque(maxlen=3))
-        self.cases = dataIO.load_json("data/mod/modlog.json")
+        self.cases = dataIO.open_dataset("data/mod/modlog.json")
         self.last_case = defaultdict(dict)
         self._tmp_banned_cache = []
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
@@ -100,7 +119,7 @@ class Mod:
                 return
             self.settings[server.id]["mod-log"] = None
             await self.bot.say("Logs désactivés.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def banmentionspam(self, ctx, max_mentions : int=False):
@@ -122,7 +141,7 @@ class Mod:
                 return
             self.settings[server.id]["ban_mention_spam"] = False
             await self.bot.say("Autoban désactivé.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def deleterepeats(self, ctx):
@@ -134,14 +153,14 @@ class Mod:
         else:
             self.settings[server.id]["delete_repeats"] = False
             await self.bot.say("Messages répétés ignorés.")
-        dataIO.save_json("data/mod/settings.json", self.settings)
+        await dataIO.save_json_async("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
     async def resetcases(self, ctx):
         """Reset la DB des logs"""
         server = ctx.message.server
         self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        await dataIO.save_json_async("data/mod/modlog.json", self.cases)
         await self.bot.say("Reset effectué.")
 
     @commands.command(no_pm=True, pass_context=True)
@@ -271,7 +290,7 @@ class Mod:
         except discord.Forbidden:
             await self.bot.say("Impossible de le faire. Mon rôle ne le permet pas.")
         else:
-            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+            await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
             await self.bot.say("Utilisateur mute.")
 
     @mute.command(name="server", pass_context=True, no_pm=True)
@@ -293,13 +312,11 @@ class Mod:
             except discord.Forbidden:
                 await self.bot.say("Impossible de le faire. Mon rôle ne le permet pas.")
                 return
-            else:
-                await asyncio.sleep(0.1)
         if not register:
             await self.bot.say("Cet utilisateur est déjà mute sur tout les channels.")
             return
         self._perms_cache[user.id] = register
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
         await self.bot.say("Utilisateur mute.")
 
     @commands.group(pass_context=True, no_pm=True, invoke_without_command=True)
@@ -338,7 +355,7 @@ class Mod:
                 pass
             if user.id in self._perms_cache and not self._perms_cache[user.id]:
                 del self._perms_cache[user.id] #cleanup
-            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+            await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
             await self.bot.say("Utilisateur libéré")
 
     @unmute.command(name="server", pass_context=True, no_pm=True)
@@ -369,10 +386,9 @@ class Mod:
                     return
                 else:
                     del self._perms_cache[user.id][channel.id]
-                    await asyncio.sleep(0.1)
         if user.id in self._perms_cache and not self._perms_cache[user.id]:
             del self._perms_cache[user.id] #cleanup
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        await dataIO.save_json_async("data/mod/perms_cache.json", self._perms_cache)
         await self.bot.say("Utilisateur démute.")
 
     @commands.group(pass_context=True)
@@ -547,26 +563,13 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        prefixes = self.bot.command_prefix
-        if isinstance(prefixes, str):
-            prefixes = [prefixes]
-        elif callable(prefixes):
-            if asyncio.iscoroutine(prefixes):
-                await self.bot.say('Préfixes de coroutine non-implémentés pour le moment.')
-                return
-            prefixes = prefixes(self.bot, ctx.message)
-
-        # In case some idiot sets a null prefix
-        if '' in prefixes:
-            prefixes.pop('')
-
         def check(m):
             if m.author.id == self.bot.user.id:
                 return True
             elif m == ctx.message:
                 return True
-            p = discord.utils.find(m.content.startswith, prefixes)
-            if p and len(p) > 0:
+            p = self.bot.settings.match_prefix(server, m.content)
+            if p:  # In case some idiot sets a null prefix
                 return m.content[len(p):].startswith(tuple(self.bot.commands))
             return False
 
@@ -716,7 +719,8 @@ class Mod:
         """Ajoute un utilisateur."""
         if user.id not in self.blacklist_list:
             self.blacklist_list.append(user.id)
-            dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/blacklist.json", self.blacklist_list)
             await self.bot.say("Rajouté.")
         else:
             await self.bot.say("Déjà blacklisté.")
@@ -726,7 +730,8 @@ class Mod:
         """Enlève un utilisateur."""
         if user.id in self.blacklist_list:
             self.blacklist_list.remove(user.id)
-            dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/blacklist.json", self.blacklist_list)
             await self.bot.say("Retiré.")
         else:
             await self.bot.say("N'est pas présent dans la blacklist.")
@@ -735,7 +740,8 @@ class Mod:
     async def _blacklist_clear(self):
         """Reset la blacklist"""
         self.blacklist_list = []
-        dataIO.save_json("data/mod/blacklist.json", self.blacklist_list)
+        self.update_access_sets()
+        await dataIO.save_json_async("data/mod/blacklist.json", self.blacklist_list)
         await self.bot.say("Vidée.")
 
     @commands.group(pass_context=True)
@@ -754,7 +760,8 @@ class Mod:
             else:
                 msg = ""
             self.whitelist_list.append(user.id)
-            dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/whitelist.json", self.whitelist_list)
             await self.bot.say("Ajouté." + msg)
         else:
             await self.bot.say("Utilisateur déjà présent.")
@@ -764,7 +771,8 @@ class Mod:
         """Retire un utilisateur"""
         if user.id in self.whitelist_list:
             self.whitelist_list.remove(user.id)
-            dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/whitelist.json", self.whitelist_list)
             await self.bot.say("Retiré.")
         else:
             await self.bot.say("Utilisateur non présent dans la liste.")
@@ -773,7 +781,8 @@ class Mod:
     async def _whitelist_clear(self):
         """Reset la whitelist"""
         self.whitelist_list = []
-        dataIO.save_json("data/mod/whitelist.json", self.whitelist_list)
+        self.update_access_sets()
+        await dataIO.save_json_async("data/mod/whitelist.json", self.whitelist_list)
         await self.bot.say("Vidée.")
 
     @commands.group(pass_context=True, no_pm=True)
@@ -791,14 +800,16 @@ class Mod:
         if not channel:
             if current_ch.id not in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].append(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.update_access_sets()
+                await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
                 await self.bot.say("Chan ignoré.")
             else:
                 await self.bot.say("Chan déjà ignoré.")
         else:
             if channel.id not in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].append(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.update_access_sets()
+                await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
                 await self.bot.say("Chan ajouté.")
             else:
                 await self.bot.say("Chan déjà ajouté.")
@@ -809,7 +820,8 @@ class Mod:
         server = ctx.message.server
         if server.id not in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].append(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
             await self.bot.say("Serveur ignoré.")
         else:
             await self.bot.say("Serveur déjà ignoré.")
@@ -829,14 +841,16 @@ class Mod:
         if not channel:
             if current_ch.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.update_access_sets()
+                await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
                 await self.bot.say("Chan plus ignoré.")
             else:
                 await self.bot.say("Ce chan n'était pas ignoré.")
         else:
             if channel.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+                self.update_access_sets()
+                await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
                 await self.bot.say("Chan plus ignoré.")
             else:
                 await self.bot.say("Ce chan n'était pas ignoré.")
@@ -847,11 +861,34 @@ class Mod:
         server = ctx.message.server
         if server.id in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].remove(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            self.update_access_sets()
+            await dataIO.save_json_async("data/mod/ignorelist.json", self.ignore_list)
             await self.bot.say("Ce serveur n'est plus ignoré.")
         else:
             await self.bot.say("Serveur non ignoré.")
 
+    def update_access_sets(self):
+        """Mirrors the black/white/ignore lists in the sets used by
+        Bot.user_allowed on every message. To call after editing them"""
+        self.blacklisted = set(self.blacklist_list)
+        self.whitelisted = set(self.whitelist_list)
+        self.ignored_servers = set(self.ignore_list["SERVERS"])
+        self.ignored_channels = set(self.ignore_list["CHANNELS"])
+
+    async def refresh_word_filters(self):
+        """Brings the word filters in line with self.filter, once
+        changed by another shard"""
+        for sid in [s for s in self.word_filters if s not in self.filter]:
+            del self.word_filters[sid]
+        for sid, words in self.filter.items():
+            word_filter = self.word_filters.setdefault(sid, WordFilter())
+            changed = word_filter.words.symmetric_difference(words)
+            for w in changed:
+                if not word_filter.remove(w):
+                    word_filter.add(w)
+            if changed:
+                await word_filter.compile_async(self.bot.loop)
+
     def count_ignored(self):
         msg = "```Ignorés:\n"
         msg += str(len(self.ignore_list["CHANNELS"])) + " channels\n"
@@ -884,12 +921,14 @@ class Mod:
         added = 0
         if server.id not in self.filter.keys():
             self.filter[server.id] = []
+        word_filter = self.word_filters.setdefault(server.id, WordFilter())
         for w in words:
-            if w.lower() not in self.filter[server.id] and w != "":
+            if word_filter.add(w.lower()):
                 self.filter[server.id].append(w.lower())
                 added += 1
         if added:
-            dataIO.save_json("data/mod/filter.json", self.filter)
+            await word_filter.compile_async(self.bot.loop)
+            await dataIO.save_json_async("data/mod/filter.json", self.filter)
             await self.bot.say("Ajouté.")
         else:
             await self.bot.say("Déjà filtrés.")
@@ -905,12 +944,14 @@ class Mod:
         if server.id not in self.filter.keys():
             await self.bot.say("Aucun mot n'est filtré..")
             return
+        word_filter = self.word_filters.setdefault(server.id, WordFilter())
         for w in words:
-            if w.lower() in self.filter[server.id]:
+            if word_filter.remove(w.lower()):
                 self.filter[server.id].remove(w.lower())
                 removed += 1
         if removed:
-            dataIO.save_json("data/mod/filter.json", self.filter)
+            await word_filter.compile_async(self.bot.loop)
+            await dataIO.save_json_async("data/mod/filter.json", self.filter)
             await self.bot.say("Mots retirés du filtre.")
         else:
             await self.bot.say("Ces mots n'étaient pas filtrés.")
@@ -990,7 +1031,6 @@ class Mod:
             else:
                 await self.bot.delete_message(messages[0])
                 messages = []
-            await asyncio.sleep(1.5)
 
     async def slow_deletion(self, messages):
         for message in messages:
@@ -1000,19 +1040,7 @@ class Mod:
                 pass
 
     def is_mod_or_superior(self, message):
-        user = message.author
-        server = message.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-
-        if user.id == settings.owner:
-            return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        return self.bot.is_mod_or_superior(message)
 
     async def new_case(self, server, *, action, mod=None, user, reason=None):
         channel = server.get_channel(self.settings[server.id]["mod-log"])
@@ -1060,7 +1088,7 @@ class Mod:
         if mod:
             self.last_case[server.id][mod.id] = case_n
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        await dataIO.save_json_async("data/mod/modlog.json", self.cases)
 
     async def update_case(self, server, *, case, mod, reason):
         channel = server.get_channel(self.settings[server.id]["mod-log"])
@@ -1084,7 +1112,7 @@ class Mod:
                     "**Raison:** {reason}"
                     "".format(**case))
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        await dataIO.save_json_async("data/mod/modlog.json", self.cases)
 
         msg = await self.bot.get_message(channel, case["message"])
         if msg:
@@ -1094,17 +1122,19 @@ class Mod:
 
     async def check_filter(self, message):
         server = message.server
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    try:
-                        await self.bot.delete_message(message)
-                        logger.info("Message supprimé {}."
-                                    "Filtré: {}"
-                                    "".format(server.id, w))
-                        return True
-                    except:
-                        pass
+        word_filter = self.word_filters.get(server.id)
+        if word_filter is None:
+            return False
+        w = word_filter.search(message.content.lower())
+        if w is not None:
+            try:
+                await self.bot.delete_message(message)
+                logger.info("Message supprimé {}. "
+                            "Filtré: {}"
+                            "".format(server.id, w))
+                return True
+            except:
+                pass
         return False
 
     async def check_duplicates(self, message):
@@ -1152,17 +1182,19 @@ class Mod:
                     self._tmp_banned_cache.remove(author)
         return False
 
-    async def on_message(self, message):
-        if message.channel.is_private or self.bot.user == message.author \
+    async def check_message(self, context):
+        message = context.message
+        if context.is_private or self.bot.user == message.author \
          or not isinstance(message.author, discord.Member):
             return
-        elif self.is_mod_or_superior(message):
+        elif context.is_mod:
             return
         deleted = await self.check_filter(message)
         if not deleted:
             deleted = await self.check_duplicates(message)
         if not deleted:
             deleted = await self.check_mention_spam(message)
+        return deleted  # Nothing else to do with a deleted message
 
     async def on_member_ban(self, member):
         if member not in self._tmp_banned_cache:
@@ -1180,7 +1212,7 @@ class Mod:
                     names = deque(self.past_names[before.id], maxlen=20)
                     names.append(after.name)
                     self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+            await dataIO.save_json_async("data/mod/past_names.json", self.past_names)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
@@ -1194,8 +1226,8 @@ class Mod:
             if after.nick not in nicks:
                 nicks.append(after.nick)
                 self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                await dataIO.save_json_async("data/mod/past_nicknames.json",
+                                             self.past_nicknames)
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1246,7 +1278,8 @@ def setup(bot):
             filename='data/mod/mod.log', encoding='utf-8', mode='a')
         handler.setFormatter(
             logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
-        logger.addHandler(handler)
+        logger.addHandler(queue_handler(handler))
     n = Mod(bot)
     bot.add_listener(n.check_names, "on_member_update")
+    bot.add_message_handler(n.check_message, priority=10)
     bot.add_cog(n)
@@ -2,10 +2,12 @@ import discord
 from discord.ext import commands
 from cogs.utils import checks
 from __main__ import set_cog, send_cmd_help, settings
-from .utils.dataIO import dataIO
+from .utils.dataIO import dataIO, STORAGE_BACKENDS, STORAGE_CONFIG
 from .utils.chat_formatting import pagify, box
+from .utils.profiler import SamplingProfiler
 
 import importlib
+import sys
 import traceback
 import logging
 import asyncio
@@ -18,6 +20,13 @@ import aiohttp
 
 log = logging.getLogger("red.owner")
 
+# Module functions creating a cog's data folders and files
+DATA_CHECKS = ("check_folders", "check_folder", "check_files", "check_file")
+# Written by each shard process, see Bot.report_shard_status
+SHARD_STATUS_FILES = "data/red/shards/shard-*.json"
+# Seconds without update after which a shard is shown as silent
+SHARD_SILENT_TIME = 90
+
 
 class CogNotFoundError(Exception):
     pass
@@ -46,6 +55,7 @@ class Owner:
     def __init__(self, bot):
         self.bot = bot
         self.setowner_lock = False
+        self.profiling = False
         self.file_path = "data/red/disabled_commands.json"
         self.disabled_commands = dataIO.load_json(self.file_path)
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
@@ -219,7 +229,6 @@ class Owner:
             await send_cmd_help(ctx)
             return
 
-        self.bot.command_prefix = sorted(prefixes, reverse=True)
         settings.prefixes = sorted(prefixes, reverse=True)
         log.debug("Changés en:\n\t{}".format(settings.prefixes))
 
@@ -364,6 +373,270 @@ class Owner:
             await self.bot.say("Token changé, rechargez-moi.")
             log.debug("Token changé.")
 
+    @commands.group(pass_context=True)
+    @checks.is_owner()
+    async def storage(self, ctx):
+        """Gestion du stockage des données"""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+            try:
+                config = dataIO.load_json(STORAGE_CONFIG)
+            except (FileNotFoundError, ValueError):
+                config = {}
+            msg = "\n".join("{}: {}".format(f, b) for f, b in config.items())
+            await self.bot.say(box(msg or "Tout est stocké en json."))
+
+    @storage.command(name="set")
+    async def storage_set(self, filename, backend):
+        """Change le moteur de stockage d'un fichier
+
+        Moteurs: json, sqlite, ledger, shards
+        Exemple: storage set data/economy/bank.json sqlite"""
+        if backend not in STORAGE_BACKENDS:
+            await self.bot.say("Moteurs disponibles: " +
+                               ", ".join(STORAGE_BACKENDS))
+            return
+        if not os.path.isfile(filename):
+            await self.bot.say("Fichier introuvable.")
+            return
+        try:
+            dataIO.set_backend(filename, backend)
+        except Exception as e:
+            log.exception(e)
+            await self.bot.say("Impossible de changer le moteur: "
+                               "`{}`".format(e))
+        else:
+            await self.bot.say("Fait. Rechargez le module concerné pour "
+                               "l'appliquer.")
+
+    @storage.command(name="export")
+    async def storage_export(self, filename, target=None):
+        """Exporte un fichier en json (sauvegarde)
+
+        Par défaut le fichier json d'origine est réécrit."""
+        try:
+            dataIO.export_json(filename, target)
+        except Exception as e:
+            log.exception(e)
+            await self.bot.say("Export impossible: `{}`".format(e))
+        else:
+            await self.bot.say("Exporté vers {}.".format(target or filename))
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    @checks.is_owner()
+    async def iostat(self, ctx, lignes: int=15):
+        """Statistiques d'accès au disque, par fichier et par module
+
+        Temps en ms: moyenne / 95e centile"""
+        paths = dataIO.stats.paths()
+        cogs = dataIO.stats.cogs()
+        if not paths:
+            await self.bot.say("Aucune opération enregistrée.")
+            return
+        header = ("{:<34} {:>6} {:>6} {:>9} {:>6} {:>6} {:>11} {:>11}"
+                  "".format("", "sauv.", "écrit.", "Ko", "lect.", "cache",
+                            "sérialis.", "écriture"))
+        def row(name, s):
+            return ("{:<34} {:>6} {:>6} {:>9.1f} {:>6} {:>6} {:>11} {:>11}"
+                    "".format(name[-34:], s.saves, s.writes, s.bytes / 1024,
+                              s.loads, s.cache_hits,
+                              "{:.1f}/{:g}".format(s.serialize.mean(),
+                                                   s.serialize.percentile(95)),
+                              "{:.1f}/{:g}".format(s.commit.mean(),
+                                                   s.commit.percentile(95))))
+        top = sorted(paths.items(), key=lambda i: (i[1].bytes, i[1].saves),
+                     reverse=True)[:lignes]
+        since = datetime.datetime.fromtimestamp(dataIO.stats.since)
+        msg = "Depuis le {:%d/%m %H:%M}\n\n".format(since) + header + "\n"
+        msg += "\n".join(row(p, s) for p, s in top)
+        msg += "\n\nPar module\n" + header + "\n"
+        msg += "\n".join(row(c, s) for c, s in
+                         sorted(cogs.items(), key=lambda i: -i[1].bytes))
+        for page in pagify(msg, delims=["\n"], shorten_by=8):
+            await self.bot.say(box(page))
+
+    @iostat.command(name="dump")
+    async def iostat_dump(self):
+        """Enregistre les statistiques dans data/red/iostat.json"""
+        await dataIO.save_json_async("data/red/iostat.json",
+                                     dataIO.stats.dump())
+        await self.bot.say("Statistiques enregistrées dans "
+                           "data/red/iostat.json.")
+
+    @iostat.command(name="reset")
+    async def iostat_reset(self):
+        """Remet les statistiques à zéro"""
+        dataIO.stats.reset()
+        await self.bot.say("Statistiques remises à zéro.")
+
+    @commands.command()
+    @checks.is_owner()
+    async def metrics(self, lignes: int=10):
+        """Résumé des métriques du bot
+
+        Complètes au format Prometheus sur le port --metrics-port"""
+        m = self.bot.metrics
+        counter = self.bot.counter
+        lag = m.histogram_values("red_loop_lag_seconds").get((), (0, 0.0))
+        errors = sum(m.counter_values("red_command_errors_total").values())
+        msg = ("Messages lus: {}\nCommandes: {} ({:g} erreurs)\n"
+               "Serveurs: {}\nConnexions vocales: {}\n"
+               "Latence de la boucle: {:.1f} ms (moyenne {:.1f} ms)\n"
+               "".format(counter["messages_read"],
+                         counter["processed_commands"], errors,
+                         len(self.bot.servers), len(self.bot.voice_clients),
+                         self.bot.loop_lag * 1000,
+                         lag[1] / lag[0] * 1000 if lag[0] else 0))
+        for title, name, label in (("Commandes", "red_command_seconds",
+                                    "command"),
+                                   ("Listeners", "red_listener_seconds",
+                                    "listener")):
+            values = m.histogram_values(name)
+            top = sorted(values.items(), key=lambda i: -i[1][1])[:lignes]
+            msg += "\n{} (total / appels / moyenne)\n".format(title)
+            for key, (count, total) in top:
+                msg += "{:<32} {:>9.1f} s {:>7} {:>8.1f} ms\n".format(
+                    dict(key)[label][-32:], total, count,
+                    total / count * 1000 if count else 0)
+        for page in pagify(msg, delims=["\n"], shorten_by=8):
+            await self.bot.say(box(page))
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    @checks.is_owner()
+    async def cmdstats(self, ctx, lignes: int=20):
+        """Temps passé dans chaque commande, du plus long au plus court
+
+        Centiles sur les 1000 derniers appels de chaque commande"""
+        rows = self.bot.command_stats.summary()[:lignes]
+        if not rows:
+            await self.bot.say("Aucune commande enregistrée.")
+            return
+        msg = "{:<26} {:>6} {:>5} {:>9} {:>8} {:>8} {:>8}\n".format(
+            "", "appels", "err.", "total s", "p50 ms", "p95 ms", "p99 ms")
+        for name, calls, errors, total, p50, p95, p99 in rows:
+            msg += ("{:<26} {:>6} {:>5} {:>9.2f} {:>8.1f} {:>8.1f} {:>8.1f}\n"
+                    "".format(name[-26:], calls, errors, total, p50 * 1000,
+                              p95 * 1000, p99 * 1000))
+        for page in pagify(msg, delims=["\n"], shorten_by=8):
+            await self.bot.say(box(page))
+
+    @cmdstats.command(name="reset")
+    async def cmdstats_reset(self):
+        """Remet les statistiques à zéro"""
+        self.bot.command_stats.reset()
+        await self.bot.say("Statistiques remises à zéro.")
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    @checks.is_owner()
+    async def lag(self, ctx, lignes: int=10):
+        """Blocages de la boucle d'évènements
+
+        Liste les derniers blocages et ce qui les a causé."""
+        watchdog = self.bot.watchdog
+        msg = ("Latence actuelle: {:.1f} ms\nBlocages de plus de {:.0f} ms: "
+               "{}\n".format(self.bot.loop_lag * 1000,
+                             watchdog.threshold * 1000, watchdog.total))
+        outbound = self.bot.outbound
+        msg += ("Requêtes en attente: {} (envoyées: {sent}, fusionnées: "
+                "{coalesced}, limitées par Discord: {rate_limited})\n".format(
+                    outbound.queued, **{k: outbound.stats[k] for k in
+                                        ("sent", "coalesced", "rate_limited")}))
+        events = list(enumerate(watchdog.events, 1))[-lignes:]
+        for n, event in reversed(events):
+            started = datetime.datetime.fromtimestamp(event.started)
+            msg += "\n#{} {:%d/%m %H:%M:%S} {:>7.0f} ms  {}".format(
+                n, started, event.duration * 1000, event.culprit)
+        if events:
+            msg += "\n\n{}lag stack <n> pour la pile d'un blocage".format(
+                ctx.prefix)
+        await self.bot.say(box(msg))
+
+    @lag.command(name="stack")
+    async def lag_stack(self, n: int):
+        """Pile d'appels d'un blocage listé par lag"""
+        events = list(self.bot.watchdog.events)
+        if not 0 < n <= len(events):
+            await self.bot.say("Blocage introuvable.")
+            return
+        event = events[n - 1]
+        stack = "".join(event.stack) or "Pile indisponible."
+        for page in pagify(stack, delims=["\n"], shorten_by=16):
+            await self.bot.say(box(page, lang="py"))
+
+    @commands.command()
+    @checks.is_owner()
+    async def shards(self):
+        """État des shards d'Asimov
+
+        Chaque shard est un processus à part, lancé par le launcher."""
+        if not self.bot.shard_name:
+            await self.bot.say("Asimov n'est pas divisé en shards.")
+            return
+        statuses = []
+        for filename in glob.glob(SHARD_STATUS_FILES):
+            try:
+                statuses.append(dataIO.load_json(filename))
+            except Exception:
+                continue
+        statuses.sort(key=lambda s: s.get("shard", 0))
+        now = time.time()
+        msg = "{:>5} {:>8} {:>9} {:>9} {:>9}  État\n".format(
+            "Shard", "Serveurs", "Membres", "Latence", "Uptime")
+        for status in statuses:
+            if now - status.get("updated", 0) > SHARD_SILENT_TIME:
+                state = "muet"
+            else:
+                state = "connecté" if status.get("ready") else "démarrage"
+            if status.get("shard") == self.bot.shard_id:
+                state += " (ici)"
+            msg += "{:>5} {:>8} {:>9} {:>7.1f}ms {:>8.1f}h  {}\n".format(
+                status.get("shard", "?"), status.get("servers", 0),
+                status.get("users", 0), status.get("loop_lag", 0) * 1000,
+                status.get("uptime", 0) / 3600, state)
+        msg += "\nTotal: {} serveurs, {} membres sur {}/{} shards".format(
+            sum(s.get("servers", 0) for s in statuses),
+            sum(s.get("users", 0) for s in statuses), len(statuses),
+            self.bot.shard_count)
+        for page in pagify(msg, delims=["\n"], shorten_by=16):
+            await self.bot.say(box(page))
+
+    @commands.command()
+    @checks.is_owner()
+    async def profile(self, secondes: float=10, lignes: int=15):
+        """Profile le bot pendant quelques secondes
+
+        Échantillonne les piles de tous les threads (boucle, pools,
+        téléchargements audio). Les piles sont enregistrées dans
+        data/red/profiles/ au format des flamegraphs."""
+        if self.profiling:
+            await self.bot.say("Un profilage est déjà en cours.")
+            return
+        if not 0 < secondes <= 300:
+            await self.bot.say("Entre 0 et 300 secondes.")
+            return
+        self.profiling = True
+        try:
+            await self.bot.say("Profilage pendant {:g} secondes..."
+                               "".format(secondes))
+            profiler = SamplingProfiler()
+            await self.bot.loop.run_in_executor(None, profiler.run, secondes)
+            filename = profiler.save()
+        finally:
+            self.profiling = False
+        top = profiler.top(lignes)
+        msg = "{} échantillons, enregistrés dans {}\n".format(
+            profiler.samples, filename)
+        if not top:
+            msg += "\nLe bot n'a rien fait pendant le profilage."
+        else:
+            msg += "\n{:>6} {:>6}  {}\n".format("propre", "total", "fonction")
+        for function, own, total in top:
+            msg += "{:>5.1f}% {:>5.1f}%  {}\n".format(
+                own * 100 / profiler.samples, total * 100 / profiler.samples,
+                function[-60:])
+        for page in pagify(msg, delims=["\n"], shorten_by=8):
+            await self.bot.say(box(page))
+
     @commands.command()
     @checks.is_owner()
     async def shutdown(self):
@@ -393,8 +666,9 @@ class Owner:
         else:
             comm_obj.enabled = False
             comm_obj.hidden = True
+            self.bot.clear_help_cache()
             self.disabled_commands.append(command)
-            dataIO.save_json(self.file_path, self.disabled_commands)
+            await dataIO.save_json_async(self.file_path, self.disabled_commands)
             await self.bot.say("Commande désactivée.")
 
     @command_disabler.command()
@@ -402,7 +676,7 @@ class Owner:
         """Active une commande"""
         if command in self.disabled_commands:
             self.disabled_commands.remove(command)
-            dataIO.save_json(self.file_path, self.disabled_commands)
+            await dataIO.save_json_async(self.file_path, self.disabled_commands)
             await self.bot.say("Commande activée.")
         else:
             await self.bot.say("Cette commande n'est pas désactivée.")
@@ -411,6 +685,7 @@ class Owner:
             comm_obj = await self.get_command(command)
             comm_obj.enabled = True
             comm_obj.hidden = False
+            self.bot.clear_help_cache()
         except:  # In case it was in the disabled list but not currently loaded
             pass # No point in even checking what returns
 
@@ -609,17 +884,29 @@ class Owner:
         except discord.HTTPException:
             await self.bot.say("J'ai besoin d'avoir l'accès aux liens.")
 
-    def _load_cog(self, cogname):
+    def _prepare_cog(self, cogname):
+        """Imports a cog and checks its data files ahead of _load_cog
+
+        Safe to run in a thread. The json files read by the checks stay
+        in dataIO's read cache for the setup of the cog"""
+        if not self._does_cogfile_exist(cogname):
+            raise CogNotFoundError(cogname)
+        module = importlib.import_module(cogname)
+        for name in DATA_CHECKS:
+            check = getattr(module, name, None)
+            if callable(check):
+                check()
+
+    def _load_cog(self, cogname, *, prepared=False):
         if not self._does_cogfile_exist(cogname):
             raise CogNotFoundError(cogname)
         try:
-            mod_obj = importlib.import_module(cogname)
-            importlib.reload(mod_obj)
-            self.bot.load_extension(mod_obj.__name__)
+            if not prepared and cogname in sys.modules:
+                # Left over by a failed load, the file may have changed
+                importlib.reload(sys.modules[cogname])
+            self.bot.load_extension(cogname)
         except SyntaxError as e:
             raise CogLoadError(*e.args)
-        except:
-            raise
 
     def _unload_cog(self, cogname, reloading=False):
         if not reloading and cogname == "cogs.owner":
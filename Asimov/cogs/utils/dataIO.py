@@ -1,57 +1,718 @@
 import json
 import os
 import logging
-from random import randint
+import asyncio
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import count
+from .iostats import IOStats
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Default delay, in seconds, before a write-behind file is flushed to disk
+WRITE_BEHIND_INTERVAL = 5
+# Number of coalesced saves after which a write-behind file is flushed
+# right away, without waiting for the timer
+WRITE_BEHIND_MAX_PENDING = 25
+# Threads serializing and writing files for the async API
+IO_THREADS = 4
+# Storage backend of each dataset, see DataIO.open_dataset
+STORAGE_CONFIG = "data/red/storage.json"
+STORAGE_BACKENDS = ("json", "sqlite", "ledger", "shards")
+# When saves are flushed to the disk: never (left to the OS), the file
+# before it replaces the old one, or the file and its folder entry
+FSYNC_POLICIES = ("none", "file", "file+dir")
+# How json files are encoded: indented with sorted keys for the files
+# humans read and edit, or as small and fast to write as possible
+JSON_PROFILES = ("pretty", "compact")
+# Read cache: total size of the files whose parsed data is kept, and
+# number of files whose validity is remembered
+READ_CACHE_SIZE = 16 * 1024 ** 2
+READ_CACHE_FILES = 1024
+# Seconds between two checks of the files shared with other processes
+SHARED_REFRESH_INTERVAL = 5
 
 class InvalidFileIO(Exception):
     pass
 
+class Dataset(MutableMapping):
+    """Data kept by a storage backend instead of a json file
+
+    Mutations are stored row by row. Passing the dataset to
+    dataIO.save_json persists the changes made since the last save"""
+
+    def save(self):
+        raise NotImplementedError
+
+    def to_json(self):
+        """Returns the whole dataset as json data"""
+        raise NotImplementedError
+
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("red")
+        self._options = {}  # path: {option: value}
+        self._pending = {}  # path: (filename, data) waiting to be flushed
+        self._pending_count = {}
+        self._timers = {}
+        self._locks = {}  # path: asyncio.Lock ordering the async writes
+        self._executor = ThreadPoolExecutor(IO_THREADS)
+        # path: [(size, mtime), valid, parsed data or None, size], LRU
+        self._read_cache = OrderedDict()
+        self._read_cache_size = 0
+        self._read_cache_lock = threading.Lock()
+        self._mismatches = {}  # path: stamp of the file already reported
+        # Writes to disk, from the loop or the thread pool. For each path:
+        # a lock, the latest text queued and the number of the last save
+        # made / written. Saves are numbered before their data is encoded,
+        # queued texts replaced by newer ones are skipped
+        self._write_locks = {}
+        self._queued = {}  # path: (save number, text)
+        self._save_number = {}
+        self._written = {}  # path: (save number, success)
+        self._write_registry = threading.Lock()
+        self._tmp_number = count()
+        self._async_number = {}  # path: number of the last async save
+        # Files shared with other processes (shards), by path: a copy of
+        # the data as last loaded / saved by this one, the data it keeps
+        # in memory and the stamp of the file once its changes are in it
+        self.shared = False
+        self._baselines = {}
+        self._live = {}  # path: (filename, data)
+        self._seen = {}
+        self._refreshed = {}  # path: function rebuilding what's derived
+        self.stats = IOStats()
+
+    def configure(self, filename, *, write_behind=None, max_pending=None,
+                  fsync="none", profile="pretty"):
+        """Sets per-file saving options
+
+        write_behind: seconds during which the saves of this file are
+        merged in memory before a single atomic write. True uses the
+        default interval, None disables it.
+        max_pending: number of merged saves forcing an early flush
+        fsync: one of FSYNC_POLICIES
+        profile: one of JSON_PROFILES. The compact profile uses orjson
+        or ujson when installed"""
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy " + fsync)
+        if profile not in JSON_PROFILES:
+            raise ValueError("Unknown json profile " + profile)
+        path = self._key(filename)
+        if write_behind is True:
+            write_behind = WRITE_BEHIND_INTERVAL
+        if not write_behind:
+            self.flush(filename)
+        options = self._options.setdefault(path, {})
+        options["write_behind"] = write_behind
+        options["max_pending"] = max_pending or WRITE_BEHIND_MAX_PENDING
+        options["fsync"] = fsync
+        options["profile"] = profile
+
+    def share_between_processes(self):
+        """Makes the saves safe when other processes, like the other
+        shards of the bot, use the same files
+
+        A save then locks the file against the other processes and
+        merges the changes this process made since it loaded the file
+        with the ones the others saved meanwhile: key by key in dicts,
+        item by item in lists, this process winning where both changed
+        the same value. watch_shared brings the changes of the others
+        into the data loaded by this process."""
+        self.shared = True
+
+    def on_refresh(self, filename, callback):
+        """Sets the function called after refresh_shared has brought the
+        changes of the other processes into the data kept for filename,
+        to rebuild what is derived from it. Coroutine functions are
+        awaited. A cog loaded again replaces the function"""
+        self._refreshed[self._key(filename)] = callback
+
+    async def watch_shared(self, interval=SHARED_REFRESH_INTERVAL):
+        """Runs refresh_shared every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_shared()
+            except Exception:
+                self.logger.exception("Refresh of the shared files has "
+                                      "failed")
+
+    async def refresh_shared(self):
+        """Merges what the other processes saved to the shared files
+        into the data this process loaded / saved, in place"""
+        for path, (filename, live) in list(self._live.items()):
+            try:
+                stamp = self._stamp(filename)
+            except FileNotFoundError:
+                continue
+            if stamp == self._seen.get(path) or path in self._pending:
+                continue
+            baseline = self._baselines.get(path)
+            async with self._lock(path):
+                try:
+                    theirs = await self._run(self._shared_read,
+                                             self._read_json, filename)
+                except (FileNotFoundError, json.decoder.JSONDecodeError):
+                    continue
+            if self._baselines.get(path) is not baseline:
+                continue  # Saved meanwhile, checked again next time
+            if not _update(live, _merge(baseline, live, theirs)):
+                continue
+            self._baselines[path] = theirs
+            self._seen[path] = stamp
+            callback = self._refreshed.get(path)
+            if callback is None:
+                continue
+            try:
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                self.logger.exception("Refresh of {} has failed"
+                                      "".format(filename))
 
     def save_json(self, filename, data):
-        """Atomically saves json file"""
-        rnd = randint(1000, 9999)
-        path, ext = os.path.splitext(filename)
-        tmp_file = "{}-{}.tmp".format(path, rnd)
-        self._save_json(tmp_file, data)
-        try:
-            self._read_json(tmp_file)
-        except json.decoder.JSONDecodeError:
-            self.logger.exception("Attempted to write file {} but JSON "
-                                  "integrity check on tmp file has failed. "
-                                  "The original file is unaltered."
-                                  "".format(filename))
-            return False
-        os.replace(tmp_file, filename)
-        return True
+        """Atomically saves json file
+
+        If the file is in write-behind mode and an event loop is
+        running the write is deferred and merged with the next ones"""
+        path = self._key(filename)
+        self.stats.called(path, "saves")
+        if self.shared:
+            self._keep(path, filename, data)
+        options = self._options.get(path, {})
+        if options.get("write_behind") and _running_loop() is not None:
+            self._defer(path, filename, data, options)
+            return True
+        self._pending.pop(path, None)
+        return self._atomic_save(filename, data)
+
+    async def save_json_async(self, filename, data):
+        """Atomically saves json file without blocking the event loop
+
+        Serialization and disk I/O run in the DataIO thread pool.
+        Saves of the same file are written in the order they were made"""
+        path = self._key(filename)
+        self.stats.called(path, "saves")
+        if self.shared:
+            self._keep(path, filename, data)
+        options = self._options.get(path, {})
+        if options.get("write_behind"):
+            self._defer(path, filename, data, options)
+            return True
+        self._pending.pop(path, None)
+        return await self._write_async(path, filename, data)
 
     def load_json(self, filename):
         """Loads json file"""
-        return self._read_json(filename)
+        path = self._key(filename)
+        self.stats.called(path, "loads")
+        self.flush(filename)
+        stamp = self._stamp_if_shared(filename)
+        data = self._shared_read(self._read_json, filename)
+        if self.shared:
+            self._loaded(path, filename, data, stamp)
+        return data
+
+    async def load_json_async(self, filename):
+        """Loads json file in the DataIO thread pool"""
+        path = self._key(filename)
+        self.stats.called(path, "loads")
+        await self._flush_async(path)
+        async with self._lock(path):
+            stamp = self._stamp_if_shared(filename)
+            data = await self._run(self._shared_read, self._read_json,
+                                   filename)
+        if self.shared:
+            self._loaded(path, filename, data, stamp)
+        return data
+
+    def _stamp_if_shared(self, filename):
+        # Taken before reading: a change made during the read is seen
+        # by the next refresh
+        if not self.shared:
+            return None
+        try:
+            return self._stamp(filename)
+        except FileNotFoundError:
+            return None
+
+    def _shared_read(self, read, filename):
+        # Other processes save a shared file and its .crc under its lock
+        if not self.shared:
+            return read(filename)
+        with _process_lock(filename):
+            return read(filename)
+
+    def _loaded(self, path, filename, data, stamp):
+        self._baselines[path] = _snapshot(data)
+        self._seen[path] = stamp
+        self._keep(path, filename, data)
+
+    def _keep(self, path, filename, data):
+        # The data a cog keeps is the one it last loaded or saved
+        if isinstance(data, (dict, list)):
+            self._live[path] = (filename, data)
 
     def is_valid_json(self, filename):
         """Verifies if json file exists / is readable"""
+        self.flush(filename)
+        path = self._key(filename)
         try:
-            self._read_json(filename)
-            return True
+            stamp = self._stamp(filename)
         except FileNotFoundError:
+            self._forget(path)
             return False
+        with self._read_cache_lock:
+            entry = self._read_cache.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._read_cache.move_to_end(path)
+                self.stats.count(path, "cache_hits")
+                return entry[1]
+        try:
+            data = self._shared_read(self._parse_json, filename)
         except json.decoder.JSONDecodeError:
+            self._remember(path, stamp, False)
             return False
+        # Kept for the load_json call that usually follows
+        self._remember(path, stamp, True, data)
+        return True
+
+    def verify_json(self, filename):
+        """Checks a json file against the checksum of its last save
+
+        Returns None if the file wasn't saved by this version of DataIO"""
+        with open(filename, mode="rb") as f:
+            return self._verify(filename, f.read())
+
+    def _verify(self, filename, payload):
+        try:
+            with open(filename + ".crc", encoding='utf-8', mode="r") as f:
+                expected = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return _checksum(payload) == expected
+
+    def open_dataset(self, filename, *, depth=2):
+        """Loads a json file through its configured storage backend
+
+        With the default json backend this is load_json. Other backends
+        return a Dataset that can be used like the loaded dict.
+        depth is 2 for {server: {key: value}} files, 1 for {key: value}"""
+        backend = self.get_backend(filename)
+        if backend == "sqlite":
+            from .sqlstore import open_dataset
+            return open_dataset(filename, depth)
+        elif backend == "ledger":
+            from .ledger import open_dataset
+            return open_dataset(filename, depth)
+        elif backend == "shards":
+            from .shards import open_dataset
+            return open_dataset(filename, depth)
+        return self.load_json(filename)
+
+    def get_backend(self, filename):
+        try:
+            config = self._read_json(STORAGE_CONFIG)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return "json"
+        return config.get(self._config_key(filename), "json")
+
+    def set_backend(self, filename, backend):
+        """Changes the storage backend of a dataset
+
+        The data is carried over to the new backend. The cog owning the
+        file has to be reloaded for the change to be effective"""
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError("Unknown storage backend " + backend)
+        current = self.get_backend(filename)
+        if backend == current:
+            return
+        self.flush(filename)
+        if current != "json":
+            self.export_json(filename)
+        if current == "sqlite" or backend == "sqlite":
+            from .sqlstore import close_store, db_path
+            path = db_path(filename)
+            close_store(path)
+            if os.path.isfile(path):  # Stale, re-imported from the json
+                os.replace(path, path + ".old")
+        if current == "ledger" or backend == "ledger":
+            from .ledger import remove_ledger
+            remove_ledger(filename)
+        if current == "shards" or backend == "shards":
+            from .shards import remove_shards
+            remove_shards(filename)
+        try:
+            config = self._read_json(STORAGE_CONFIG)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            config = {}
+        if backend == "json":
+            config.pop(self._config_key(filename), None)
+        else:
+            config[self._config_key(filename)] = backend
+        self._atomic_save(STORAGE_CONFIG, config)
+
+    def export_json(self, filename, target=None):
+        """Writes a dataset to a json file, its own one by default
+
+        Used for backups of the datasets stored by other backends"""
+        self.flush(filename)
+        backend = self.get_backend(filename)
+        if backend == "sqlite":
+            from .sqlstore import db_path, open_store
+            data = open_store(db_path(filename)).export_data()
+        elif backend == "ledger":
+            from .ledger import open_ledger
+            ledger = open_ledger(filename)
+            ledger.save()
+            data = ledger.data
+        elif backend == "shards":
+            from .shards import open_dataset
+            dataset = open_dataset(filename, 2)
+            dataset.save()
+            data = dataset.to_json()
+        else:
+            data = self._read_json(filename)
+        return self._atomic_save(target or filename, data)
+
+    def flush(self, filename=None):
+        """Writes the pending write-behind saves to disk
+
+        Every pending file is flushed if no filename is passed"""
+        if filename is None:
+            paths = list(self._pending)
+        else:
+            paths = [self._key(filename)]
+        for path in paths:
+            timer = self._timers.pop(path, None)
+            if timer is not None:
+                timer.cancel()
+            self._pending_count.pop(path, None)
+            pending = self._pending.pop(path, None)
+            if pending is None:
+                continue
+            try:
+                self._atomic_save(*pending)
+            except Exception:
+                self.logger.exception("Write-behind flush of {} has failed"
+                                      "".format(pending[0]))
+
+    async def flush_async(self, filename=None):
+        """Same as flush, with the writes done in the thread pool"""
+        if filename is None:
+            paths = list(self._pending)
+        else:
+            paths = [self._key(filename)]
+        for path in paths:
+            await self._flush_async(path)
+
+    async def _flush_async(self, path):
+        timer = self._timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        self._pending_count.pop(path, None)
+        pending = self._pending.pop(path, None)
+        if pending is None:
+            return
+        try:
+            await self._write_async(path, *pending)
+        except Exception:
+            self.logger.exception("Write-behind flush of {} has failed"
+                                  "".format(pending[0]))
+
+    def _defer(self, path, filename, data, options):
+        self._pending[path] = (filename, data)
+        count = self._pending_count.get(path, 0) + 1
+        self._pending_count[path] = count
+        if count >= options["max_pending"]:
+            asyncio.ensure_future(self._flush_async(path))
+        elif path not in self._timers:
+            loop = _running_loop()
+            self._timers[path] = loop.call_later(
+                options["write_behind"],
+                lambda: asyncio.ensure_future(self._flush_async(path)))
+
+    async def _write_async(self, path, filename, data):
+        if isinstance(data, Dataset):
+            return data.save()
+        number = self._async_number[path] = self._async_number.get(path, 0) + 1
+        async with self._lock(path):
+            if self._async_number[path] != number:
+                # A newer save of this file is waiting for the lock, it
+                # will write its data instead of this outdated version
+                return True
+            # The loop goes on changing data while the thread pool
+            # encodes it: the pool gets a copy, quicker to make than text
+            data = _snapshot(data)
+            if self.shared:
+                return await self._run(self._shared_save, filename, data)
+            number = self._next_save(path)
+            text = await self._run(self._encode, path, data)
+            return await self._run(self._write_file, filename, text, number)
+
+    def _lock(self, path):
+        lock = self._locks.get(path)
+        if lock is None:
+            lock = self._locks[path] = asyncio.Lock()
+        return lock
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, partial(func, *args))
+
+    def _atomic_save(self, filename, data):
+        if isinstance(data, Dataset):
+            return data.save()
+        if self.shared:
+            return self._shared_save(filename, _snapshot(data))
+        path = self._key(filename)
+        number = self._next_save(path)
+        return self._write_file(filename, self._encode(path, data), number)
+
+    def _shared_save(self, filename, data):
+        """Saves data merged with what the other processes wrote to the
+        file, under a lock they respect too
+
+        data is a snapshot, kept as the baseline of the next merge"""
+        path = self._key(filename)
+        with _process_lock(filename):
+            try:
+                merged = _merge(self._baselines.get(path), data,
+                                self._read_json(filename))
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                merged = data
+            number = self._next_save(path)
+            ok = self._write_file(filename, self._encode(path, merged),
+                                  number)
+            if ok and merged == data:  # Nothing to refresh
+                self._seen[path] = self._stamp(filename)
+        if ok:
+            self._baselines[path] = data
+        return ok
+
+    def _next_save(self, path):
+        with self._write_registry:
+            number = self._save_number.get(path, 0) + 1
+            self._save_number[path] = number
+        return number
+
+    def _write_file(self, filename, text, number=None):
+        """Writes a file, safe to call from any thread
+
+        Writes of the same path are serialized. While a write is in
+        progress only the latest of the texts queued for that path is
+        kept, the callers of the others get the outcome of that write.
+        number is the one _next_save gave the save before its data was
+        encoded, a text encoded since then by a newer save wins"""
+        path = self._key(filename)
+        if number is None:
+            number = self._next_save(path)
+        with self._write_registry:
+            written = self._written.get(path)
+            queued = self._queued.get(path)
+            if ((written is None or written[0] < number) and
+                    (queued is None or queued[0] < number)):
+                self._queued[path] = (number, text)
+            lock = self._write_locks.get(path)
+            if lock is None:
+                lock = self._write_locks[path] = threading.Lock()
+        with lock:
+            with self._write_registry:
+                written = self._written.get(path)
+                if written is not None and written[0] >= number:
+                    return written[1]
+                number, text = self._queued.pop(path)
+            ok = False
+            try:
+                ok = self._replace_file(filename, text)
+            finally:
+                with self._write_registry:
+                    self._written[path] = (number, ok)
+            return ok
+
+    def _replace_file(self, filename, text):
+        """Writes the text to a tmp file then renames it over filename
+
+        The payload is checked in memory instead of re-reading the tmp
+        file, its checksum is kept in <filename>.crc and checked when the
+        file is parsed (see verify_json)"""
+        if isinstance(text, bytes):  # Already encoded by orjson
+            payload = text
+        else:
+            payload = text.encode('utf-8')
+        fsync = self._options.get(self._key(filename), {}).get("fsync")
+        start = time.perf_counter()
+        path, ext = os.path.splitext(filename)
+        tmp_file = "{}-{}-{}.tmp".format(path, os.getpid(),
+                                         next(self._tmp_number))
+        try:
+            f = open(tmp_file, mode="xb")
+        except FileExistsError:  # Left by a crashed process with our pid
+            os.remove(tmp_file)
+            f = open(tmp_file, mode="xb")
+        with f:
+            written = f.write(payload)
+            f.flush()
+            if fsync in ("file", "file+dir"):
+                os.fsync(f.fileno())
+        if written != len(payload) or not _looks_complete(payload):
+            self.logger.error("Attempted to write file {} but JSON "
+                              "integrity check on tmp file has failed. "
+                              "The original file is unaltered."
+                              "".format(filename))
+            os.remove(tmp_file)
+            return False
+        os.replace(tmp_file, filename)
+        # What was just written is known to be valid, no need to parse it
+        self._remember(self._key(filename), self._stamp(filename), True)
+        crc_file = "{}-{}-{}.crc.tmp".format(path, os.getpid(),
+                                             next(self._tmp_number))
+        with open(crc_file, encoding='utf-8', mode="w") as f:
+            f.write(_checksum(payload))
+            f.flush()
+            if fsync in ("file", "file+dir"):
+                os.fsync(f.fileno())
+        os.replace(crc_file, filename + ".crc")
+        if fsync == "file+dir":
+            _fsync_dir(filename)
+        path = self._key(filename)
+        self.stats.timed(path, "commit", (time.perf_counter() - start) * 1000)
+        self.stats.count(path, "writes")
+        self.stats.count(path, "bytes", len(payload))
+        return True
+
+    def _key(self, filename):
+        return os.path.normpath(filename)
+
+    def _profile(self, path):
+        return self._options.get(path, {}).get("profile", "pretty")
+
+    def _config_key(self, filename):
+        return self._key(filename).replace(os.sep, "/")
 
     def _read_json(self, filename):
-        with open(filename, encoding='utf-8', mode="r") as f:
-            data = json.load(f)
+        """Parses a json file, unless is_valid_json just did it
+
+        The parsed data of the cache is handed out once, as callers
+        are free to modify what they load"""
+        path = self._key(filename)
+        try:
+            stamp = self._stamp(filename)
+        except FileNotFoundError:
+            self._forget(path)
+            raise
+        with self._read_cache_lock:
+            entry = self._read_cache.get(path)
+            if (entry is not None and entry[0] == stamp and
+                    entry[2] is not None):
+                data = entry[2]
+                entry[2] = None
+                self._read_cache_size -= entry[3]
+                self.stats.count(path, "cache_hits")
+                return data
+        try:
+            data = self._parse_json(filename)
+        except json.decoder.JSONDecodeError:
+            self._remember(path, stamp, False)
+            raise
+        self._remember(path, stamp, True)
         return data
 
+    def _parse_json(self, filename):
+        with open(filename, mode="rb") as f:
+            payload = f.read()
+        try:
+            data = json.loads(payload.decode('utf-8'))
+        finally:
+            # Run when it can't be parsed too, to tell a damaged file
+            # from one edited by hand
+            if self._verify(filename, payload) is False:
+                self._mismatch(filename)
+        return data
+
+    def _mismatch(self, filename):
+        """Logs once that a file doesn't match the checksum of its save"""
+        path = self._key(filename)
+        try:
+            stamp = self._stamp(filename)
+        except FileNotFoundError:
+            return
+        with self._read_cache_lock:
+            if self._mismatches.get(path) == stamp:
+                return
+            self._mismatches[path] = stamp
+        self.logger.warning("{} doesn't match the checksum of its last save: "
+                            "it was changed outside of DataIO or is damaged"
+                            "".format(filename))
+
+    def _stamp(self, filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _remember(self, path, stamp, valid, data=None):
+        """Adds a file to the read cache, evicting the least recently
+        used entries past READ_CACHE_FILES / READ_CACHE_SIZE"""
+        size = stamp[0] if data is not None else 0
+        if size > READ_CACHE_SIZE:
+            data, size = None, 0
+        with self._read_cache_lock:
+            old = self._read_cache.pop(path, None)
+            if old is not None and old[2] is not None:
+                self._read_cache_size -= old[3]
+            self._read_cache[path] = [stamp, valid, data, size]
+            self._read_cache_size += size
+            while (len(self._read_cache) > READ_CACHE_FILES or
+                   self._read_cache_size > READ_CACHE_SIZE):
+                _, evicted = self._read_cache.popitem(last=False)
+                if evicted[2] is not None:
+                    self._read_cache_size -= evicted[3]
+
+    def _forget(self, path):
+        with self._read_cache_lock:
+            entry = self._read_cache.pop(path, None)
+            if entry is not None and entry[2] is not None:
+                self._read_cache_size -= entry[3]
+
     def _save_json(self, filename, data):
-        with open(filename, encoding='utf-8', mode="w") as f:
-            json.dump(data, f, indent=4,sort_keys=True,
-                separators=(',',' : '))
+        profile = self._profile(self._key(filename))
+        with open(filename, mode="wb") as f:
+            text = self._dump_json(data, profile)
+            f.write(text if isinstance(text, bytes) else text.encode('utf-8'))
         return data
 
+    def _dump_json(self, data, profile="pretty"):
+        """Encodes data, to bytes when orjson is used"""
+        if profile == "compact":
+            return _dump_compact(data)
+        return json.dumps(data, indent=4,sort_keys=True,
+            separators=(',',' : '))
+
+    def _encode(self, path, data):
+        """_dump_json with the profile of the path, timed"""
+        start = time.perf_counter()
+        text = self._dump_json(data, self._profile(path))
+        self.stats.timed(path, "serialize", (time.perf_counter() - start) * 1000)
+        return text
+
     def _legacy_fileio(self, filename, IO, data=None):
         """Old fileIO provided for backwards compatibility"""
         if IO == "save" and data != None:
@@ -64,6 +725,115 @@ class DataIO():
             raise InvalidFileIO("FileIO was called with invalid"
                 " parameters")
 
+_MISSING = object()
+
+def _merge(base, ours, theirs):
+    """Three-way merge of json data: the changes made from base to ours
+    applied to theirs. Dicts are merged key by key, lists item by item,
+    ours wins where both changed the same value"""
+    if ours == base:
+        return theirs
+    if theirs == base or theirs == ours:
+        return ours
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        if not isinstance(base, dict):
+            base = {}
+        merged = dict(theirs)
+        for key, value in ours.items():
+            value = _merge(base.get(key, _MISSING), value,
+                           theirs.get(key, _MISSING))
+            if value is _MISSING:
+                merged.pop(key, None)
+            else:
+                merged[key] = value
+        for key, value in base.items():
+            if key not in ours and theirs.get(key, _MISSING) == value:
+                merged.pop(key, None)  # Removed by ours
+        return merged
+    if isinstance(ours, list) and isinstance(theirs, list):
+        if not isinstance(base, list):
+            base = []
+        merged = [v for v in theirs if v in ours or v not in base]
+        merged.extend(v for v in ours if v not in base and v not in merged)
+        return merged
+    return ours
+
+def _update(data, new):
+    """Changes json data in place into new, keeping the dicts and lists
+    that are still there. Returns False if their types differ"""
+    if isinstance(data, dict) and isinstance(new, dict):
+        for key in [k for k in data if k not in new]:
+            del data[key]
+        for key, value in new.items():
+            current = data.get(key, _MISSING)
+            if current != value and not _update(current, value):
+                data[key] = _snapshot(value)
+        return True
+    if isinstance(data, list) and isinstance(new, list):
+        if data != new:
+            data[:] = _snapshot(new)
+        return True
+    return False
+
+def _snapshot(data):
+    """Copy of json data: only its dicts and lists can be changed"""
+    if isinstance(data, dict):  # defaultdicts too, like Mod's settings
+        return {key: _snapshot(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_snapshot(value) for value in data]
+    return data
+
+@contextmanager
+def _process_lock(filename):
+    """Exclusive lock on a file among processes and threads"""
+    with open(filename + ".lock", mode="a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _running_loop():
+    """Returns the event loop running in this thread, if any"""
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:  # Worker threads have no event loop
+        return None
+    return loop if loop.is_running() else None
+
+def _dump_compact(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    elif ujson is not None:
+        return ujson.dumps(data, ensure_ascii=False,
+                           escape_forward_slashes=False)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+def _looks_complete(payload):
+    """Cheap check that an encoded json document wasn't cut short"""
+    payload = payload.strip()
+    return (payload[:1], payload[-1:]) in ((b"{", b"}"), (b"[", b"]"))
+
+def _checksum(payload):
+    return "crc32:{:08x}:{}".format(zlib.crc32(payload), len(payload))
+
+def _fsync_dir(filename):
+    if not hasattr(os, "O_DIRECTORY"):  # Windows can't open folders
+        return
+    fd = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 def get_value(filename, key):
     with open(filename, encoding='utf-8', mode="r") as f:
         data = json.load(f)
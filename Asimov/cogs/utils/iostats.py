@@ -0,0 +1,141 @@
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds, in milliseconds, of the buckets of the time histograms
+BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+COUNTERS = ("saves", "writes", "bytes", "loads", "cache_hits")
+
+
+class Histogram:
+    """Counts durations in the BUCKETS they fall into"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+
+    def add(self, ms):
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        self.total += ms
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        rank = self.count * p / 100
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if n and seen >= rank:
+                return bound
+        return 0.0
+
+    def to_dict(self):
+        return {"buckets_ms": [str(b) for b in BUCKETS],
+                "counts": list(self.counts), "total_ms": self.total}
+
+
+class Stats:
+    """Counters and histograms of the file operations of one path or cog"""
+
+    def __init__(self):
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+        self.serialize = Histogram()
+        self.commit = Histogram()  # write, fsync and rename of a file
+
+    def merge(self, other):
+        for counter in COUNTERS:
+            setattr(self, counter,
+                    getattr(self, counter) + getattr(other, counter))
+        self.serialize.merge(other.serialize)
+        self.commit.merge(other.commit)
+
+    def to_dict(self):
+        data = {c: getattr(self, c) for c in COUNTERS}
+        data["serialize"] = self.serialize.to_dict()
+        data["commit"] = self.commit.to_dict()
+        return data
+
+
+class IOStats:
+    """Storage statistics collected by DataIO, per path and per cog
+
+    The operations of a path are credited to the last cog that saved or
+    loaded it, found by walking up the call stack."""
+
+    def __init__(self):
+        self.since = time.time()
+        self._paths = defaultdict(Stats)
+        self._owners = {}  # path: cog
+        self._lock = threading.Lock()
+
+    def called(self, path, counter):
+        """Counts a call of the DataIO API made by a cog"""
+        cog = calling_cog()
+        with self._lock:
+            if cog is not None:
+                self._owners[path] = cog
+            stats = self._paths[path]
+            setattr(stats, counter, getattr(stats, counter) + 1)
+
+    def count(self, path, counter, n=1):
+        with self._lock:
+            stats = self._paths[path]
+            setattr(stats, counter, getattr(stats, counter) + n)
+            if path not in self._owners:
+                self._owners[path] = calling_cog()
+
+    def timed(self, path, histogram, ms):
+        with self._lock:
+            getattr(self._paths[path], histogram).add(ms)
+
+    def paths(self):
+        with self._lock:
+            return {p: s for p, s in self._paths.items()}
+
+    def cogs(self):
+        cogs = defaultdict(Stats)
+        with self._lock:
+            for path, stats in self._paths.items():
+                cogs[self._owners.get(path) or "?"].merge(stats)
+        return dict(cogs)
+
+    def reset(self):
+        with self._lock:
+            self._paths.clear()
+            self.since = time.time()
+
+    def dump(self):
+        """Returns every statistic as json data"""
+        return {"since": self.since,
+                "paths": {p: dict(s.to_dict(), cog=self._owners.get(p))
+                          for p, s in self.paths().items()},
+                "cogs": {c: s.to_dict() for c, s in self.cogs().items()}}
+
+
+def calling_cog():
+    """Name of the first cog found in the call stack, red for the core"""
+    frame = sys._getframe(2)
+    core = False
+    while frame is not None:
+        name = frame.f_globals.get("__name__", "")
+        if name.startswith("cogs.") and not name.startswith("cogs.utils"):
+            return name[5:]
+        core = core or name == "__main__"
+        frame = frame.f_back
+    return "red" if core else None
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import os
+from copy import deepcopy
+from .dataIO import Dataset, dataIO, _process_lock, _running_loop
+
+# Size of the ledger file from which a new snapshot is written
+MAX_LEDGER_SIZE = 2 * 1024 ** 2
+
+log = logging.getLogger("red.ledger")
+
+_ledgers = {}  # json path: Ledger, shared by cog reloads
+
+
+class Ledger:
+    """Dataset kept in memory, persisted as a snapshot plus a change log
+
+    The json file is the snapshot. Every save appends one record per
+    changed value to <file>.ledger instead of rewriting the snapshot.
+    Once the ledger grows past MAX_LEDGER_SIZE a fresh snapshot is
+    written in the background and the ledger starts over.
+    On load the snapshot is read and the ledger replayed over it.
+    Values of datasets that aren't split per server use None as server.
+
+    When dataIO is shared between processes they all append to the same
+    ledger, under a lock. The snapshot is then made from the files, which
+    hold the records of every process, and the others open the new
+    ledger before their next append."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = os.path.splitext(filename)[0] + ".ledger"
+        self.old_path = self.path + ".old"
+        self._touched = {}  # (server, key): json of the value when read
+        self._records = []
+        self._compacting = False
+        self._shared = dataIO.shared
+        if self._shared:
+            with _process_lock(self.path):
+                self._load()
+        else:
+            self._load()
+        if self._log.tell() > MAX_LEDGER_SIZE:
+            self.compact()
+
+    def _load(self):
+        self.data = self._read_snapshot()
+        self._replay(self.old_path, self.data)
+        self._replay(self.path, self.data)
+        self._log = open(self.path, encoding='utf-8', mode="a")
+
+    def _read_snapshot(self):
+        # Not load_json: in shared mode dataIO would refresh the data
+        # returned from the snapshot file
+        try:
+            return dataIO._read_json(self.filename)
+        except FileNotFoundError:
+            return {}
+
+    def fetch(self, server, key):
+        bucket = self._bucket(server)
+        value = bucket[key]
+        if (server, key) not in self._touched:
+            self._touched[(server, key)] = _dumps(value)
+        return value
+
+    def set(self, server, key, value):
+        self._bucket(server, create=True)[key] = value
+        self._touched.pop((server, key), None)
+        self._records.append({"s": server, "k": key, "v": value})
+
+    def delete(self, server, key):
+        del self._bucket(server)[key]
+        self._touched.pop((server, key), None)
+        self._records.append({"s": server, "k": key, "d": True})
+
+    def replace_server(self, server, mapping):
+        self._forget(server)
+        self.data[server] = dict(mapping)
+        self._records.append({"s": server, "r": self.data[server]})
+
+    def drop_server(self, server):
+        self._forget(server)
+        del self.data[server]
+        self._records.append({"s": server, "d": True})
+
+    def save(self):
+        self._append()
+        if not self._compacting and self._log.tell() > MAX_LEDGER_SIZE:
+            if _running_loop() is not None:
+                asyncio.ensure_future(self.compact_async())
+            else:
+                self.compact()
+        return True
+
+    def compact(self):
+        """Writes a new snapshot and empties the ledger"""
+        if self._shared:
+            self._compact_shared(self._lines())
+            return
+        self._append()
+        self._rotate()
+        if dataIO._atomic_save(self.filename, self.data):
+            os.remove(self.old_path)
+
+    def _append(self):
+        """Writes the changes made since the last save to the ledger"""
+        if not self._shared:
+            self._write(self._lines())
+        elif not self._compacting:  # Else written once it is over
+            with _process_lock(self.path):
+                self._write(self._lines())
+
+    def _lines(self):
+        """Takes the changes made since the last save, as ledger lines"""
+        for (server, key), text in self._touched.items():
+            try:
+                value = self._bucket(server)[key]
+            except KeyError:
+                continue
+            if _dumps(value) != text:
+                self._records.append({"s": server, "k": key, "v": value})
+        self._touched.clear()
+        lines = "".join(_dumps(r) + "\n" for r in self._records)
+        self._records = []
+        return lines
+
+    def _write(self, lines):
+        if not lines:
+            return
+        if self._shared:
+            self._reopen()
+        self._log.write(lines)
+        self._log.flush()
+
+    def _reopen(self):
+        """Opens the ledger again if another process compacted it"""
+        try:
+            replaced = (os.stat(self.path).st_ino !=
+                        os.fstat(self._log.fileno()).st_ino)
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._log.close()
+            self._log = open(self.path, encoding='utf-8', mode="a")
+
+    async def compact_async(self):
+        """Same as compact, with the snapshot written in the thread pool
+
+        The changes made in the meantime go to the new ledger, which is
+        replayed over the snapshot in case they made it into it"""
+        self._compacting = True
+        try:
+            if self._shared:
+                await dataIO._run(self._compact_shared, self._lines())
+            else:
+                self._rotate()
+                path = dataIO._key(self.filename)
+                if await dataIO._write_async(path, self.filename, self.data):
+                    os.remove(self.old_path)
+        except Exception:
+            log.exception("Compaction of {} has failed".format(self.path))
+        finally:
+            self._compacting = False
+        if self._shared:  # The changes saved during the compaction
+            self._append()
+
+    def _compact_shared(self, lines):
+        with _process_lock(self.path):
+            self._write(lines)
+            if self._log.tell() <= MAX_LEDGER_SIZE:
+                return  # Just compacted by another process
+            self._rotate()
+            data = self._read_snapshot()
+            self._replay(self.old_path, data)
+            path = dataIO._key(self.filename)
+            if dataIO._write_file(self.filename, dataIO._encode(path, data)):
+                os.remove(self.old_path)
+
+    def close(self):
+        self.save()
+        self._log.close()
+
+    def _rotate(self):
+        self._log.close()
+        if os.path.isfile(self.old_path):  # Previous compaction failed
+            with open(self.old_path, encoding='utf-8', mode="a") as old, \
+                    open(self.path, encoding='utf-8', mode="r") as new:
+                old.write(new.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.old_path)
+        self._log = open(self.path, encoding='utf-8', mode="a")
+
+    def _bucket(self, server, create=False):
+        if server is None:
+            return self.data
+        if create and server not in self.data:
+            self.data[server] = {}
+        return self.data[server]
+
+    def _forget(self, server):
+        for touched in [k for k in self._touched if k[0] == server]:
+            del self._touched[touched]
+
+    def _replay(self, path, data):
+        try:
+            f = open(path, encoding='utf-8', mode="r")
+        except FileNotFoundError:
+            return
+        with f:
+            for n, line in enumerate(f, 1):
+                try:
+                    _apply(data, json.loads(line))
+                except (ValueError, KeyError):
+                    # An interrupted write can only damage the last line
+                    log.warning("Skipping bad record {} of {}"
+                                "".format(n, path))
+
+
+class LedgerDataset(Dataset):
+    """Maps server ids to the LedgerBucket holding their data"""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+
+    def __getitem__(self, server):
+        if server not in self.ledger.data:
+            raise KeyError(server)
+        return LedgerBucket(self.ledger, server)
+
+    def __setitem__(self, server, mapping):
+        self.ledger.replace_server(server, mapping)
+
+    def __delitem__(self, server):
+        self.ledger.drop_server(server)
+
+    def __contains__(self, server):
+        return server in self.ledger.data
+
+    def __iter__(self):
+        return iter(list(self.ledger.data))
+
+    def __len__(self):
+        return len(self.ledger.data)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.ledger.data, memo)
+
+    def save(self):
+        return self.ledger.save()
+
+    def to_json(self):
+        return self.ledger.data
+
+
+class LedgerBucket(Dataset):
+    """The values of a single server, seen as a dict"""
+
+    def __init__(self, ledger, server):
+        self.ledger = ledger
+        self.server = server
+
+    def __getitem__(self, key):
+        return self.ledger.fetch(self.server, key)
+
+    def __setitem__(self, key, value):
+        self.ledger.set(self.server, key, value)
+
+    def __delitem__(self, key):
+        self.ledger.delete(self.server, key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._data, memo)
+
+    @property
+    def _data(self):
+        return self.ledger._bucket(self.server)
+
+    def items(self):
+        return list(self._data.items())
+
+    def values(self):
+        return list(self._data.values())
+
+    def save(self):
+        return self.ledger.save()
+
+    def to_json(self):
+        return self._data
+
+
+def _apply(data, record):
+    server = record.get("s")
+    if "k" in record:
+        bucket = data if server is None else data.setdefault(server, {})
+        if record.get("d"):
+            bucket.pop(record["k"], None)
+        else:
+            bucket[record["k"]] = record["v"]
+    elif "r" in record:
+        data[server] = record["r"]
+    elif record.get("d"):
+        data.pop(server, None)
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def open_ledger(filename):
+    path = dataIO._key(filename)
+    ledger = _ledgers.get(path)
+    if ledger is None:
+        ledger = _ledgers[path] = Ledger(filename)
+    return ledger
+
+
+def close_ledger(filename):
+    ledger = _ledgers.pop(dataIO._key(filename), None)
+    if ledger is not None:
+        ledger.close()
+
+
+def remove_ledger(filename):
+    """Moves aside the ledger files left by a previous use of the backend"""
+    close_ledger(filename)
+    path = os.path.splitext(filename)[0] + ".ledger"
+    for p in (path, path + ".old"):
+        if os.path.isfile(p):
+            os.replace(p, p + ".bak")
+
+
+def open_dataset(filename, depth):
+    ledger = open_ledger(filename)
+    if depth == 1:
+        return LedgerBucket(ledger, None)
+    return LedgerDataset(ledger)
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import Counter
+
+# Records waiting to be written. Once the queue is LOG_SAMPLE_FROM full,
+# only one debug / info record out of LOG_SAMPLE_RATE is kept. When it
+# is full, records are dropped, errors wait up to LOG_BLOCK_TIMEOUT
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_FROM = 0.8
+LOG_SAMPLE_RATE = 10
+LOG_BLOCK_TIMEOUT = 0.05
+# Seconds between two notices of dropped records in a log under overload
+LOG_NOTICE_INTERVAL = 10
+
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_listener = None
+_lock = threading.Lock()
+dropped = Counter()  # (logger, "sampled" or "full"): records
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands the records of a logger to the logging thread, which
+    formats and writes them with handlers
+
+    Never blocks on a full queue, except briefly for errors"""
+
+    def __init__(self, handlers):
+        super().__init__(_queue)
+        self.handlers = handlers
+        self.unreported = 0  # Dropped since the last notice in the logs
+        self.noticed = 0.0
+        self._sampled = 0
+
+    def prepare(self, record):
+        # Formatting is left to the logging thread
+        return self, record
+
+    def enqueue(self, item):
+        record = item[1]
+        if (record.levelno < logging.WARNING and
+                self.queue.qsize() >= LOG_QUEUE_SIZE * LOG_SAMPLE_FROM):
+            self._sampled += 1
+            if self._sampled % LOG_SAMPLE_RATE:
+                self._drop(record, "sampled")
+                return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if record.levelno >= logging.ERROR:
+                try:
+                    self.queue.put(item, timeout=LOG_BLOCK_TIMEOUT)
+                    return
+                except queue.Full:
+                    pass
+            self._drop(record, "full")
+
+    def _drop(self, record, reason):
+        dropped[(record.name, reason)] += 1
+        self.unreported += 1
+
+
+class RoutingQueueListener(logging.handlers.QueueListener):
+    """Writes each record with the handlers of the logger it comes from"""
+
+    def handle(self, item):
+        source, record = item
+        for handler in source.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        # Once the queue is drained (the stop sentinel may be left) or
+        # from time to time under overload
+        if source.unreported and (self.queue.qsize() <= 1 or time.monotonic()
+                                  - source.noticed >= LOG_NOTICE_INTERVAL):
+            count, source.unreported = source.unreported, 0
+            source.noticed = time.monotonic()
+            notice = logging.makeLogRecord({
+                "name": "red.logqueue", "levelno": logging.WARNING,
+                "levelname": "WARNING", "module": "logqueue",
+                "funcName": "handle", "lineno": 0,
+                "msg": "{} log records dropped, the logs were written "
+                       "too slowly".format(count)})
+            for handler in source.handlers:
+                handler.handle(notice)
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Waits for room, unlike the base
+
+
+def queue_handler(*handlers):
+    """Returns a handler writing with handlers from the logging thread,
+    to add to a logger in their place"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            _listener = RoutingQueueListener(_queue)
+            _listener.start()
+            atexit.register(stop)
+    return BoundedQueueHandler(handlers)
+
+
+def stop():
+    """Writes the records still queued and stops the logging thread"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def queued():
+    return _queue.qsize()
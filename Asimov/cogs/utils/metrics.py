@@ -0,0 +1,197 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+           float("inf"))
+# Durations kept per command for the rolling percentiles
+LATENCY_WINDOW = 1000
+
+log = logging.getLogger("red.metrics")
+
+
+class Metrics:
+    """Counters, gauges and histograms in the Prometheus text format
+
+    Counters and histograms are updated by the bot as things happen.
+    Gauges are functions read when the metrics are rendered, from the
+    thread of the HTTP endpoint: they must be quick and thread safe."""
+
+    def __init__(self):
+        self._help = {}  # name: (type, help)
+        self._counters = defaultdict(lambda: defaultdict(float))
+        self._histograms = defaultdict(dict)  # name: {labels: [counts, sum]}
+        self._gauges = {}  # name: function
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help):
+        self._help[name] = (kind, help)
+
+    def inc(self, name, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._counters[name][key] += value
+
+    def observe(self, name, seconds, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                series = self._histograms[name][key] = [[0] * len(BUCKETS),
+                                                        0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+
+    def gauge(self, name, help, func):
+        """Registers a gauge, replacing the one with the same name
+
+        func returns a number, or a {labels dict as tuple: number} dict.
+        Gauges of a cog are removed with it, see forget()"""
+        self.describe(name, "gauge", help)
+        self._gauges[name] = func
+
+    def forget(self, owner):
+        """Removes the gauges whose function is a method of owner"""
+        for name, func in list(self._gauges.items()):
+            if getattr(func, "__self__", None) is owner:
+                del self._gauges[name]
+
+    def counter_values(self, name):
+        with self._lock:
+            return {k: v for k, v in self._counters.get(name, {}).items()}
+
+    def histogram_values(self, name):
+        """Returns {labels: (count, total seconds)}"""
+        with self._lock:
+            return {k: (sum(s[0]), s[1])
+                    for k, s in self._histograms.get(name, {}).items()}
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {n: dict(v) for n, v in self._counters.items()}
+            histograms = {n: {k: (list(s[0]), s[1]) for k, s in v.items()}
+                          for n, v in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append("{}{} {}".format(name, _format(key), value))
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, (counts, total) in sorted(series.items()):
+                seen = 0
+                for bound, n in zip(BUCKETS, counts):
+                    seen += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("{}_bucket{} {}".format(
+                        name, _format(key + (("le", le),)), seen))
+                lines.append("{}_sum{} {}".format(name, _format(key), total))
+                lines.append("{}_count{} {}".format(name, _format(key), seen))
+        for name, func in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                log.exception("Gauge {} has failed".format(name))
+                continue
+            self._header(lines, name, "gauge")
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    lines.append("{}{} {}".format(name, _format(key), v))
+            else:
+                lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        kind, help = self._help.get(name, (kind, ""))
+        if help:
+            lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+
+class CommandStats:
+    """Calls, errors, total time and rolling latency percentiles of
+    each command, by qualified name"""
+
+    def __init__(self):
+        self._stats = {}  # name: [calls, errors, total, deque of durations]
+
+    def record(self, name, seconds):
+        stats = self._get(name)
+        stats[0] += 1
+        stats[2] += seconds
+        stats[3].append(seconds)
+
+    def error(self, name):
+        self._get(name)[1] += 1
+
+    def summary(self):
+        """Returns (name, calls, errors, total, p50, p95, p99) tuples,
+        sorted by total time"""
+        rows = []
+        for name, (calls, errors, total, window) in self._stats.items():
+            durations = sorted(window)
+            rows.append((name, calls, errors, total,
+                         _percentile(durations, 50),
+                         _percentile(durations, 95),
+                         _percentile(durations, 99)))
+        rows.sort(key=lambda r: r[3], reverse=True)
+        return rows
+
+    def reset(self):
+        self._stats.clear()
+
+    def _get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = [0, 0, 0.0,
+                                         deque(maxlen=LATENCY_WINDOW)]
+        return stats
+
+
+def _percentile(durations, p):
+    if not durations:
+        return 0.0
+    return durations[min(len(durations) - 1, int(len(durations) * p / 100))]
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format(key):
+    if not key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\")
+                                             .replace('"', '\\"'))
+                          for k, v in key) + "}"
+
+
+def start_http_server(metrics, port, host="127.0.0.1"):
+    """Serves the metrics on http://host:port/metrics from a thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type",
+                             "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="metrics-http", daemon=True)
+    thread.start()
+    return server
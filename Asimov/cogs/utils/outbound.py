@@ -0,0 +1,273 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import weakref
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Priorities of the outbound requests, lowest first. A cog sets its own
+# with an outbound_priority attribute, NORMAL otherwise
+MODERATION = 0
+NORMAL = 5
+FUN = 9
+
+# Longest message Discord accepts, coalesced sends stay under it
+MAX_MESSAGE_LENGTH = 2000
+
+log = logging.getLogger("red.outbound")
+
+_current_task = getattr(asyncio, "current_task", None) or \
+    asyncio.Task.current_task
+_API_PREFIX = re.compile(r"^/api(?:/v\d+)?")
+_MAJOR = re.compile(r"^/(?:channels|guilds|webhooks)/\d+")
+_ID = re.compile(r"/\d+")
+
+
+def route_key(method, path):
+    """Rate limit bucket of a request, like Discord's: the method, the
+    channel / server it is about and the path with the other ids left out
+
+    path can be a full url of the API"""
+    path = _API_PREFIX.sub("", urlsplit(path).path)
+    major = _MAJOR.match(path)
+    split = major.end() if major else 0
+    return "{} {}{}".format(method.upper(), path[:split],
+                            _ID.sub("/{id}", path[split:]))
+
+
+class Bucket:
+    """Requests left to a route until its rate limit resets
+
+    Unknown until a first request to the route gets an answer, one
+    request at a time is sent meanwhile. Routes answered without rate
+    limit headers are not limited."""
+
+    __slots__ = ("known", "limit", "remaining", "reset_at", "inflight")
+
+    def __init__(self):
+        self.known = False
+        self.limit = None
+        self.remaining = 0
+        self.reset_at = 0.0  # loop.time()
+        self.inflight = 0
+
+    def delay(self, now):
+        """Seconds before a request can be sent, None until a request
+        in flight gets its answer"""
+        if not self.known:
+            return None if self.inflight else 0.0
+        if self.limit is None:
+            return 0.0
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = float("inf")  # Until the next answer
+        if self.remaining > 0:
+            return 0.0
+        if self.reset_at == float("inf"):
+            return None
+        return self.reset_at - now
+
+    def learn(self, now, limit, remaining, reset_after):
+        self.known = True
+        self.limit = limit
+        # Requests sent after this one are not counted by Discord yet
+        self.remaining = remaining - max(self.inflight - 1, 0)
+        self.reset_at = now + max(reset_after, 0.0)
+
+
+class Job:
+    __slots__ = ("priority", "seq", "key", "call", "content", "future",
+                 "coalesce", "waiters")
+
+    def __init__(self, priority, seq, key, call, content, future, coalesce):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.call = call
+        self.content = content
+        self.future = future
+        self.coalesce = coalesce
+        self.waiters = [future]
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Sends the bot's REST requests as fast as their rate limits allow
+
+    Every route has its bucket, learnt from the X-RateLimit headers of
+    Discord's answers. Queued requests leave by priority, then in the
+    order they came, as soon as their bucket has room: a route waiting
+    for its reset doesn't hold the others. Plain text messages queued
+    for the same channel can be merged into one when the caller allows
+    it."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._buckets = {}  # route key: Bucket
+        self._queues = {}  # route key: heap of jobs
+        self._last = {}  # route key: last job queued
+        self._priorities = weakref.WeakKeyDictionary()  # task: priority
+        self._global_reset = 0.0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = Counter()  # sent, coalesced, rate_limited
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def prioritize(self, priority):
+        """Sets the priority of what the current task sends, None for the
+        default one. Returns the previous priority"""
+        task = _current_task(loop=self.loop)
+        if task is None:
+            return None
+        previous = self._priorities.get(task)
+        if priority is None:
+            self._priorities.pop(task, None)
+        else:
+            self._priorities[task] = priority
+        return previous
+
+    def current_priority(self):
+        task = _current_task(loop=self.loop)
+        if task is None:
+            return NORMAL
+        return self._priorities.get(task, NORMAL)
+
+    async def submit(self, key, call, *, priority=None, content=None,
+                     coalesce=False):
+        """Queues call, a coroutine function, on the route key and returns
+        its result once sent
+
+        If coalesce, content is the text of a message that call sends:
+        it may be merged with the previous message queued on the route,
+        call then never runs and the merged message is returned."""
+        if priority is None:
+            priority = self.current_priority()
+        future = self.loop.create_future()
+        coalesce = coalesce and isinstance(content, str)
+        if coalesce and self._coalesce(key, content, priority, future):
+            return await future
+        job = Job(priority, next(self._seq), key, call, content, future,
+                  coalesce)
+        heapq.heappush(self._queues.setdefault(key, []), job)
+        self._last[key] = job
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+        self._wakeup.set()
+        return await future
+
+    def _coalesce(self, key, content, priority, future):
+        job = self._last.get(key)
+        if job is None or not job.coalesce or job.priority != priority:
+            return False
+        merged = job.content + "\n" + content
+        if len(merged) > MAX_MESSAGE_LENGTH:
+            return False
+        job.content = merged
+        job.waiters.append(future)
+        self.stats["coalesced"] += 1
+        return True
+
+    def observe(self, method, url, status, headers):
+        """Learns the rate limit of the route from an answer of Discord"""
+        now = self.loop.time()
+        if status == 429:
+            self.stats["rate_limited"] += 1
+            retry_after = _number(headers.get("Retry-After"), 1000) / 1000
+            log.info("Rate limited on {} {}, retrying in {:.2f} s"
+                     "".format(method, url, retry_after))
+            if headers.get("X-RateLimit-Global"):
+                self._global_reset = now + retry_after
+                self._wakeup.set()
+                return
+            bucket = self._bucket(route_key(method, url))
+            bucket.learn(now, bucket.limit or 1, 0, retry_after)
+            return
+        limit = headers.get("X-RateLimit-Limit")
+        if limit is None:
+            return
+        try:
+            reset_after = (float(headers["X-RateLimit-Reset"]) -
+                           parsedate_to_datetime(headers["Date"]).timestamp())
+        except (KeyError, TypeError, ValueError):
+            reset_after = 1.0
+        bucket = self._bucket(route_key(method, url))
+        bucket.learn(now, _number(limit, 1),
+                     _number(headers.get("X-RateLimit-Remaining"), 0),
+                     reset_after)
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket()
+        return bucket
+
+    async def _run(self):
+        while self._queues:
+            now = self.loop.time()
+            best = None
+            wait = None
+            for key, queue in self._queues.items():
+                delay = self._bucket(key).delay(now)
+                if delay is not None:
+                    delay = max(delay, self._global_reset - now)
+                if delay is not None and delay <= 0:
+                    if best is None or queue[0] < self._queues[best][0]:
+                        best = key
+                elif delay is not None:
+                    wait = delay if wait is None else min(wait, delay)
+            if best is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            queue = self._queues[best]
+            job = heapq.heappop(queue)
+            if not queue:
+                del self._queues[best]
+            if self._last.get(best) is job:
+                del self._last[best]
+            if all(f.done() for f in job.waiters):  # Cancelled
+                continue
+            bucket = self._bucket(best)
+            bucket.inflight += 1
+            bucket.remaining -= 1
+            self.loop.create_task(self._send(job))
+
+    async def _send(self, job):
+        bucket = self._bucket(job.key)
+        try:
+            if job.coalesce:
+                result = await job.call(job.content)
+            else:
+                result = await job.call()
+        except Exception as e:
+            for future in job.waiters:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in job.waiters:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.stats["sent"] += 1
+            bucket.inflight -= 1
+            bucket.known = True
+            self._wakeup.set()
+
+
+def _number(value, default):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,100 @@
+import datetime
+import linecache
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Seconds between two samples of the threads' stacks
+SAMPLE_INTERVAL = 0.005
+PROFILES_PATH = "data/red/profiles"
+
+# C functions have no frame: a thread sleeping in one of these is shown
+# running the line calling it
+_SLEEPING = re.compile(r"\btime\.sleep\(")
+
+
+class SamplingProfiler:
+    """Statistical profiler of every thread of the process
+
+    Samples the stacks of all the threads (event loop, thread pools,
+    audio downloaders...) at a fixed interval, without tracing
+    function calls, so it can run on the live bot."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()  # collapsed stack: samples
+        self.samples = 0
+
+    def run(self, seconds):
+        """Samples for the given seconds, blocking the calling thread"""
+        me = threading.get_ident()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {t.ident: _thread_name(t) for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self.stacks[_collapse(names.get(ident, "?"), frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def save(self, path=PROFILES_PATH):
+        """Writes the stacks in the collapsed format of flamegraph.pl and
+        speedscope, returns the file name"""
+        os.makedirs(path, exist_ok=True)
+        filename = os.path.join(path, "profile-{:%Y%m%d-%H%M%S}.txt".format(
+            datetime.datetime.now()))
+        with open(filename, encoding='utf-8', mode="w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+        return filename
+
+    def top(self, n=15, idle=False):
+        """Returns the (function, own samples, total samples) of the n
+        functions seen running the most
+
+        Threads waiting (sleep, select, locks) are left out unless idle"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if not idle and _is_idle(frames[-1]):
+                continue
+            own[frames[-1]] += count
+            for function in set(frames[1:]):
+                total[function] += count
+        return [(f, count, total[f]) for f, count in own.most_common(n)]
+
+
+_IDLE = ("selectors.", "threading.Condition.wait", "threading.Event.wait",
+         "threading.Thread._wait_for_tstate_lock", "queue.Queue.get",
+         "time.sleep", "concurrent.futures.thread._worker",
+         "socketserver.BaseServer.serve_forever")
+
+
+def _is_idle(function):
+    return function.startswith(_IDLE)
+
+
+def _thread_name(thread):
+    if type(thread) is not threading.Thread:  # Downloader, Timer...
+        return type(thread).__name__
+    return re.sub(r"[-_]?\d+$", "", thread.name) or thread.name
+
+
+def _collapse(thread, frame):
+    functions = []
+    if _SLEEPING.search(linecache.getline(frame.f_code.co_filename,
+                                          frame.f_lineno)):
+        functions.append("time.sleep")
+    while frame is not None:
+        code = frame.f_code
+        functions.append("{}.{}".format(
+            frame.f_globals.get("__name__", "?"),
+            getattr(code, "co_qualname", code.co_name)))
+        frame = frame.f_back
+    functions.append(thread)
+    return ";".join(reversed(functions))
@@ -2,6 +2,7 @@ from .dataIO import dataIO
 from copy import deepcopy
 import discord
 import os
+import re
 import argparse
 
 
@@ -24,6 +25,9 @@ class Settings:
                         "PREFIXES": []}
                         }
         self._memory_only = False
+        self.shard_id = 0
+        self.shard_count = 1
+        self._prefix_matchers = {}  # server id or None: compiled regex
 
         if not dataIO.is_valid_json(self.path):
             self.bot_settings = deepcopy(self.default_settings)
@@ -80,8 +84,26 @@ class Settings:
         parser.add_argument("--debug",
                             action="store_true",
                             help="Enables debug mode")
+        parser.add_argument("--metrics-port", type=int, default=9200,
+                            help="Local port of the Prometheus metrics "
+                                 "endpoint, 0 to disable it")
+        parser.add_argument("--shard-id", type=int, default=0,
+                            help="Shard run by this process, from 0")
+        parser.add_argument("--shard-count", type=int, default=1,
+                            help="Number of shards the bot is split in, "
+                                 "each run by its own process")
 
         args = parser.parse_args()
+        if not 0 <= args.shard_id < args.shard_count:
+            parser.error("--shard-id must be between 0 and --shard-count - 1")
+        if args.shard_count > 1:
+            dataIO.share_between_processes()
+            # The prefixes changed on another shard are matched again
+            dataIO.on_refresh(self.path, self._prefix_matchers.clear)
+            # Loaded again for the save below to only change what the
+            # arguments set, not what the other shards saved meanwhile
+            if dataIO.is_valid_json(self.path):
+                self.bot_settings = dataIO.load_json(self.path)
 
         if args.owner:
             self.owner = args.owner
@@ -98,6 +120,9 @@ class Settings:
         self._no_cogs = args.no_cogs
         self.debug = args.debug
         self._dry_run = args.dry_run
+        self.metrics_port = args.metrics_port
+        self.shard_id = args.shard_id
+        self.shard_count = args.shard_count
 
         self.save_settings()
 
@@ -192,6 +217,7 @@ class Settings:
     def prefixes(self, value):
         assert isinstance(value, list)
         self.bot_settings["PREFIXES"] = value
+        self._prefix_matchers.clear()  # Servers may use the global ones
 
     @property
     def default_admin(self):
@@ -279,6 +305,7 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["PREFIXES"] = prefixes
+        self._prefix_matchers.pop(server.id, None)
         self.save_settings()
 
     def get_prefixes(self, server):
@@ -286,6 +313,24 @@ class Settings:
         p = self.get_server_prefixes(server)
         return p if p else self.prefixes
 
+    def match_prefix(self, server, content):
+        """Returns the longest of the server's prefixes content starts
+        with, None if there is none"""
+        sid = server.id if server is not None else None
+        try:
+            matcher = self._prefix_matchers[sid]
+        except KeyError:
+            prefixes = sorted(self.get_prefixes(server), key=len,
+                              reverse=True)
+            matcher = None
+            if prefixes:
+                matcher = re.compile("|".join(map(re.escape, prefixes)))
+            self._prefix_matchers[sid] = matcher
+        if matcher is None:
+            return None
+        match = matcher.match(content)
+        return match.group(0) if match else None
+
     def add_server(self, sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
         self.save_settings()
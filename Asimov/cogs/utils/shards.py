@@ -0,0 +1,207 @@
+import logging
+import os
+import re
+import time
+from copy import deepcopy
+from .dataIO import Dataset, dataIO
+
+# Seconds without access after which a server's data leaves the memory
+SHARD_IDLE_TIME = 30 * 60
+# Seconds between two looks for idle shards
+SHARD_SWEEP_INTERVAL = 60
+
+SHARD_NAME = re.compile(r"^[\w-]+$")
+
+log = logging.getLogger("red.shards")
+
+_datasets = {}  # json path: ShardedDataset, shared by cog reloads
+
+
+class ShardedDataset(Dataset):
+    """Per server dataset stored as one json file per server
+
+    data/<cog>/<file>.json becomes data/<cog>/<file>/<server id>.json.
+    A server's file is loaded the first time its data is accessed and
+    dropped from the memory after SHARD_IDLE_TIME without access.
+    Saving writes the servers accessed since the last save, if they
+    changed."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.folder = folder(filename)
+        self._shards = {}  # server: data
+        self._saved = {}  # server: hash of the json last read/written
+        self._used = {}  # server: time of the last access
+        self._accessed = set()  # servers to look at on the next save
+        self._last_sweep = time.monotonic()
+        os.makedirs(self.folder, exist_ok=True)
+        self._servers = {os.path.splitext(f)[0]
+                         for f in os.listdir(self.folder)
+                         if f.endswith(".json")}
+
+    def __getitem__(self, server):
+        if server not in self._servers:
+            raise KeyError(server)
+        data = self._shards.get(server)
+        if data is None:
+            data = self._shards[server] = dataIO.load_json(self._path(server))
+            self._saved[server] = hash(self._dump(data))
+        self._touch(server)
+        return data
+
+    def __setitem__(self, server, mapping):
+        if not SHARD_NAME.match(server):
+            raise ValueError("{} can't be used as a shard name".format(server))
+        self._servers.add(server)
+        self._shards[server] = mapping
+        self._saved.pop(server, None)
+        self._touch(server)
+
+    def __delitem__(self, server):
+        if server not in self._servers:
+            raise KeyError(server)
+        self._servers.discard(server)
+        self._forget(server)
+        path = self._path(server)
+        for p in (path, path + ".crc"):
+            try:
+                os.remove(p)
+            except FileNotFoundError:  # Never saved
+                pass
+
+    def __contains__(self, server):
+        return server in self._servers
+
+    def __iter__(self):
+        return iter(list(self._servers))
+
+    def __len__(self):
+        return len(self._servers)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.to_json(), memo)
+
+    def save(self):
+        ok = True
+        for server in self._accessed:
+            if server in self._shards:
+                ok = self._write(server) and ok
+        self._accessed.clear()
+        return ok
+
+    def to_json(self):
+        return {s: self._shards[s] if s in self._shards
+                else dataIO.load_json(self._path(s)) for s in self._servers}
+
+    def loaded(self):
+        """Number of servers whose data is in memory"""
+        return len(self._shards)
+
+    def evict(self, idle=SHARD_IDLE_TIME):
+        """Drops from the memory the shards unused for idle seconds
+
+        Changes made to them since their last save are written first"""
+        now = time.monotonic()
+        self._last_sweep = now
+        for server, used in list(self._used.items()):
+            if now - used < idle:
+                continue
+            try:
+                self._write(server)
+            except Exception:
+                log.exception("Could not save the idle shard {} of {}"
+                              "".format(server, self.filename))
+                continue
+            self._forget(server)
+
+    def close(self):
+        self.save()
+        self.evict(idle=0)
+
+    def _touch(self, server):
+        now = time.monotonic()
+        self._used[server] = now
+        self._accessed.add(server)
+        if now - self._last_sweep > SHARD_SWEEP_INTERVAL:
+            self.evict()
+
+    def _write(self, server):
+        data = self._shards[server]
+        text = self._dump(data)
+        if hash(text) == self._saved.get(server):
+            return True
+        if dataIO._write_file(self._path(server), text):
+            self._saved[server] = hash(text)
+            return True
+        return False
+
+    def _forget(self, server):
+        self._shards.pop(server, None)
+        self._saved.pop(server, None)
+        self._used.pop(server, None)
+        self._accessed.discard(server)
+
+    def _dump(self, data):
+        return dataIO._dump_json(data, dataIO._profile(
+            dataIO._key(self.filename)))
+
+    def _path(self, server):
+        return os.path.join(self.folder, server + ".json")
+
+
+def folder(filename):
+    return os.path.splitext(filename)[0]
+
+
+def close_dataset(filename):
+    dataset = _datasets.pop(dataIO._key(filename), None)
+    if dataset is not None:
+        dataset.close()
+
+
+def remove_shards(filename):
+    """Moves aside the shards folder left by a previous use of the backend"""
+    close_dataset(filename)
+    path = folder(filename)
+    if os.path.isdir(path):
+        old = path + ".old"
+        if os.path.isdir(old):
+            os.replace(old, "{}.{}".format(old, int(time.time())))
+        os.replace(path, old)
+
+
+def import_json(filename):
+    """Splits a monolithic json file into one file per server"""
+    try:
+        data = dataIO.load_json(filename)
+    except FileNotFoundError:
+        data = {}
+    for server, mapping in data.items():
+        if not isinstance(mapping, dict) or not SHARD_NAME.match(server):
+            raise ValueError("{} is not a per server dataset"
+                             "".format(filename))
+    path = folder(filename)
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    profile = dataIO._profile(dataIO._key(filename))
+    for server, mapping in data.items():
+        dataIO._write_file(os.path.join(tmp, server + ".json"),
+                           dataIO._dump_json(mapping, profile))
+    os.replace(tmp, path)
+    log.info("{} split into {} server files".format(filename, len(data)))
+
+
+def open_dataset(filename, depth):
+    """Opens the sharded version of a json dataset
+
+    The json file is split the first time, then left untouched
+    until the dataset is exported back to it"""
+    if depth != 2:
+        raise ValueError("{} is not a per server dataset".format(filename))
+    path = dataIO._key(filename)
+    dataset = _datasets.get(path)
+    if dataset is None:
+        if not os.path.isdir(folder(filename)):
+            import_json(filename)
+        dataset = _datasets[path] = ShardedDataset(filename)
+    return dataset
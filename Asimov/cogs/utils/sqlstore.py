@@ -0,0 +1,299 @@
+import json
+import os
+import sqlite3
+from copy import deepcopy
+from .dataIO import Dataset
+
+# Server column of the rows of the datasets that aren't split per server
+GLOBAL = ""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS servers (
+    server TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS data (
+    server TEXT NOT NULL,
+    key    TEXT NOT NULL,
+    value  TEXT NOT NULL,
+    PRIMARY KEY (server, key)
+) WITHOUT ROWID;
+"""
+
+_stores = {}  # db path: SQLiteStore, shared by cog reloads
+
+
+class SQLiteStore:
+    """SQLite database holding one dataset
+
+    Every value is a json document stored in its own row, keyed by
+    server and key (usually an user id). Values read from the store are
+    remembered until the next commit, changes made to them in place are
+    written back at that moment."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._touched = {}  # (server, key): [value, json it was read from]
+
+    @property
+    def depth(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'depth'"
+                                ).fetchone()
+        return int(row[0]) if row else None
+
+    @depth.setter
+    def depth(self, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) "
+                          "VALUES ('depth', ?)", (str(value),))
+        self.conn.commit()
+
+    def fetch(self, server, key):
+        touched = self._touched.get((server, key))
+        if touched is not None:
+            return touched[0]
+        row = self.conn.execute("SELECT value FROM data WHERE server = ? "
+                                "AND key = ?", (server, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = json.loads(row[0])
+        self._touched[(server, key)] = [value, row[0]]
+        return value
+
+    def has(self, server, key):
+        if (server, key) in self._touched:
+            return True
+        row = self.conn.execute("SELECT 1 FROM data WHERE server = ? "
+                                "AND key = ?", (server, key)).fetchone()
+        return row is not None
+
+    def upsert(self, server, key, value):
+        text = _dumps(value)
+        self.add_server(server)
+        self.conn.execute("INSERT OR REPLACE INTO data (server, key, value) "
+                          "VALUES (?, ?, ?)", (server, key, text))
+        self._touched[(server, key)] = [value, text]
+
+    def delete(self, server, key):
+        self._touched.pop((server, key), None)
+        cursor = self.conn.execute("DELETE FROM data WHERE server = ? "
+                                   "AND key = ?", (server, key))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def keys(self, server):
+        cursor = self.conn.execute("SELECT key FROM data WHERE server = ?",
+                                   (server,))
+        return [row[0] for row in cursor]
+
+    def items(self, server):
+        """Returns the (key, value) pairs of a server in one query
+
+        Unlike fetch() the values aren't tracked, assign them back to
+        persist the changes made to them"""
+        cursor = self.conn.execute("SELECT key, value FROM data "
+                                   "WHERE server = ?", (server,))
+        items = []
+        for key, text in cursor:
+            touched = self._touched.get((server, key))
+            items.append((key, touched[0] if touched else json.loads(text)))
+        return items
+
+    def count(self, server):
+        return self.conn.execute("SELECT COUNT(*) FROM data WHERE server = ?",
+                                 (server,)).fetchone()[0]
+
+    def servers(self):
+        cursor = self.conn.execute("SELECT server FROM servers "
+                                   "WHERE server != ?", (GLOBAL,))
+        return [row[0] for row in cursor]
+
+    def has_server(self, server):
+        row = self.conn.execute("SELECT 1 FROM servers WHERE server = ?",
+                                (server,)).fetchone()
+        return row is not None
+
+    def add_server(self, server):
+        self.conn.execute("INSERT OR IGNORE INTO servers (server) VALUES (?)",
+                          (server,))
+
+    def drop_server(self, server):
+        for touched in [k for k in self._touched if k[0] == server]:
+            del self._touched[touched]
+        self.conn.execute("DELETE FROM data WHERE server = ?", (server,))
+        cursor = self.conn.execute("DELETE FROM servers WHERE server = ?",
+                                   (server,))
+        return cursor.rowcount != 0
+
+    def replace_server(self, server, mapping):
+        # Read first, the mapping can be the bucket of this very server
+        rows = [(server, k, _dumps(v)) for k, v in mapping.items()]
+        self.drop_server(server)
+        self.add_server(server)
+        self.conn.executemany("INSERT INTO data (server, key, value) "
+                              "VALUES (?, ?, ?)", rows)
+
+    def commit(self):
+        """Writes back the values changed in place and commits"""
+        for (server, key), (value, text) in self._touched.items():
+            new_text = _dumps(value)
+            if new_text != text:
+                self.conn.execute("INSERT OR REPLACE INTO data "
+                                  "(server, key, value) VALUES (?, ?, ?)",
+                                  (server, key, new_text))
+        self._touched.clear()
+        self.conn.commit()
+
+    def import_data(self, data, depth):
+        """Replaces the content of the store with json data"""
+        self._touched.clear()
+        self.conn.execute("DELETE FROM data")
+        self.conn.execute("DELETE FROM servers")
+        if depth == 1:
+            self.replace_server(GLOBAL, data)
+        else:
+            for server, mapping in data.items():
+                if not isinstance(mapping, dict):
+                    raise ValueError("{} is not a per server dataset"
+                                     "".format(self.path))
+                self.replace_server(server, mapping)
+        self.conn.commit()
+        self.depth = depth
+
+    def export_data(self):
+        """Returns the content of the store as json data"""
+        self.commit()
+        if self.depth == 1:
+            return dict(self.items(GLOBAL))
+        return {s: dict(self.items(s)) for s in self.servers()}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class SQLiteDataset(Dataset):
+    """Maps server ids to the SQLiteBucket holding their data"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, server):
+        if not self.store.has_server(server):
+            raise KeyError(server)
+        return SQLiteBucket(self.store, server)
+
+    def __setitem__(self, server, mapping):
+        self.store.replace_server(server, mapping)
+
+    def __delitem__(self, server):
+        if not self.store.drop_server(server):
+            raise KeyError(server)
+
+    def __contains__(self, server):
+        return self.store.has_server(server)
+
+    def __iter__(self):
+        return iter(self.store.servers())
+
+    def __len__(self):
+        return len(self.store.servers())
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.to_json(), memo)
+
+    def save(self):
+        self.store.commit()
+        return True
+
+    def to_json(self):
+        return self.store.export_data()
+
+
+class SQLiteBucket(Dataset):
+    """The rows of a single server, seen as a dict"""
+
+    def __init__(self, store, server):
+        self.store = store
+        self.server = server
+
+    def __getitem__(self, key):
+        return self.store.fetch(self.server, key)
+
+    def __setitem__(self, key, value):
+        self.store.upsert(self.server, key, value)
+
+    def __delitem__(self, key):
+        self.store.delete(self.server, key)
+
+    def __contains__(self, key):
+        return self.store.has(self.server, key)
+
+    def __iter__(self):
+        return iter(self.store.keys(self.server))
+
+    def __len__(self):
+        return self.store.count(self.server)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.to_json(), memo)
+
+    def items(self):
+        return self.store.items(self.server)
+
+    def values(self):
+        return [v for k, v in self.items()]
+
+    def save(self):
+        self.store.commit()
+        return True
+
+    def to_json(self):
+        return dict(self.items())
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def db_path(filename):
+    return os.path.splitext(filename)[0] + ".db"
+
+
+def open_store(path):
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = SQLiteStore(path)
+    return store
+
+
+def close_store(path):
+    store = _stores.pop(path, None)
+    if store is not None:
+        store.close()
+
+
+def open_dataset(filename, depth):
+    """Opens the SQLite database of a json dataset
+
+    The json file is imported the first time, then left untouched
+    until the dataset is exported back to it"""
+    path = db_path(filename)
+    is_new = not os.path.isfile(path)
+    store = open_store(path)
+    if is_new:
+        try:
+            with open(filename, encoding='utf-8', mode="r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        store.import_data(data, depth)
+    if depth == 1:
+        return SQLiteBucket(store, GLOBAL)
+    return SQLiteDataset(store)
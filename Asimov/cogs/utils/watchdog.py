@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+# Seconds the event loop can stay busy before it counts as blocked
+WATCHDOG_THRESHOLD = 0.25
+# Seconds between two heartbeats of the loop / two looks of the thread
+HEARTBEAT_INTERVAL = 0.1
+CHECK_INTERVAL = 0.05
+# Blocking events kept for [p]lag
+MAX_EVENTS = 50
+
+log = logging.getLogger("red.watchdog")
+
+
+class BlockingEvent:
+    """The loop was blocked for duration seconds by what stack shows"""
+
+    def __init__(self, started, stack, cog, function, command):
+        self.started = started  # time.time()
+        self.duration = 0.0
+        self.stack = stack
+        self.cog = cog
+        self.function = function
+        self.command = command
+
+    @property
+    def culprit(self):
+        if self.command:
+            return "{} ({})".format(self.command, self.cog or "?")
+        if self.function:
+            return "{}.{}".format(self.cog or "?", self.function)
+        return "?"
+
+
+class LoopWatchdog:
+    """Detects the callbacks blocking the event loop
+
+    A task of the loop beats every HEARTBEAT_INTERVAL. A thread checks
+    the last beat and, once the loop is late by WATCHDOG_THRESHOLD,
+    captures the stack of the loop thread to find what is running."""
+
+    def __init__(self, loop, threshold=WATCHDOG_THRESHOLD):
+        self.loop = loop
+        self.threshold = threshold
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.total = 0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._current = None  # BlockingEvent in progress
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self.loop.create_task(self._heartbeat())
+        thread = threading.Thread(target=self._watch, name="loop-watchdog",
+                                  daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._running = False
+
+    async def _heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        while self._running:
+            self._beat = time.monotonic()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _watch(self):
+        while self._running:
+            time.sleep(CHECK_INTERVAL)
+            late = time.monotonic() - self._beat - HEARTBEAT_INTERVAL
+            current = self._current
+            if late >= self.threshold:
+                if current is None:
+                    current = self._current = self._capture()
+                current.duration = late
+            elif current is not None:
+                self._current = None
+                self._report(current)
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return BlockingEvent(time.time(), [], None, None, None)
+        stack = traceback.format_stack(frame)
+        cog, function, command = attribute(frame)
+        return BlockingEvent(time.time(), stack, cog, function, command)
+
+    def _report(self, event):
+        self.total += 1
+        self.events.append(event)
+        log.warning("Event loop blocked for {:.0f} ms by {}\n{}".format(
+            event.duration * 1000, event.culprit, "".join(event.stack[-8:])))
+
+
+def attribute(frame):
+    """Returns the cog, function and command found in a stack
+
+    The innermost frame of a cog module gives the cog and the function,
+    a ctx local variable the command being invoked"""
+    cog = function = command = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if (cog is None and module.startswith("cogs.") and
+                not module.startswith("cogs.utils")):
+            cog = module[5:]
+            function = getattr(frame.f_code, "co_qualname",
+                               frame.f_code.co_name)
+        if command is None:
+            ctx = frame.f_locals.get("ctx")
+            name = getattr(getattr(ctx, "command", None), "qualified_name",
+                           None)
+            if isinstance(name, str):
+                command = name
+        if cog is not None and command is not None:
+            break
+        frame = frame.f_back
+    return cog, function, command
@@ -0,0 +1,137 @@
+import re
+
+# Longer words are searched one by one: the regex nests a group for each
+# character a word shares with others, too deep a nesting can't compile
+MAX_WORD_LENGTH = 100
+
+
+class _Node:
+    __slots__ = ("children", "end", "pattern")
+
+    def __init__(self):
+        self.children = {}
+        self.end = False  # A word ends here
+        self.pattern = None  # Regex of the branch, None until built
+
+
+class WordFilter:
+    """Finds the first of a set of words contained in a text, in one scan
+
+    The words are kept in a trie, compiled into a single regex in which
+    each character of the text is only compared with the words sharing
+    the prefix read so far. Adding or removing a word only changes its
+    path in the trie, compile() builds again the regex of the branches
+    on that path and reuses the others. Words added or removed are
+    searched once compiled, with compile() or compile_async()."""
+
+    def __init__(self, words=()):
+        self.words = set()
+        self._root = _Node()
+        self._long_words = set()
+        self._regex = None
+        self._long = ()
+        self._version = 0
+        for word in words:
+            self.add(word)
+        self.compile()
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word):
+        """Adds a word, returns False if it was already there"""
+        if not word or word in self.words:
+            return False
+        self.words.add(word)
+        if len(word) > MAX_WORD_LENGTH:
+            self._long_words.add(word)
+            return True
+        node = self._root
+        node.pattern = None
+        for char in word:
+            node = node.children.setdefault(char, _Node())
+            node.pattern = None
+        node.end = True
+        return True
+
+    def remove(self, word):
+        """Removes a word, returns False if it wasn't there"""
+        if word not in self.words:
+            return False
+        self.words.remove(word)
+        if len(word) > MAX_WORD_LENGTH:
+            self._long_words.remove(word)
+            return True
+        path = [self._root]
+        for char in word:
+            path.append(path[-1].children[char])
+        path[-1].end = False
+        for node in path:
+            node.pattern = None
+        # Drops the nodes only leading to the removed word
+        for parent, char, node in zip(path[-2::-1], word[::-1],
+                                      path[:0:-1]):
+            if node.end or node.children:
+                break
+            del parent.children[char]
+        return True
+
+    def compile(self):
+        self._version += 1
+        pattern = self._pattern()
+        self._regex = re.compile(pattern) if pattern is not None else None
+        self._long = tuple(sorted(self._long_words))
+
+    async def compile_async(self, loop):
+        """Compiles the words, the regex in the default executor"""
+        self._version += 1
+        version = self._version
+        pattern = self._pattern()
+        long_words = tuple(sorted(self._long_words))
+        regex = None
+        if pattern is not None:
+            regex = await loop.run_in_executor(None, re.compile, pattern)
+        if version == self._version:  # Not replaced by a later compile
+            self._regex, self._long = regex, long_words
+
+    def search(self, text):
+        """Returns the word found in text, None if there is none"""
+        if self._regex is not None:
+            match = self._regex.search(text)
+            if match:
+                return match.group()
+        for word in self._long:
+            if word in text:
+                return word
+        return None
+
+    def _pattern(self):
+        # Matching stops at the end of a word: a text containing one of the
+        # longer words of its branch contains that word too. The branches
+        # changed since the last compile are built children first,
+        # without recursion
+        if not self._root.children:
+            return None
+        stack = [(self._root, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node.pattern is not None:
+                continue
+            if node.end:
+                node.pattern = ""
+            elif not ready:
+                stack.append((node, True))
+                stack.extend((child, False)
+                             for child in node.children.values()
+                             if child.pattern is None)
+            else:
+                branches = [re.escape(char) + child.pattern
+                            for char, child in sorted(node.children.items())]
+                if len(branches) == 1:
+                    node.pattern = branches[0]
+                else:
+                    node.pattern = "(?:{})".format("|".join(branches))
+        return self._root.pattern
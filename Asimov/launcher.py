@@ -11,7 +11,9 @@ import platform
 import webbrowser
 import hashlib
 import argparse
+import json
 import shutil
+import signal
 import stat
 import time
 try:
@@ -29,6 +31,15 @@ INTRO = ("==========================\n"
          "Asimov - Discord Bot\n"
          "==========================\n")
 
+# Shard supervisor: status files written by the shards, seconds before
+# restarting a crashed shard (doubled for each crash in a row, reset
+# once it ran SHARD_STABLE_TIME), seconds given to a shard to log out
+SHARD_STATUS_PATH = os.path.join("data", "red", "shards")
+SHARD_RESTART_DELAY = 5
+SHARD_MAX_RESTART_DELAY = 300
+SHARD_STABLE_TIME = 300
+SHARD_STOP_TIMEOUT = 30
+
 IS_WINDOWS = os.name == "nt"
 IS_MAC = sys.platform == "darwin"
 IS_64BIT = platform.machine().endswith("64")
@@ -62,6 +73,12 @@ def parse_cli_arguments():
     parser.add_argument("--repair",
                         help="Issues a git reset --hard",
                         action="store_true")
+    parser.add_argument("--benchmark",
+                        help="Benchmarks Red and compares with the last run",
+                        action="store_true")
+    parser.add_argument("--shards",
+                        help="Runs Red as this many shard processes",
+                        type=int, default=1)
     return parser.parse_args()
 
 
@@ -320,6 +337,7 @@ def maintenance_menu():
         print("2. Supprimer dossier 'data' (Toutes les données sauvegardées)")
         print("3. Supprimer dossier 'lib' (Tous les modules et les paquets extérieurs)")
         print("4. Retour usine (Version totalement basique)")
+        print("5. Mesurer les performances (Comparées à la dernière mesure)")
         print("\n0. Retour")
         choice = user_choice()
         if choice == "1":
@@ -340,12 +358,15 @@ def maintenance_menu():
             if user_pick_yes_no():
                 reset_red(reqs=True, data=True, cogs=True, git_reset=True)
                 wait()
+        elif choice == "5":
+            run_benchmark()
+            wait()
         elif choice == "0":
             break
         clear_screen()
 
 
-def run_red(autorestart):
+def run_red(autorestart, shards=1):
     interpreter = sys.executable
 
     if interpreter is None: # This should never happen
@@ -356,6 +377,9 @@ def run_red(autorestart):
         if not INTERACTIVE_MODE:
             exit(1)
 
+    if shards > 1:
+        return run_shards(interpreter, shards)
+
     cmd = (interpreter, "red.py")
 
     while True:
@@ -380,6 +404,163 @@ def run_red(autorestart):
         wait()
 
 
+class Shard:
+    """A red.py process running one shard of the bot"""
+
+    def __init__(self, shard_id, count):
+        self.id = shard_id
+        self.count = count
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.crashes = 0  # In a row
+        self.restart_at = None
+        self.last_code = None
+
+    def start(self, interpreter):
+        self.process = subprocess.Popen(
+            (interpreter, "red.py", "--no-prompt", "--shard-id", str(self.id),
+             "--shard-count", str(self.count)))
+        self.started = time.time()
+        self.restart_at = None
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        if IS_WINDOWS:
+            self.process.terminate()
+        else:  # KeyboardInterrupt, red.py logs out and saves
+            self.process.send_signal(signal.SIGINT)
+
+    def status(self):
+        try:
+            path = os.path.join(SHARD_STATUS_PATH,
+                                "shard-{}.json".format(self.id))
+            with open(path, encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            status = {}
+        if self.process is None or status.get("pid") != self.process.pid:
+            status = {}  # Written by a previous process
+        if self.process is not None:
+            status["state"] = "connecté" if status.get("ready") else "démarrage"
+        elif self.restart_at is not None:
+            status["state"] = "redémarre dans {:.0f} s".format(
+                max(self.restart_at - time.time(), 0))
+        else:
+            status["state"] = "arrêté ({})".format(self.last_code)
+        status["restarts"] = self.restarts
+        return status
+
+
+def run_shards(interpreter, count):
+    """Runs and watches count shard processes
+
+    A shard exiting with code 26 ([p]restart) is restarted right away,
+    a crashed one after a delay. [p]shutdown in any shard stops them all"""
+    if not is_configured():
+        print("Lancez Asimov une première fois sans shards pour le "
+              "configurer.")
+        return
+    shards = [Shard(i, count) for i in range(count)]
+    for shard in shards:
+        shard.start(interpreter)
+    print("{} shards lancés.".format(count))
+    stopping = None  # Time by which the shards must have logged out
+    try:
+        while any(s.process is not None or s.restart_at is not None
+                  for s in shards):
+            time.sleep(1)
+            if stopping is not None and time.time() > stopping:
+                for shard in shards:
+                    if shard.process is not None:
+                        shard.process.kill()
+            for shard in shards:
+                if shard.process is None:
+                    if (shard.restart_at is not None and
+                            time.time() >= shard.restart_at):
+                        shard.start(interpreter)
+                    continue
+                code = shard.process.poll()
+                if code is None:
+                    continue
+                shard.process = None
+                shard.last_code = code
+                if stopping is not None:
+                    continue
+                if code == 0:
+                    print("Shard {} arrêté, arrêt des autres shards..."
+                          "".format(shard.id))
+                    stopping = time.time() + SHARD_STOP_TIMEOUT
+                    for other in shards:
+                        other.stop()
+                        other.restart_at = None
+                    continue
+                shard.restarts += 1
+                if code == 26:
+                    print("Redémarrage du shard {}...".format(shard.id))
+                    shard.crashes = 0
+                    shard.start(interpreter)
+                    continue
+                if time.time() - shard.started >= SHARD_STABLE_TIME:
+                    shard.crashes = 0
+                delay = min(SHARD_RESTART_DELAY * 2 ** shard.crashes,
+                            SHARD_MAX_RESTART_DELAY)
+                shard.crashes += 1
+                shard.restart_at = time.time() + delay
+                print("Le shard {} a planté (exit code {}), redémarrage dans "
+                      "{} s.".format(shard.id, code, delay))
+                print_shards_status(shards)
+    except KeyboardInterrupt:
+        # The shards got the interrupt too, they are logging out
+        deadline = time.time() + SHARD_STOP_TIMEOUT
+        for shard in shards:
+            if shard.process is None:
+                continue
+            try:
+                shard.process.wait(max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                shard.process.kill()
+    print_shards_status(shards)
+    print("Asimov arrêté.")
+
+    if INTERACTIVE_MODE:
+        wait()
+
+
+def print_shards_status(shards):
+    servers = 0
+    for shard in shards:
+        status = shard.status()
+        servers += status.get("servers", 0)
+        print("Shard {:>3}: {:<22} {:>6} serveurs, {} redémarrages"
+              "".format(shard.id, status["state"], status.get("servers", "?"),
+                        status["restarts"]))
+    print("Total: {} serveurs".format(servers))
+
+
+def is_configured():
+    try:
+        with open(os.path.join("data", "red", "settings.json"),
+                  encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return bool(settings.get("TOKEN") or settings.get("EMAIL"))
+
+
+def run_benchmark():
+    interpreter = sys.executable
+
+    if interpreter is None: # This should never happen
+        raise RuntimeError("Couldn't find Python's interpreter")
+
+    code = subprocess.call((interpreter, "benchmark.py"))
+    if code == 1:
+        print("Des régressions de performances ont été détectées.")
+    return code
+
+
 def clear_screen():
     if IS_WINDOWS:
         os.system("cls")
@@ -550,8 +731,10 @@ if __name__ == '__main__':
         install_reqs(audio=True)
     elif args.update_reqs_no_audio:
         install_reqs(audio=False)
+    if args.benchmark:
+        exit(run_benchmark())
     if INTERACTIVE_MODE:
         main()
     elif args.start:
         print("Starting Red...")
-        run_red(autorestart=args.auto_restart)
+        run_red(autorestart=args.auto_restart, shards=args.shards)
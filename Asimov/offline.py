@@ -0,0 +1,511 @@
+"""Offline stand-in for Discord, used by replay.py and benchmark.py
+
+FakeDiscord replaces the HTTP client of a bot: the REST routes used by
+Red answer from an in-memory copy of the servers, and their effects are
+sent back to the bot as the gateway events Discord would send.
+offline_bot() starts Red on it."""
+import asyncio
+import datetime
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from copy import deepcopy
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "lib"))
+
+from discord.http import HTTPClient
+
+# Messages kept per channel for logs_from
+HISTORY_SIZE = 1000
+
+EVERYONE_PERMISSIONS = 104324161
+ADMINISTRATOR = 8
+
+TEXT, VOICE, PRIVATE = 0, 2, 1
+
+MENTION = re.compile(r"<@!?(\d+)>")
+ROLE_MENTION = re.compile(r"<@&(\d+)>")
+
+
+class FakeDiscord(HTTPClient):
+    """Discord REST API answered from memory
+
+    Requests are counted per route in requests. latency seconds are
+    waited before each answer, to look like the real round trip."""
+
+    def __init__(self, *, loop=None, latency=0.0):
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.latency = latency
+        self.token = None
+        self.bot_token = True
+        self.requests = Counter()  # "METHOD path": count
+        self.unknown = Counter()
+        self.users = {}  # id: user
+        self.guilds = {}  # id: guild, with id keyed roles/members/channels
+        self.channels = {}  # channel id: guild id, None for private ones
+        self.history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+        self.bans = defaultdict(dict)  # guild id: {user id: user}
+        self.dms = {}  # user id: private channel id
+        self.connection = None
+        self._ids = 200000000000000000
+        self.me = self.add_user("Asimov", bot=True)
+        self.owner = self.add_user("Acrown")
+
+    # Building the servers
+
+    def snowflake(self):
+        self._ids += 1
+        return str(self._ids)
+
+    def add_user(self, name, *, bot=False):
+        user = {"id": self.snowflake(), "username": name,
+                "discriminator": "{:04}".format(self._ids % 10000),
+                "avatar": None, "bot": bot}
+        self.users[user["id"]] = user
+        return user
+
+    def add_server(self, name, *, members=50, channels=3,
+                   admin_role="Transistor", mod_role="Process"):
+        """Creates a server holding the bot, its owner and members users
+
+        The owner has the admin role, one member out of ten the mod role"""
+        gid = self.snowflake()
+        guild = {"id": gid, "name": name, "owner_id": self.owner["id"],
+                 "region": "eu-west", "verification_level": 0,
+                 "mfa_level": 0, "afk_timeout": 300, "icon": None,
+                 "splash": None, "features": [], "emojis": [],
+                 "roles": {}, "members": {}, "channels": {}}
+        self.guilds[gid] = guild
+        self._role(guild, gid, "@everyone", EVERYONE_PERMISSIONS, 0)
+        admin = self._role(guild, self.snowflake(), admin_role,
+                           ADMINISTRATOR, 2)
+        mod = self._role(guild, self.snowflake(), mod_role,
+                         EVERYONE_PERMISSIONS, 1)
+        self._member(guild, self.me, [admin["id"]])
+        self._member(guild, self.owner, [admin["id"]])
+        for n in range(members):
+            user = self.add_user("Membre{}".format(n))
+            self._member(guild, user, [mod["id"]] if n % 10 == 0 else [])
+        for n in range(channels):
+            cid = self.snowflake()
+            guild["channels"][cid] = {"id": cid, "guild_id": gid,
+                                      "name": "salon-{}".format(n),
+                                      "type": TEXT, "position": n,
+                                      "topic": None,
+                                      "permission_overwrites": []}
+            self.channels[cid] = gid
+        return guild
+
+    def _role(self, guild, rid, name, permissions, position):
+        role = {"id": rid, "name": name, "permissions": permissions,
+                "position": position, "color": 0, "hoist": False,
+                "managed": False, "mentionable": False}
+        guild["roles"][rid] = role
+        return role
+
+    def _member(self, guild, user, roles):
+        guild["members"][user["id"]] = {
+            "user": user, "roles": roles, "nick": None, "deaf": False,
+            "mute": False, "joined_at": _timestamp()}
+
+    def guild_payload(self, guild):
+        """A server in the format of GUILD_CREATE"""
+        data = {k: v for k, v in guild.items()
+                if k not in ("roles", "members", "channels")}
+        data.update(roles=list(guild["roles"].values()),
+                    members=list(guild["members"].values()),
+                    channels=list(guild["channels"].values()),
+                    member_count=len(guild["members"]), large=False,
+                    presences=[], voice_states=[])
+        return deepcopy(data)
+
+    def attach(self, bot):
+        """Replaces the HTTP client of bot and logs it in the servers"""
+        from discord import User
+        bot.http = self
+        self.connection = bot.connection
+        self.connection.user = User(**self.me)
+        for guild in self.guilds.values():
+            self.connection._add_server_from_data(self.guild_payload(guild))
+
+    # Gateway
+
+    def message(self, channel_id, author_id, content):
+        """A message written by a user, without sending it to the bot"""
+        data = self._message(channel_id, self.users[author_id], content)
+        channel = self.connection.get_channel(channel_id)
+        return self.connection._create_message(channel=channel,
+                                               **deepcopy(data))
+
+    def receive(self, channel_id, author_id, content):
+        """Sends MESSAGE_CREATE for a message written by a user"""
+        data = self._message(channel_id, self.users[author_id], content)
+        self.connection.parse_message_create(deepcopy(data))
+        return data
+
+    def _event(self, name, data):
+        """Sends a gateway event once the REST call has returned"""
+        if self.connection is not None:
+            parse = getattr(self.connection, "parse_" + name)
+            self.loop.call_soon(parse, deepcopy(data))
+
+    # REST
+
+    async def request(self, route, *, header_bypass_delay=None, **kwargs):
+        key = "{} {}".format(route.method, route.path)
+        self.requests[key] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = ROUTES.get((route.method, route.path))
+        if handler is None:
+            self.unknown[key] += 1
+            return {}
+        params = _parameters(route)
+        return deepcopy(handler(self, kwargs.get("json"),
+                                kwargs.get("params") or {}, **params))
+
+    async def close(self):
+        pass
+
+    def recreate(self):
+        pass
+
+    def _message(self, channel_id, author, content="", embed=None):
+        gid = self.channels.get(channel_id)
+        guild = self.guilds.get(gid)
+        content = content or ""
+        mentions = []
+        role_mentions = []
+        if guild is not None:
+            mentions = [guild["members"][i]["user"]
+                        for i in MENTION.findall(content)
+                        if i in guild["members"]]
+            role_mentions = [i for i in ROLE_MENTION.findall(content)
+                             if i in guild["roles"]]
+        data = {"id": self.snowflake(), "channel_id": channel_id,
+                "author": author, "content": content,
+                "timestamp": _timestamp(), "edited_timestamp": None,
+                "tts": False, "mention_everyone": "@everyone" in content,
+                "mentions": mentions, "mention_roles": role_mentions,
+                "attachments": [], "embeds": [embed] if embed else [],
+                "pinned": False, "type": 0}
+        self.history[channel_id].append(data)
+        return data
+
+    def _find_message(self, channel_id, message_id):
+        for data in self.history[channel_id]:
+            if data["id"] == message_id:
+                return data
+        return None
+
+    def _channel(self, channel_id):
+        return self.guilds[self.channels[channel_id]]["channels"][channel_id]
+
+    def _member_update(self, guild, user_id):
+        member = guild["members"][user_id]
+        self._event("guild_member_update", {
+            "guild_id": guild["id"], "user": member["user"],
+            "roles": member["roles"], "nick": member["nick"]})
+
+    # Routes, called with the json body, the query string and the values
+    # of the parameters of the path
+
+    def route_start_dm(self, json, params):
+        user = self.users[json["recipient_id"]]
+        cid = self.dms.get(user["id"])
+        if cid is None:
+            cid = self.dms[user["id"]] = self.snowflake()
+            self.channels[cid] = None
+        return {"id": cid, "type": PRIVATE, "recipients": [user],
+                "last_message_id": None}
+
+    def route_send_message(self, json, params, channel_id):
+        json = json or {}
+        data = self._message(channel_id, self.me, json.get("content"),
+                             json.get("embed"))
+        self._event("message_create", data)
+        return data
+
+    def route_typing(self, json, params, channel_id):
+        return None
+
+    def route_get_message(self, json, params, channel_id, message_id):
+        return self._find_message(channel_id, message_id) or {}
+
+    def route_logs_from(self, json, params, channel_id):
+        """Messages from the newest to the oldest, like Discord"""
+        history = list(self.history[channel_id])
+        limit = int(params.get("limit", 50))
+        if "before" in params:
+            history = [m for m in history if int(m["id"]) <
+                       int(params["before"])]
+        elif "after" in params:
+            history = [m for m in history if int(m["id"]) >
+                       int(params["after"])][:limit]
+        elif "around" in params:
+            ids = [int(m["id"]) for m in history]
+            middle = min(range(len(ids)), default=0, key=lambda i: abs(
+                ids[i] - int(params["around"])))
+            history = history[max(0, middle - limit // 2):][:limit]
+        return list(reversed(history[-limit:]))
+
+    def route_edit_message(self, json, params, channel_id, message_id):
+        data = self._find_message(channel_id, message_id)
+        if data is None:
+            return {}
+        json = json or {}
+        data["content"] = json.get("content", data["content"])
+        if "embed" in json:
+            data["embeds"] = [json["embed"]]
+        data["edited_timestamp"] = _timestamp()
+        self._event("message_update", data)
+        return data
+
+    def route_delete_message(self, json, params, channel_id, message_id):
+        data = self._find_message(channel_id, message_id)
+        if data is not None:
+            self.history[channel_id].remove(data)
+        self._event("message_delete", {"id": message_id,
+                                       "channel_id": channel_id})
+
+    def route_delete_messages(self, json, params, channel_id):
+        ids = set(json["messages"])
+        history = self.history[channel_id]
+        for data in [m for m in history if m["id"] in ids]:
+            history.remove(data)
+        self._event("message_delete_bulk", {"ids": list(ids),
+                                            "channel_id": channel_id})
+
+    def route_reaction(self, json, params, **ids):
+        return None
+
+    def route_edit_channel_permissions(self, json, params, channel_id, target):
+        channel = self._channel(channel_id)
+        overwrites = [o for o in channel["permission_overwrites"]
+                      if o["id"] != target]
+        if json is not None:
+            overwrites.append(json)
+        channel["permission_overwrites"] = overwrites
+        self._event("channel_update", channel)
+
+    def route_delete_channel_permissions(self, json, params, channel_id, target):
+        self.route_edit_channel_permissions(None, params, channel_id, target)
+
+    def route_add_role(self, json, params, guild_id, user_id, role_id):
+        roles = self.guilds[guild_id]["members"][user_id]["roles"]
+        if role_id not in roles:
+            roles.append(role_id)
+        self._member_update(self.guilds[guild_id], user_id)
+
+    def route_remove_role(self, json, params, guild_id, user_id, role_id):
+        roles = self.guilds[guild_id]["members"][user_id]["roles"]
+        if role_id in roles:
+            roles.remove(role_id)
+        self._member_update(self.guilds[guild_id], user_id)
+
+    def route_edit_member(self, json, params, guild_id, user_id):
+        guild = self.guilds[guild_id]
+        member = guild["members"][user_id]
+        for key in ("roles", "nick", "mute", "deaf"):
+            if key in json:
+                member[key] = json[key]
+        self._member_update(guild, user_id)
+
+    def route_change_my_nickname(self, json, params, guild_id):
+        self.route_edit_member(json, params, guild_id, self.me["id"])
+        return {"nick": json.get("nick")}
+
+    def route_kick(self, json, params, guild_id, user_id):
+        member = self.guilds[guild_id]["members"].pop(user_id)
+        self._event("guild_member_remove", {"guild_id": guild_id,
+                                            "user": member["user"]})
+
+    def route_ban(self, json, params, guild_id, user_id):
+        user = self.users[user_id]
+        self.bans[guild_id][user_id] = user
+        self._event("guild_ban_add", {"guild_id": guild_id, "user": user})
+        if user_id in self.guilds[guild_id]["members"]:
+            self.route_kick(json, params, guild_id, user_id)
+
+    def route_unban(self, json, params, guild_id, user_id):
+        user = self.bans[guild_id].pop(user_id, None)
+        if user is not None:
+            self._event("guild_ban_remove", {"guild_id": guild_id,
+                                             "user": user})
+
+    def route_get_bans(self, json, params, guild_id):
+        return [{"user": u, "reason": None}
+                for u in self.bans[guild_id].values()]
+
+    def route_create_role(self, json, params, guild_id):
+        guild = self.guilds[guild_id]
+        role = self._role(guild, self.snowflake(), "new role",
+                          EVERYONE_PERMISSIONS, len(guild["roles"]))
+        self._event("guild_role_create", {"guild_id": guild_id,
+                                          "role": role})
+        return role
+
+    def route_edit_role(self, json, params, guild_id, role_id):
+        role = self.guilds[guild_id]["roles"][role_id]
+        role.update(json or {})
+        self._event("guild_role_update", {"guild_id": guild_id,
+                                          "role": role})
+        return role
+
+    def route_delete_role(self, json, params, guild_id, role_id):
+        del self.guilds[guild_id]["roles"][role_id]
+        for member in self.guilds[guild_id]["members"].values():
+            if role_id in member["roles"]:
+                member["roles"].remove(role_id)
+        self._event("guild_role_delete", {"guild_id": guild_id,
+                                          "role_id": role_id})
+
+    def route_application_info(self, json, params):
+        return {"id": self.me["id"], "name": self.me["username"],
+                "description": "", "icon": None, "owner": self.owner}
+
+    def route_get_user(self, json, params, user_id):
+        return self.users.get(user_id, {})
+
+
+ROUTES = {
+    ("POST", "/users/@me/channels"): FakeDiscord.route_start_dm,
+    ("POST", "/channels/{channel_id}/messages"): FakeDiscord.route_send_message,
+    ("POST", "/channels/{channel_id}/typing"): FakeDiscord.route_typing,
+    ("GET", "/channels/{channel_id}/messages"): FakeDiscord.route_logs_from,
+    ("GET", "/channels/{channel_id}/messages/{message_id}"):
+        FakeDiscord.route_get_message,
+    ("PATCH", "/channels/{channel_id}/messages/{message_id}"):
+        FakeDiscord.route_edit_message,
+    ("DELETE", "/channels/{channel_id}/messages/{message_id}"):
+        FakeDiscord.route_delete_message,
+    ("POST", "/channels/{channel_id}/messages/bulk_delete"):
+        FakeDiscord.route_delete_messages,
+    ("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/"
+            "{emoji}/@me"): FakeDiscord.route_reaction,
+    ("DELETE", "/channels/{channel_id}/messages/{message_id}/reactions/"
+               "{emoji}/{member_id}"): FakeDiscord.route_reaction,
+    ("PUT", "/channels/{channel_id}/permissions/{target}"):
+        FakeDiscord.route_edit_channel_permissions,
+    ("DELETE", "/channels/{channel_id}/permissions/{target}"):
+        FakeDiscord.route_delete_channel_permissions,
+    ("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"):
+        FakeDiscord.route_add_role,
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"):
+        FakeDiscord.route_remove_role,
+    ("PATCH", "/guilds/{guild_id}/members/{user_id}"):
+        FakeDiscord.route_edit_member,
+    ("PATCH", "/guilds/{guild_id}/members/@me/nick"):
+        FakeDiscord.route_change_my_nickname,
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}"): FakeDiscord.route_kick,
+    ("PUT", "/guilds/{guild_id}/bans/{user_id}"): FakeDiscord.route_ban,
+    ("DELETE", "/guilds/{guild_id}/bans/{user_id}"): FakeDiscord.route_unban,
+    ("GET", "/guilds/{guild_id}/bans"): FakeDiscord.route_get_bans,
+    ("POST", "/guilds/{guild_id}/roles"): FakeDiscord.route_create_role,
+    ("PATCH", "/guilds/{guild_id}/roles/{role_id}"): FakeDiscord.route_edit_role,
+    ("DELETE", "/guilds/{guild_id}/roles/{role_id}"):
+        FakeDiscord.route_delete_role,
+    ("GET", "/oauth2/applications/@me"): FakeDiscord.route_application_info,
+    ("GET", "/users/{user_id}"): FakeDiscord.route_get_user,
+}
+
+_patterns = {}
+
+
+def _parameters(route):
+    """Values of the {parameters} of the path of a route, from its url"""
+    pattern = _patterns.get(route.path)
+    if pattern is None:
+        regex = re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(route.path))
+        pattern = _patterns[route.path] = re.compile(regex + "$")
+    return pattern.search(route.url).groupdict()
+
+
+def _timestamp():
+    return datetime.datetime.utcnow().isoformat() + "+00:00"
+
+
+def scratch_folder(copy_data=True):
+    """Makes a temporary bot folder the current one and returns it
+
+    cogs/ is linked to the real one, data/ copied if copy_data"""
+    path = tempfile.mkdtemp(prefix="asimov-offline-")
+    if copy_data and os.path.isdir(os.path.join(ROOT, "data")):
+        shutil.copytree(os.path.join(ROOT, "data"),
+                        os.path.join(path, "data"))
+    try:
+        os.symlink(os.path.join(ROOT, "cogs"), os.path.join(path, "cogs"))
+    except (OSError, NotImplementedError):  # Windows without privileges
+        shutil.copytree(os.path.join(ROOT, "cogs"), os.path.join(path, "cogs"))
+    os.chdir(path)
+    return path
+
+
+def offline_bot(*, servers=1, members=50, channels=3, latency=0.0,
+                cogs=None, prefix=None):
+    """Starts Red on FakeDiscord from the current folder
+
+    cogs lists the cogs to load instead of the enabled ones, none
+    but Owner if empty.
+    Returns the bot and the FakeDiscord it is attached to."""
+    # The settings read the command line
+    sys.argv = [sys.argv[0], "--no-prompt", "--memory-only",
+                "--metrics-port", "0"]
+    if prefix:
+        sys.argv += ["--prefix", prefix]
+    if cogs == []:
+        sys.argv.append("--no-cogs")
+
+    import red
+
+    bot = red.initialize()
+    import __main__
+    __main__.set_cog = red.set_cog
+    if not bot.settings.prefixes:
+        bot.settings.prefixes = ["!"]
+    bot.settings.owner = None  # The fake owner, from application_info
+
+    fake = FakeDiscord(loop=bot.loop, latency=latency)
+    for n in range(servers):
+        fake.add_server("Serveur {}".format(n), members=members,
+                        channels=channels,
+                        admin_role=bot.settings.default_admin,
+                        mod_role=bot.settings.default_mod)
+    fake.attach(bot)
+
+    red.check_folders()
+    red.load_cogs(bot, cogs or None)
+    return bot, fake
+
+
+def stop_bot(bot):
+    """Cancels what is left running on the loop of bot and closes it"""
+    loop = bot.loop
+    tasks = all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def all_tasks(loop):
+    tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+    return set(tasks(loop=loop))
+
+
+async def handle(fake, channel_id, author_id, content):
+    """Sends a message to the bot and returns the seconds it took to
+    handle it: until the tasks started by its dispatch have ended"""
+    loop = fake.loop
+    before = all_tasks(loop)
+    start = time.perf_counter()
+    fake.receive(channel_id, author_id, content)
+    tasks = all_tasks(loop) - before
+    if tasks:
+        await asyncio.wait(tasks)
+    return time.perf_counter() - start
@@ -7,6 +7,7 @@ import logging.handlers
 import traceback
 import datetime
 import subprocess
+import time
 
 try:
     assert sys.version_info >= (3, 5)
@@ -28,7 +29,13 @@ except AssertionError:
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import inline
-from collections import Counter
+from cogs.utils import logqueue
+from cogs.utils.metrics import CommandStats, Metrics, start_http_server
+from cogs.utils.outbound import FUN, NORMAL, OutboundScheduler, route_key
+from cogs.utils.watchdog import LoopWatchdog
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from io import TextIOWrapper
 
 #
@@ -42,27 +49,59 @@ from io import TextIOWrapper
 
 description = "Asimov - Bot multifonction de Acrown"
 
+# Seconds between two measures of the event loop lag
+LOOP_LAG_INTERVAL = 1
+# Status of each shard process, read by the launcher and [p]shards
+SHARD_STATUS_PATH = "data/red/shards"
+SHARD_STATUS_INTERVAL = 30
+# Threads importing the cogs and reading their data files at boot
+COG_LOADING_THREADS = 8
+# Help pages kept by the Formatter
+HELP_CACHE_SIZE = 512
+
+_current_task = getattr(asyncio, "current_task", None) or \
+    asyncio.Task.current_task
+
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
 
         def prefix_manager(bot, message):
             """
-            Returns prefixes of the message's server if set.
-            If none are set or if the message's server is None
-            it will return the global prefixes instead.
+            Returns the prefix the message starts with, among the
+            prefixes of the message's server if set or the global ones.
 
             Requires a Bot instance and a Message object to be
             passed as arguments.
             """
-            return bot.settings.get_prefixes(message.server)
+            last = bot._last_prefix_match
+            if last is not None and last[0] is message:  # dispatch_message
+                prefix = last[1]
+            else:
+                prefix = bot.settings.match_prefix(message.server,
+                                                   message.content)
+            return [prefix] if prefix is not None else []
 
         self.counter = Counter()
         self.uptime = datetime.datetime.utcnow()  # Refreshed before login
         self._message_modifiers = []
+        self._message_handlers = []  # (priority, handler), sorted
+        self._last_prefix_match = None  # (message, prefix)
+        self._staff_role_ids = {}  # server id: (role names, role ids)
+        self._running_commands = {}  # task: (ctx, command, start, priority)
+        self.metrics = Metrics()
+        self.command_stats = CommandStats()
+        self.loop_lag = 0.0
         self.settings = Settings()
         self._intro_displayed = False
         self._shutdown_mode = None
+        if "shard_count" not in kwargs and self.settings.shard_count > 1:
+            kwargs["shard_id"] = self.settings.shard_id
+            kwargs["shard_count"] = self.settings.shard_count
+        self.shard_id = kwargs.get("shard_id")
+        self.shard_count = kwargs.get("shard_count")
+        if (self.shard_count or 1) > 1:
+            dataIO.share_between_processes()
         self.logger = set_logger(self)
         if 'self_bot' in kwargs:
             self.settings.self_bot = kwargs['self_bot']
@@ -71,26 +110,110 @@ class Bot(commands.Bot):
             if self.settings.self_bot:
                 kwargs['pm_help'] = False
         super().__init__(*args, command_prefix=prefix_manager, **kwargs)
-
-    async def send_message(self, *args, **kwargs):
-        if self._message_modifiers:
-            if "content" in kwargs:
-                pass
-            elif len(args) == 2:
-                args = list(args)
-                kwargs["content"] = args.pop()
-            else:
-                return await super().send_message(*args, **kwargs)
-
-            content = kwargs['content']
+        self.watchdog = LoopWatchdog(self.loop)
+        self.outbound = OutboundScheduler(self.loop)
+        self._observe_rate_limits()
+        self.add_message_handler(self._command_handler, priority=100)
+        for event in ("on_server_role_create", "on_server_role_delete",
+                      "on_server_role_update"):
+            self.add_listener(self._forget_staff_roles, event)
+        self._register_metrics()
+
+    async def send_message(self, destination, content=None, *,
+                           priority=None, coalesce=None, **kwargs):
+        """Sends a message through the outbound scheduler
+
+        priority defaults to the one of the cog running the command.
+        If coalesce, a plain text message may be merged with the one
+        queued before it for the same channel, the merged message is
+        then returned to both callers. Only messages of FUN priority,
+        whose callers don't keep them, are merged by default."""
+        if content is not None and self._message_modifiers:
             for m in self._message_modifiers:
                 try:
                     content = str(m(content))
                 except:   # Faulty modifiers should not
                     pass  # break send_message
-            kwargs['content'] = content
 
-        return await super().send_message(*args, **kwargs)
+        if priority is None:
+            priority = self.outbound.current_priority()
+        if coalesce is None:
+            coalesce = priority >= FUN
+        send = partial(super().send_message, destination, **kwargs)
+        key = route_key("POST", "/channels/{}/messages".format(
+            getattr(destination, "id", None)))
+        if coalesce and not kwargs:  # No embed, no tts
+            return await self.outbound.submit(key, send, priority=priority,
+                                              content=content, coalesce=True)
+        return await self.outbound.submit(key, partial(send, content),
+                                          priority=priority)
+
+    # A message deleted after a while is never merged: the text of the
+    # other callers would be deleted with it
+
+    def say(self, *args, **kwargs):
+        return super().say(*args, **_unmerged_if_deleted(kwargs))
+
+    def whisper(self, *args, **kwargs):
+        return super().whisper(*args, **_unmerged_if_deleted(kwargs))
+
+    def reply(self, content, *args, **kwargs):
+        return super().reply(content, *args, **_unmerged_if_deleted(kwargs))
+
+    async def edit_message(self, message, *args, priority=None, **kwargs):
+        path = "/channels/{}/messages/{}".format(message.channel.id,
+                                                 message.id)
+        call = partial(super().edit_message, message, *args, **kwargs)
+        return await self.outbound.submit(route_key("PATCH", path), call,
+                                          priority=priority)
+
+    async def delete_message(self, message, *, priority=None):
+        path = "/channels/{}/messages/{}".format(message.channel.id,
+                                                 message.id)
+        call = partial(super().delete_message, message)
+        return await self.outbound.submit(route_key("DELETE", path), call,
+                                          priority=priority)
+
+    async def delete_messages(self, messages, *, priority=None):
+        messages = list(messages)
+        if not messages:  # discord.py raises the error
+            return await super().delete_messages(messages)
+        path = "/channels/{}/messages/bulk_delete".format(
+            messages[0].channel.id)
+        call = partial(super().delete_messages, messages)
+        return await self.outbound.submit(route_key("POST", path), call,
+                                          priority=priority)
+
+    async def edit_channel_permissions(self, channel, target, overwrite=None,
+                                       *, priority=None):
+        path = "/channels/{}/permissions/{}".format(channel.id, target.id)
+        call = partial(super().edit_channel_permissions, channel, target,
+                       overwrite)
+        return await self.outbound.submit(route_key("PUT", path), call,
+                                          priority=priority)
+
+    async def delete_channel_permissions(self, channel, target, *,
+                                         priority=None):
+        path = "/channels/{}/permissions/{}".format(channel.id, target.id)
+        call = partial(super().delete_channel_permissions, channel, target)
+        return await self.outbound.submit(route_key("DELETE", path), call,
+                                          priority=priority)
+
+    def _observe_rate_limits(self):
+        # Only discord.http sees Discord's answers, its session is wrapped
+        # to hand their rate limit headers to the scheduler
+        session = getattr(self.http, "session", None)
+        if session is None:
+            return
+        request = session.request
+        outbound = self.outbound
+
+        async def observed(method, url, **kwargs):
+            response = await request(method, url, **kwargs)
+            outbound.observe(method, url, response.status, response.headers)
+            return response
+
+        session.request = observed
 
     async def shutdown(self, *, restart=False):
         """Gracefully quits Red with exit code 0
@@ -98,6 +221,8 @@ class Bot(commands.Bot):
         If restart is True, the exit code will be 26 instead
         The launcher automatically restarts Red when that happens"""
         self._shutdown_mode = not restart
+        self.watchdog.stop()
+        await dataIO.flush_async()
         await self.logout()
 
     def add_message_modifier(self, func):
@@ -131,6 +256,206 @@ class Bot(commands.Bot):
         """Removes all message modifiers from the bot"""
         self._message_modifiers.clear()
 
+    def add_message_handler(self, handler, *, priority=50):
+        """
+        Adds a step to the message dispatch pipeline
+
+        handler is a coroutine function receiving the MessageContext
+        of every message the bot sees. Handlers run one after the other
+        by increasing priority. A handler returning True stops the
+        pipeline, for example after deleting the message.
+        Handlers of a cog are removed with the cog.
+        Core priorities: moderation 10, commands 100
+        """
+        if not asyncio.iscoroutinefunction(handler):
+            raise TypeError("Message handlers must be coroutine functions.")
+        self._message_handlers.append((priority, handler))
+        self._message_handlers.sort(key=lambda h: h[0])
+
+    def remove_message_handler(self, handler):
+        """Removes a step of the message dispatch pipeline"""
+        self._message_handlers = [h for h in self._message_handlers
+                                  if h[1] != handler]
+
+    async def dispatch_message(self, message):
+        """Runs a message through the message handlers"""
+        context = MessageContext(self, message)
+        for priority, handler in list(self._message_handlers):
+            start = time.perf_counter()
+            # What a cog's handler sends has the cog's priority
+            self.outbound.prioritize(getattr(getattr(handler, "__self__", None),
+                                             "outbound_priority", None))
+            try:
+                if await handler(context):
+                    break
+            except Exception:
+                self.logger.exception("Exception in message handler {}"
+                                      "".format(handler.__qualname__))
+            finally:
+                self._observe_listener(handler, start)
+        self.outbound.prioritize(None)
+
+    async def process_commands(self, message):
+        # The command found is announced by the "command" event, then
+        # invoked in there: it is timed until it ends or fails, checks
+        # and converters included, and what it sends has the priority of
+        # its cog. A command can process another message
+        task = _current_task(loop=self.loop)
+        outer = self._running_commands.pop(task, None)
+        try:
+            await super().process_commands(message)
+        finally:
+            running = self._running_commands.pop(task, None)
+            if outer is not None:
+                self._running_commands[task] = outer
+            if running is not None:
+                self._command_done(*running)
+
+    def _command_started(self, command, ctx):
+        task = _current_task(loop=self.loop)
+        previous = self.outbound.prioritize(getattr(
+            command.instance, "outbound_priority", NORMAL))
+        self._running_commands[task] = (ctx, command, time.perf_counter(),
+                                        previous)
+
+    def _command_done(self, ctx, command, start, previous):
+        elapsed = time.perf_counter() - start
+        self.outbound.prioritize(previous)
+        command = ctx.command or command  # The subcommand invoked if any
+        self.command_stats.record(command.qualified_name, elapsed)
+        self.metrics.observe("red_command_seconds", elapsed,
+                             command=command.qualified_name,
+                             cog=command.cog_name or "")
+
+    def dispatch(self, event, *args, **kwargs):
+        if event == "command":
+            self._command_started(*args[:2])
+        elif event == "command_error":
+            error, ctx = args[0], args[1]
+            command = ctx.command.qualified_name if ctx.command else ""
+            self.metrics.inc("red_command_errors_total", command=command,
+                             error=type(error).__name__)
+            if ctx.command is not None:
+                self.command_stats.error(command)
+        super().dispatch(event, *args, **kwargs)
+
+    async def _run_extra(self, coro, event_name, *args, **kwargs):
+        # Listeners added with add_listener, timed for the metrics
+        start = time.perf_counter()
+        try:
+            await super()._run_extra(coro, event_name, *args, **kwargs)
+        finally:
+            self._observe_listener(coro, start)
+
+    def _observe_listener(self, func, start):
+        cog = getattr(func, "__self__", None)
+        self.metrics.observe("red_listener_seconds",
+                             time.perf_counter() - start,
+                             listener=func.__qualname__,
+                             cog=type(cog).__name__ if cog else "")
+
+    @property
+    def shard_name(self):
+        """shard-<id> when the bot is split in several processes"""
+        if (self.shard_count or 1) > 1:
+            return "shard-{}".format(self.shard_id)
+        return None
+
+    async def report_shard_status(self):
+        """Writes the status of this shard for the launcher's supervisor
+        and the other shards"""
+        filename = os.path.join(SHARD_STATUS_PATH,
+                                "{}.json".format(self.shard_name))
+        while not self.is_closed:
+            status = {"shard": self.shard_id,
+                      "shard_count": self.shard_count,
+                      "pid": os.getpid(),
+                      "ready": self.is_logged_in and bool(self.servers),
+                      "servers": len(self.servers),
+                      "users": sum(s.member_count for s in self.servers),
+                      "voice_clients": len(self.voice_clients),
+                      "loop_lag": self.loop_lag,
+                      "uptime": (datetime.datetime.utcnow() -
+                                 self.uptime).total_seconds(),
+                      "updated": time.time()}
+            await dataIO.save_json_async(filename, status)
+            await asyncio.sleep(SHARD_STATUS_INTERVAL)
+
+    async def measure_loop_lag(self):
+        """Measures how late the event loop wakes up a sleeping task"""
+        while not self.is_closed:
+            start = self.loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag = max(0.0, self.loop.time() - start -
+                                LOOP_LAG_INTERVAL)
+            self.metrics.observe("red_loop_lag_seconds", self.loop_lag)
+
+    def _register_metrics(self):
+        m = self.metrics
+        m.describe("red_command_seconds", "histogram",
+                   "Time taken by commands, checks included")
+        m.describe("red_command_errors_total", "counter",
+                   "Commands that ended with an error")
+        m.describe("red_listener_seconds", "histogram",
+                   "Time taken by event listeners and message handlers")
+        m.describe("red_loop_lag_seconds", "histogram",
+                   "Delay of the event loop")
+        m.gauge("red_events", "Bot.counter values",
+                lambda: {(("event", k),): v for k, v in self.counter.items()})
+        m.gauge("red_servers", "Servers the bot is in",
+                lambda: len(self.servers))
+        m.gauge("red_voice_clients", "Voice connections",
+                lambda: len(self.voice_clients))
+        m.gauge("red_cogs", "Loaded cogs", lambda: len(self.cogs))
+        m.gauge("red_loop_lag_last_seconds", "Last event loop delay measured",
+                lambda: self.loop_lag)
+        m.gauge("red_dataio_pending_writes", "Write-behind saves not flushed",
+                lambda: len(dataIO._pending))
+        m.gauge("red_loop_blocked", "Times the event loop was blocked",
+                lambda: self.watchdog.total)
+        m.gauge("red_log_queued", "Log records waiting to be written",
+                logqueue.queued)
+        m.gauge("red_log_dropped", "Log records dropped under overload",
+                lambda: {(("logger", name), ("reason", reason)): count
+                         for (name, reason), count
+                         in logqueue.dropped.items()})
+        m.gauge("red_outbound_queued", "Requests waiting for their rate limit",
+                lambda: self.outbound.queued)
+        m.gauge("red_outbound_requests", "Requests of the outbound scheduler",
+                lambda: {(("kind", k),): v
+                         for k, v in self.outbound.stats.items()})
+
+    async def _command_handler(self, context):
+        if context.allowed:
+            await self.process_commands(context.message)
+
+    def load_extension(self, name):
+        try:
+            super().load_extension(name)
+        finally:  # A failed setup may have added commands
+            self.clear_help_cache()
+
+    def unload_extension(self, name):
+        try:
+            super().unload_extension(name)
+        finally:
+            self.clear_help_cache()
+
+    def clear_help_cache(self):
+        """Forgets the help pages kept by the formatter, if it keeps some"""
+        clear = getattr(self.formatter, "clear_cache", None)
+        if clear is not None:
+            clear()
+
+    def remove_cog(self, name):
+        cog = self.get_cog(name)
+        if cog is not None:
+            for priority, handler in list(self._message_handlers):
+                if getattr(handler, "__self__", None) is cog:
+                    self.remove_message_handler(handler)
+            self.metrics.forget(cog)
+        super().remove_cog(name)
+
     async def send_cmd_help(self, ctx):
         if ctx.invoked_subcommand:
             pages = self.formatter.format_help_for(ctx, ctx.invoked_subcommand)
@@ -141,7 +466,33 @@ class Bot(commands.Bot):
             for page in pages:
                 await self.send_message(ctx.message.channel, page)
 
-    def user_allowed(self, message):
+    def is_mod_or_superior(self, message):
+        """Owner, or admin / mod role of the message's server"""
+        author = message.author
+        if self.settings.owner == author.id:
+            return True
+        if message.channel.is_private:
+            return False
+        staff = self._staff_roles(message.server)
+        return any(r.id in staff for r in getattr(author, "roles", ()))
+
+    def _staff_roles(self, server):
+        """Ids of the server's roles named like its admin / mod roles
+
+        Cached per server until its roles change or the names are set"""
+        names = (self.settings.get_server_admin(server),
+                 self.settings.get_server_mod(server))
+        cached = self._staff_role_ids.get(server.id)
+        if cached is None or cached[0] != names:
+            ids = frozenset(r.id for r in server.roles if r.name in names)
+            cached = self._staff_role_ids[server.id] = (names, ids)
+        return cached[1]
+
+    async def _forget_staff_roles(self, role, after=None):
+        self._staff_role_ids.pop(role.server.id, None)
+
+    def user_allowed(self, message, *, is_mod=None):
+        """is_mod is the result of is_mod_or_superior, if already known"""
         author = message.author
 
         if author.bot:
@@ -153,31 +504,23 @@ class Bot(commands.Bot):
         mod = self.get_cog('Mod')
 
         if mod is not None:
-            if self.settings.owner == author.id:
+            if is_mod is None:
+                is_mod = self.is_mod_or_superior(message)
+            if is_mod:
                 return True
-            if not message.channel.is_private:
-                server = message.server
-                names = (self.settings.get_server_admin(
-                    server), self.settings.get_server_mod(server))
-                results = map(
-                    lambda name: discord.utils.get(author.roles, name=name),
-                    names)
-                for r in results:
-                    if r is not None:
-                        return True
-
-            if author.id in mod.blacklist_list:
+
+            if author.id in mod.blacklisted:
                 return False
 
-            if mod.whitelist_list:
-                if author.id not in mod.whitelist_list:
+            if mod.whitelisted:
+                if author.id not in mod.whitelisted:
                     return False
 
             if not message.channel.is_private:
-                if message.server.id in mod.ignore_list["SERVERS"]:
+                if message.server.id in mod.ignored_servers:
                     return False
 
-                if message.channel.id in mod.ignore_list["CHANNELS"]:
+                if message.channel.id in mod.ignored_channels:
                     return False
             return True
         else:
@@ -219,9 +562,83 @@ class Bot(commands.Bot):
         return await asyncio.wait_for(response, timeout=timeout)
 
 
+def _unmerged_if_deleted(kwargs):
+    if kwargs.get("delete_after") is not None:
+        kwargs.setdefault("coalesce", False)
+    return kwargs
+
+
+class MessageContext:
+    """What the message handlers need to know about a message
+
+    Computed once per message by Bot.dispatch_message.
+    prefix, command (the content after the prefix) and first_word
+    (lowercased) are None if the message doesn't start with a prefix"""
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.server = message.server
+        self.author = message.author
+        self.channel = message.channel
+        self.is_private = message.channel.is_private
+        self.prefix = bot.settings.match_prefix(self.server, message.content)
+        self.command = None
+        self.first_word = None
+        if self.prefix is not None:
+            self.command = message.content[len(self.prefix):]
+            self.first_word = self.command.split(" ")[0].lower()
+        bot._last_prefix_match = (message, self.prefix)
+        self._is_mod = None
+        self._allowed = None
+
+    @property
+    def is_mod(self):
+        """Owner, or admin / mod role of the server"""
+        if self._is_mod is None:
+            self._is_mod = self.bot.is_mod_or_superior(self.message)
+        return self._is_mod
+
+    @property
+    def allowed(self):
+        """Result of Bot.user_allowed"""
+        if self._allowed is None:
+            self._allowed = self.bot.user_allowed(self.message,
+                                                  is_mod=self.is_mod)
+        return self._allowed
+
+
 class Formatter(commands.HelpFormatter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # (command, prefix, invoked with, visible subcommands): pages
+        self._cache = OrderedDict()
+
+    def format_help_for(self, context, command_or_bot):
+        """Returns the help pages of a command, formatted once for each
+        prefix and set of subcommands the author is allowed to see"""
+        self.context = context
+        self.command = command_or_bot
+        key = (command_or_bot, self.clean_prefix, context.invoked_with,
+               self._visible_commands())
+        pages = self._cache.get(key)
+        if pages is None:
+            pages = self._cache[key] = self.format()
+            if len(self._cache) > HELP_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return list(pages)
+
+    def clear_cache(self):
+        """Forgets the help pages, to call when commands change"""
+        self._cache.clear()
+
+    def _visible_commands(self):
+        if isinstance(self.command, commands.Command) and \
+                not self.has_subcommands():
+            return ()
+        return tuple(name for name, command in self.filter_command_list())
 
     def _add_subcommands_to_page(self, max_width, commands):
         for name, command in sorted(commands, key=lambda t: t[0]):
@@ -235,10 +652,18 @@ class Formatter(commands.HelpFormatter):
             self._paginator.add_line(shortened)
 
 
-def initialize(bot_class=Bot, formatter_class=Formatter):
+def initialize(bot_class=Bot, formatter_class=Formatter, *, shard_id=None,
+               shard_count=None):
+    """Creates the bot, connected to the shard_id shard of shard_count
+    if given. The --shard-id / --shard-count arguments are used otherwise"""
     formatter = formatter_class(show_check_failure=False)
 
-    bot = bot_class(formatter=formatter, description=description, pm_help=None)
+    kwargs = {}
+    if shard_count is not None:
+        kwargs["shard_id"] = shard_id or 0
+        kwargs["shard_count"] = shard_count
+    bot = bot_class(formatter=formatter, description=description, pm_help=None,
+                    **kwargs)
 
     import __main__
     __main__.send_cmd_help = bot.send_cmd_help  # Backwards
@@ -341,8 +766,7 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     @bot.event
     async def on_message(message):
         bot.counter["messages_read"] += 1
-        if bot.user_allowed(message):
-            await bot.process_commands(message)
+        await bot.dispatch_message(message)
 
     @bot.event
     async def on_command_error(error, ctx):
@@ -452,13 +876,15 @@ def set_logger(bot):
         stdout_handler.setLevel(logging.INFO)
         logger.setLevel(logging.INFO)
 
+    # A log file per shard, the processes can't rotate the same one
+    suffix = "-" + bot.shard_name if bot.shard_name else ""
     fhandler = logging.handlers.RotatingFileHandler(
-        filename='data/red/red.log', encoding='utf-8', mode='a',
-        maxBytes=10**7, backupCount=5)
+        filename='data/red/red{}.log'.format(suffix), encoding='utf-8',
+        mode='a', maxBytes=10**7, backupCount=5)
     fhandler.setFormatter(red_format)
 
-    logger.addHandler(fhandler)
-    logger.addHandler(stdout_handler)
+    # Formatted and written by the logging thread
+    logger.addHandler(logqueue.queue_handler(fhandler, stdout_handler))
 
     dpy_logger = logging.getLogger("discord")
     if bot.settings.debug:
@@ -466,12 +892,13 @@ def set_logger(bot):
     else:
         dpy_logger.setLevel(logging.WARNING)
     handler = logging.FileHandler(
-        filename='data/red/discord.log', encoding='utf-8', mode='a')
+        filename='data/red/discord{}.log'.format(suffix), encoding='utf-8',
+        mode='a')
     handler.setFormatter(logging.Formatter(
         '%(asctime)s %(levelname)s %(module)s %(funcName)s %(lineno)d: '
         '%(message)s',
         datefmt="[%d/%m/%Y %H:%M]"))
-    dpy_logger.addHandler(handler)
+    dpy_logger.addHandler(logqueue.queue_handler(handler))
 
     return logger
 
@@ -500,16 +927,23 @@ def set_cog(cog, value):  # TODO: move this out of red.py
     dataIO.save_json("data/red/cogs.json", data)
 
 
-def load_cogs(bot):
+def load_cogs(bot, cogs=None):
+    """Loads the enabled cogs, or the ones listed in cogs without
+    reading or changing the saved list"""
     defaults = ("alias", "audio", "customcom", "downloader", "economy",
                 "general", "image", "mod", "streams", "trivia")
 
-    try:
-        registry = dataIO.load_json("data/red/cogs.json")
-    except:
-        registry = {}
+    if cogs is not None:
+        registry = {"cogs." + c: True for c in cogs}
+    else:
+        try:
+            registry = dataIO.load_json("data/red/cogs.json")
+        except:
+            registry = {}
 
+    boot = time.perf_counter()
     bot.load_extension('cogs.owner')
+    timings = [("cogs.owner", 0.0, time.perf_counter() - boot)]
     owner_cog = bot.get_cog('Owner')
     if owner_cog is None:
         print("Le module Owner n'est pas présent. Veuillez le réinstaller avant de continuer.")
@@ -528,25 +962,79 @@ def load_cogs(bot):
         for ext in defaults:
             registry["cogs." + ext] = True
 
-    for extension in extensions:
-        if extension.lower() == "cogs.owner":
-            continue
-        to_load = registry.get(extension, False)
-        if to_load:
+    extensions = [e for e in extensions if e.lower() != "cogs.owner" and
+                  registry.get(e, False)]
+
+    def prepare(extension):
+        start = time.perf_counter()
+        try:
+            owner_cog._prepare_cog(extension)
+        except Exception:
+            return None  # Raised again by _load_cog
+        return time.perf_counter() - start
+
+    # Imports and data files in the thread pool, setup() on the loop
+    # in the usual order, as soon as each cog is prepared
+    with ThreadPoolExecutor(COG_LOADING_THREADS) as executor:
+        prepared = [(e, executor.submit(prepare, e)) for e in extensions]
+        for extension, future in prepared:
+            prepare_time = future.result()
+            start = time.perf_counter()
             try:
-                owner_cog._load_cog(extension)
+                owner_cog._load_cog(extension,
+                                    prepared=prepare_time is not None)
             except Exception as e:
                 print("{}: {}".format(e.__class__.__name__, str(e)))
                 bot.logger.exception(e)
                 failed.append(extension)
                 registry[extension] = False
+            else:
+                timings.append((extension, prepare_time or 0.0,
+                                time.perf_counter() - start))
 
-    dataIO.save_json("data/red/cogs.json", registry)
+    if cogs is None:
+        dataIO.save_json("data/red/cogs.json", registry)
 
+    print_load_times(timings, time.perf_counter() - boot)
     if failed:
         print("\nFailed to load: {}\n".format(" ".join(failed)))
 
 
+def print_load_times(timings, elapsed):
+    """Prints what each cog took to load, slowest first"""
+    print("\n{:<20} {:>11} {:>11} {:>11}".format(
+        "Module", "Importation", "Activation", "Total"))
+    for name, prepare, setup in sorted(timings, key=lambda t: t[1] + t[2],
+                                       reverse=True):
+        print("{:<20} {:>8.1f} ms {:>8.1f} ms {:>8.1f} ms".format(
+            name[len("cogs."):], prepare * 1000, setup * 1000,
+            (prepare + setup) * 1000))
+    total = sum(t[1] + t[2] for t in timings)
+    print("{} modules chargés en {:.2f} s ({:.2f} s cumulées)\n".format(
+        len(timings), elapsed, total))
+
+
+def start_monitoring(bot):
+    bot.loop.create_task(bot.measure_loop_lag())
+    bot.watchdog.start()
+    if bot.shard_name:
+        os.makedirs(SHARD_STATUS_PATH, exist_ok=True)
+        bot.loop.create_task(bot.report_shard_status())
+        bot.loop.create_task(dataIO.watch_shared())
+    port = bot.settings.metrics_port
+    if not port:
+        return
+    port += bot.shard_id or 0  # One endpoint per shard
+    try:
+        start_http_server(bot.metrics, port)
+    except OSError as e:
+        bot.logger.warning("Metrics endpoint unavailable on port {}: {}"
+                           "".format(port, e))
+    else:
+        bot.logger.info("Metrics served on http://127.0.0.1:{}/metrics"
+                        "".format(port))
+
+
 def main(bot):
     check_folders()
     if not bot.settings.no_prompt:
@@ -558,7 +1046,12 @@ def main(bot):
         bot._shutdown_mode = True
         exit(0)
 
-    print("Connexion...")
+    start_monitoring(bot)
+    if bot.shard_name:
+        print("Connexion du shard {}/{}...".format(bot.shard_id + 1,
+                                                 bot.shard_count))
+    else:
+        print("Connexion...")
     bot.uptime = datetime.datetime.utcnow()
 
     if bot.settings.login_credentials:
@@ -595,6 +1088,8 @@ if __name__ == '__main__':
                              exc_info=e)
         loop.run_until_complete(bot.logout())
     finally:
+        dataIO.flush()
+        logqueue.stop()
         loop.close()
         if bot._shutdown_mode is True:
             exit(0)
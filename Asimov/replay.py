@@ -0,0 +1,195 @@
+"""Load test of the bot without Discord, run from the bot folder
+
+    python replay.py --messages 5000 --rate 200
+    python replay.py --stream messages.jsonl --cogs mod,economy
+
+Messages go through the gateway of offline.FakeDiscord, so the core
+handlers, process_commands and the listeners of the cogs see them as
+they would on Discord. The bot runs on a copy of data/ unless
+--in-place is given.
+
+A stream file holds one json message per line: {"content": "...",
+"author": user id, "channel": channel id}. Unknown or missing authors
+and channels are replaced by random members and channels of the fake
+servers."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+
+from offline import ROOT, handle, offline_bot, scratch_folder, stop_bot
+
+SYNTHETIC_COMMANDS = ("ping", "roll", "flip", "choose pile face",
+                      "8 Est-ce que ça marche ?", "bank balance",
+                      "leaderboard", "help ping")
+WORDS = ("salut", "bonjour", "merci", "oui", "non", "peut-être", "demain",
+         "ce", "soir", "jeu", "musique", "serveur", "bot", "lol", "ok",
+         "quelqu'un", "sait", "comment", "faire", "ça", "?", "!")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Asimov - Replay offline")
+    parser.add_argument("--messages", type=int, default=2000,
+                        help="Synthetic messages to send")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Messages per second, 0 for as fast as possible")
+    parser.add_argument("--commands", type=float, default=0.3,
+                        help="Share of synthetic messages that are commands")
+    parser.add_argument("--stream", help="json lines file of messages to "
+                                         "replay instead of synthetic ones")
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--members", type=int, default=100,
+                        help="Members per server")
+    parser.add_argument("--channels", type=int, default=3,
+                        help="Text channels per server")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds taken by each fake REST call")
+    parser.add_argument("--cogs", help="Comma separated cogs to load "
+                                       "instead of the enabled ones")
+    parser.add_argument("--prefix", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Writes the results to this file")
+    parser.add_argument("--in-place", action="store_true",
+                        help="Uses data/ instead of a copy of it")
+    return parser.parse_args()
+
+
+def synthetic_stream(rnd, count, prefix, commands):
+    for _ in range(count):
+        if rnd.random() < commands:
+            yield None, None, prefix + rnd.choice(SYNTHETIC_COMMANDS)
+        else:
+            yield None, None, " ".join(rnd.choice(WORDS)
+                                       for _ in range(rnd.randint(1, 12)))
+
+
+def file_stream(path):
+    with open(path, encoding='utf-8', mode="r") as f:
+        for line in f:
+            if line.strip():
+                message = json.loads(line)
+                yield (message.get("channel"), message.get("author"),
+                       message.get("content", ""))
+
+
+async def replay(bot, fake, stream, rate, rnd):
+    """Sends the messages at rate per second and returns the seconds taken
+    to handle each of them, until every task it started has ended"""
+    loop = bot.loop
+    channels = [c for c, g in fake.channels.items() if g is not None]
+    members = [u for g in fake.guilds.values() for u in g["members"]
+               if u not in (fake.me["id"], fake.owner["id"])]
+    latencies = []
+
+    async def send(channel, author, content):
+        latencies.append(await handle(fake, channel, author, content))
+
+    pending = set()
+    start = loop.time()
+    for n, (channel, author, content) in enumerate(stream):
+        if channel not in fake.channels:
+            channel = rnd.choice(channels)
+        if author not in fake.users:
+            author = rnd.choice(members)
+        delay = start + n / rate - loop.time() if rate else 0
+        await asyncio.sleep(max(delay, 0))
+        pending.add(loop.create_task(send(channel, author, content)))
+        pending = {t for t in pending if not t.done()}
+    if pending:
+        await asyncio.wait(pending)
+    return latencies, loop.time() - start
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(bot, fake, latencies, elapsed, rate):
+    latencies.sort()
+    commands = bot.command_stats.summary()
+    results = {
+        "messages": len(latencies), "seconds": elapsed, "rate": rate,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": {"p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "max": latencies[-1] if latencies else 0.0},
+        "requests": dict(fake.requests),
+        "unknown_routes": dict(fake.unknown),
+        "loop_blocked": bot.watchdog.total,
+        "commands": {name: {"calls": calls, "errors": errors,
+                            "seconds": total, "p95": p95}
+                     for name, calls, errors, total, p50, p95, p99
+                     in commands}}
+    print("\n{messages} messages in {seconds:.2f} s, {throughput:.1f} msg/s"
+          " (target {rate:g} msg/s)".format(**results))
+    print("Latency: p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, "
+          "max {max:.2f} ms".format(**{k: v * 1000 for k, v in
+                                       results["latency"].items()}))
+    print("Event loop blocked {} times".format(bot.watchdog.total))
+    print("\nREST calls: {}".format(sum(fake.requests.values())))
+    for route, count in fake.requests.most_common():
+        print("{:>8}  {}{}".format(count, route,
+                                   " (not emulated)" if route in fake.unknown
+                                   else ""))
+    if commands:
+        print("\n{:<24} {:>6} {:>5} {:>9} {:>8}".format(
+            "Command", "calls", "err.", "total s", "p95 ms"))
+        for name, calls, errors, total, p50, p95, p99 in commands:
+            print("{:<24} {:>6} {:>5} {:>9.2f} {:>8.2f}".format(
+                name[-24:], calls, errors, total, p95 * 1000))
+    return results
+
+
+def main():
+    args = parse_args()
+    for option in ("stream", "json"):  # Before leaving the current folder
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    scratch = None
+    if args.in_place:
+        os.chdir(ROOT)
+    else:
+        scratch = scratch_folder()
+    cogs = [c.strip() for c in args.cogs.split(",")] if args.cogs else None
+    bot, fake = offline_bot(servers=args.servers, members=args.members,
+                            channels=args.channels, latency=args.latency,
+                            cogs=cogs, prefix=args.prefix)
+    from red import start_monitoring
+    start_monitoring(bot)
+
+    rnd = random.Random(args.seed)
+    if args.stream:
+        stream = file_stream(args.stream)
+    else:
+        stream = synthetic_stream(rnd, args.messages, bot.settings.prefixes[0],
+                                  args.commands)
+
+    async def run():
+        bot.dispatch("ready")
+        await asyncio.sleep(0.5)
+        bot.command_stats.reset()
+        latencies, elapsed = await replay(bot, fake, stream, args.rate, rnd)
+        await bot.shutdown()
+        return latencies, elapsed
+
+    loop = bot.loop
+    try:
+        latencies, elapsed = loop.run_until_complete(run())
+        results = report(bot, fake, latencies, elapsed, args.rate)
+        if args.json:
+            with open(args.json, encoding='utf-8', mode="w") as f:
+                json.dump(results, f, indent=4, sort_keys=True)
+    finally:
+        stop_bot(bot)
+        os.chdir(ROOT)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("discord.ext.commands")
+
+from cogs.utils.dataIO import dataIO
+from cogs.utils.outbound import FUN, MODERATION
+from offline import handle, offline_bot, scratch_folder, stop_bot
+
+
+@pytest.fixture(scope="module")
+def offline():
+    cwd = os.getcwd()
+    scratch = scratch_folder(copy_data=False)
+    bot, fake = offline_bot(members=5, cogs=["general", "mod"])
+    yield bot, fake
+    stop_bot(bot)
+    os.chdir(cwd)
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+def command(bot, fake, content):
+    channel = sorted(bot.servers[0].channels, key=lambda c: c.position)[0]
+    content = bot.settings.prefixes[0] + content
+    bot.loop.run_until_complete(
+        handle(fake, channel.id, fake.owner["id"], content))
+
+
+def test_commands_are_recorded(offline):
+    bot, fake = offline
+    bot.command_stats.reset()
+    command(bot, fake, "ping")
+    names = [row[0] for row in bot.command_stats.summary()]
+    assert names == ["ping"]
+
+
+def sent_priorities(bot, monkeypatch):
+    priorities = []
+    submit = bot.outbound.submit
+
+    async def recorded(key, call, *, priority=None, **kwargs):
+        priorities.append(priority)
+        return await submit(key, call, priority=priority, **kwargs)
+
+    monkeypatch.setattr(bot.outbound, "submit", recorded)
+    return priorities
+
+
+def test_commands_send_with_the_priority_of_their_cog(offline, monkeypatch):
+    bot, fake = offline
+    priorities = sent_priorities(bot, monkeypatch)
+    command(bot, fake, "modset deleterepeats")
+    assert priorities == [MODERATION]
+    del priorities[:]
+    command(bot, fake, "ping")
+    assert priorities == [FUN]
+
+
+def test_mod_rebuilds_its_caches_on_refresh(offline):
+    # What dataIO calls once another shard's changes are brought in
+    bot, fake = offline
+    mod = bot.get_cog("Mod")
+    mod.blacklist_list.append("42")
+    mod.filter["1"] = ["zut"]
+    for f in ("blacklist.json", "filter.json"):
+        callback = dataIO._refreshed[dataIO._key("data/mod/" + f)]
+        result = callback()
+        if result is not None:
+            bot.loop.run_until_complete(result)
+    assert "42" in mod.blacklisted
+    assert mod.word_filters["1"].search("et zut") == "zut"
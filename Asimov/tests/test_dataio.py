@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+from cogs.utils.dataIO import DataIO, _merge, _snapshot
+
+
+@pytest.fixture
+def io(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return DataIO()
+
+
+def test_older_save_encoded_last_is_not_written(io):
+    older = io._next_save("data.json")
+    newer = io._next_save("data.json")
+    assert io._write_file("data.json", '{"version" : 2}', newer)
+    assert io._write_file("data.json", '{"version" : 1}', older)
+    with open("data.json") as f:
+        assert json.load(f) == {"version": 2}
+
+
+def test_tmp_file_left_by_a_crash_is_replaced(io):
+    with open("data-{}-0.tmp".format(os.getpid()), "w") as f:
+        f.write('{"half')
+    assert io.save_json("data.json", {"saved": True})
+    assert io.load_json("data.json") == {"saved": True}
+    assert not [f for f in os.listdir(".") if f.endswith(".tmp")]
+
+
+def test_files_changed_outside_of_dataio_are_reported(io, caplog):
+    io.save_json("data.json", {"a": 1})
+    assert io.verify_json("data.json")
+    assert sorted(os.listdir(".")) == ["data.json", "data.json.crc"]
+    with open("data.json", "w") as f:
+        json.dump({"a": 2}, f)
+    assert io.verify_json("data.json") is False
+    assert io.load_json("data.json") == {"a": 2}
+    io.load_json("data.json")
+    assert len([r for r in caplog.records if "checksum" in r.message]) == 1
+
+
+def test_snapshot_copies_dict_subclasses():
+    settings = defaultdict(dict, {"1": {"ban_mention_spam": False}})
+    snapshot = _snapshot(settings)
+    settings["2"]["ban_mention_spam"] = True
+    settings["1"]["ban_mention_spam"] = True
+    assert snapshot == {"1": {"ban_mention_spam": False}}
+
+
+def test_three_way_merge():
+    base = {"1": {"a": 1, "b": 1}, "list": [1, 2], "gone": 0}
+    ours = {"1": {"a": 2, "b": 1}, "list": [2, 3]}
+    theirs = {"1": {"a": 1, "b": 3}, "list": [1, 2, 4], "gone": 0, "2": {}}
+    assert _merge(base, ours, theirs) == {"1": {"a": 2, "b": 3},
+                                         "list": [2, 4, 3], "2": {}}
+
+
+def test_shared_saves_keep_the_changes_of_other_processes(io):
+    other = DataIO()
+    io.shared = other.shared = True
+    io.save_json("mod.json", {"blacklist": [], "servers": {}})
+    mine, theirs = io.load_json("mod.json"), other.load_json("mod.json")
+    mine["blacklist"].append("1")
+    mine["servers"]["1"] = {"filter": ["zut"]}
+    io.save_json("mod.json", mine)
+    theirs["blacklist"].append("2")
+    theirs["servers"]["2"] = {"filter": []}
+    other.save_json("mod.json", theirs)
+    expected = {"blacklist": ["1", "2"],
+                "servers": {"1": {"filter": ["zut"]}, "2": {"filter": []}}}
+    assert DataIO().load_json("mod.json") == expected
+    servers = mine["servers"]
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(io.refresh_shared())
+    loop.close()
+    assert mine == expected and mine["servers"] is servers
+
+
+def test_shared_defaultdicts_are_merged(io):
+    # Mod keeps its settings in a defaultdict
+    other = DataIO()
+    io.shared = other.shared = True
+    io.save_json("settings.json", {"1": {"x": 0}, "2": {"x": 0}})
+    mine = defaultdict(dict, io.load_json("settings.json"))
+    theirs = defaultdict(dict, other.load_json("settings.json"))
+    mine["1"]["x"] = 1
+    io.save_json("settings.json", mine)
+    theirs["2"]["x"] = 2
+    theirs["3"]["x"] = 3
+    other.save_json("settings.json", theirs)
+    expected = {"1": {"x": 1}, "2": {"x": 2}, "3": {"x": 3}}
+    assert DataIO().load_json("settings.json") == expected
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(io.refresh_shared())
+    loop.close()
+    assert mine == expected
+
+
+def test_refresh_callbacks_rebuild_derived_data(io):
+    other = DataIO()
+    io.shared = other.shared = True
+    io.save_json("blacklist.json", ["1"])
+    blacklist = io.load_json("blacklist.json")
+    blacklisted = set(blacklist)
+
+    async def rebuild():
+        blacklisted.clear()
+        blacklisted.update(blacklist)
+
+    io.on_refresh("blacklist.json", rebuild)
+    other.save_json("blacklist.json", other.load_json("blacklist.json") + ["2"])
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(io.refresh_shared())
+    loop.close()
+    assert blacklisted == {"1", "2"}
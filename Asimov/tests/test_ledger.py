@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from cogs.utils import ledger
+from cogs.utils.dataIO import dataIO
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ledger, "MAX_LEDGER_SIZE", 1000)
+    yield tmp_path
+    ledger._ledgers.clear()
+
+
+def test_save_over_the_size_limit_compacts_once(folder):
+    dataset = ledger.open_dataset("bank.json", 2)
+    dataset["1"] = {}
+    for n in range(200):
+        dataset["1"][str(n)] = n
+        dataset.save()  # No loop running: compacts synchronously
+    assert os.path.getsize("bank.ledger") <= 1000
+    assert not os.path.exists("bank.ledger.old")
+    assert dataIO.load_json("bank.json")["1"]["150"] == 150
+
+
+def test_big_ledger_is_compacted_when_opened(folder):
+    with open("bank.ledger", encoding="utf-8", mode="w") as f:
+        for n in range(100):
+            f.write('{"s":"1","k":"%d","v":%d}\n' % (n, n))
+    dataset = ledger.open_dataset("bank.json", 2)
+    assert dataset["1"]["99"] == 99
+    assert os.path.getsize("bank.ledger") == 0
+    assert dataIO.load_json("bank.json")["1"]["42"] == 42
+
+
+def test_failed_compaction_keeps_the_old_ledger(folder, monkeypatch):
+    dataset = ledger.open_dataset("bank.json", 2)
+    dataset["1"] = {"a": 1}
+    with monkeypatch.context() as patch:
+        patch.setattr(dataIO, "_atomic_save", lambda filename, data: False)
+        dataset.ledger.compact()
+    assert os.path.exists("bank.ledger.old")
+    ledger._ledgers.clear()
+    assert ledger.open_dataset("bank.json", 2)["1"]["a"] == 1
+
+
+def test_processes_sharing_a_ledger(folder, monkeypatch):
+    monkeypatch.setattr(dataIO, "shared", True)
+    first, second = ledger.Ledger("bank.json"), ledger.Ledger("bank.json")
+    for n in range(100):
+        first.set("1", str(n), n)
+        first.save()  # Compacted on the way
+        second.set("2", str(n), n)
+        second.save()
+    reopened = ledger.Ledger("bank.json")
+    assert len(reopened.data["1"]) == len(reopened.data["2"]) == 100
@@ -0,0 +1,23 @@
+from cogs.utils.sqlstore import open_dataset, close_store, db_path
+
+
+def test_bucket_assigned_back_to_its_server(tmp_path):
+    # What customcom does after changing a server's commands
+    filename = str(tmp_path / "commands.json")
+    dataset = open_dataset(filename, 2)
+    dataset["1"] = {}
+    cmdlist = dataset["1"]
+    cmdlist["hello"] = "salut"
+    cmdlist["bye"] = "au revoir"
+    dataset["1"] = cmdlist
+    dataset.save()
+    assert dataset["1"].to_json() == {"hello": "salut", "bye": "au revoir"}
+
+    cmdlist = dataset["1"]
+    del cmdlist["bye"]
+    dataset["1"] = cmdlist
+    dataset.save()
+    close_store(db_path(filename))
+    dataset = open_dataset(filename, 2)
+    assert dataset.to_json() == {"1": {"hello": "salut"}}
+    close_store(db_path(filename))
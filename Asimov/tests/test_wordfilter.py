@@ -0,0 +1,48 @@
+import asyncio
+
+from cogs.utils.wordfilter import WordFilter
+
+
+def test_long_words_are_found():
+    word_filter = WordFilter(["a" * 1500, "zut"])
+    assert word_filter.search("x" + "a" * 1600) == "a" * 1500
+    assert word_filter.search("a" * 100) is None
+    assert word_filter.search("et zut") == "zut"
+
+
+def test_words_sharing_long_prefixes():
+    words = ["a" * n + "b" for n in range(1500)]
+    word_filter = WordFilter(words)
+    text = "a" * 1200 + "b"
+    found = word_filter.search(text)
+    assert found in words and found in text
+    assert word_filter.search("a" * 50 + "b") == "a" * 50 + "b"
+    assert word_filter.search("a" * 1500) is None
+
+
+def test_words_are_searched_once_compiled():
+    loop = asyncio.new_event_loop()
+    word_filter = WordFilter(["zut"])
+    word_filter.add("flute")
+    word_filter.remove("zut")
+    assert word_filter.search("zut et flute") == "zut"
+    loop.run_until_complete(word_filter.compile_async(loop))
+    loop.close()
+    assert word_filter.search("zut et flute") == "flute"
+
+
+def test_only_the_changed_branches_are_built_again():
+    word_filter = WordFilter(["zut", "flute", "flan"])
+    zut = word_filter._root.children["z"]
+    word_filter.add("zoo")
+    word_filter.remove("flan")
+    flute = word_filter._root.children["f"].children["l"].children["u"]
+    assert flute.pattern is not None and zut.pattern is None
+    word_filter.compile()
+    expected = WordFilter(["zut", "flute", "zoo"])._regex.pattern
+    assert word_filter._regex.pattern == expected
+    for word in ["zut", "flute", "zoo"]:
+        word_filter.remove(word)
+    word_filter.compile()
+    assert not word_filter._root.children
+    assert word_filter.search("zut et flute") is None